@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:43
+
+import django.core.validators
+import shared.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='profile_picture',
+            field=models.ImageField(blank=True, default='avatars/avatars.png', storage=shared.storage.content_addressed_storage, upload_to='profile_photos/', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'heic', 'webp'])]),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.db import models
 from django.utils import timezone
 
 from shared.models import BaseModel
+from shared.storage import content_addressed_storage
 
 
 class CustomUserManager(BaseUserManager):
@@ -27,6 +28,7 @@ class CustomUser(AbstractBaseUser, BaseModel):
     last_name = models.CharField(max_length=50)
     email = models.EmailField(unique=True)
     profile_picture = models.ImageField(upload_to='profile_photos/', blank=True, default='avatars/avatars.png',
+                                      storage=content_addressed_storage,
                                       validators=[
                                           FileExtensionValidator(
                                               allowed_extensions=['jpg', 'jpeg', 'png', 'heic', 'webp', ])], )
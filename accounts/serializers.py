@@ -6,10 +6,28 @@ from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 from accounts.models import CustomUser, PasswordResetCode
+from carts.store import anonymous_cart_key, get_cart_store, user_cart_key
+from shared.serializers import DeduplicatedImageField
 
 from .tasks import send_reset_code
 
 class AccountsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # The anonymous cart to merge into the user's, see carts.store.
+    cart_token = serializers.CharField(required=False, write_only=True)
+
+    def validate_cart_token(self, value):
+        try:
+            anonymous_cart_key(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        if attrs.get('cart_token'):
+            get_cart_store().merge(anonymous_cart_key(attrs['cart_token']), user_cart_key(self.user.pk))
+        return data
+
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
@@ -18,6 +36,9 @@ class AccountsTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 
 class AccountsSerializer(serializers.ModelSerializer):
+    profile_picture = DeduplicatedImageField(
+        required=False, validators=CustomUser._meta.get_field('profile_picture').validators
+    )
 
     class Meta:
         model = CustomUser
@@ -3,6 +3,9 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from accounts.models import CustomUser
 from accounts.tasks import send_email
+from shared.storage import track_blob_references
+
+track_blob_references(CustomUser, 'profile_picture')
 
 @receiver(post_save, sender=CustomUser)
 def send_welcome_email(sender, instance, created, **kwargs):
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+from carts.reservations import reservations_enabled
+from orders.stock import InsufficientStock, available_stock
+
+UPSERT_LINES_SQL = """
+    INSERT INTO carts_cartitem (cart_id, product_id, quantity, reserved_until, created_at, updated_at)
+    SELECT %s, product_id, quantity, %s, now(), now()
+    FROM unnest(%s::bigint[], %s::integer[]) AS line (product_id, quantity)
+    ON CONFLICT (cart_id, product_id) DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        reserved_until = EXCLUDED.reserved_until,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+@transaction.atomic
+def set_cart_lines(cart, lines):
+    """
+    Apply ``{product_id: quantity}`` to the cart in one go: products with a
+    quantity are added or get it as their new quantity, products with 0 are
+    removed. One upsert, one delete and one total recomputation, however
+    many lines. With reservations on, the new quantities are reserved, all
+    of them or none: ``InsufficientStock`` is raised with the shortages.
+    """
+    Cart.lock(cart.pk)
+    # Sorted, so concurrent batches touch the item rows in the same order.
+    kept = sorted(pk for pk, quantity in lines.items() if quantity)
+    removed = [pk for pk, quantity in lines.items() if not quantity]
+
+    reserved_until = None
+    if kept and reservations_enabled():
+        available = available_stock(kept, exclude_cart=cart.pk, lock=True)
+        shortages = {pk: available.get(pk, 0) for pk in kept if available.get(pk, 0) < lines[pk]}
+        if shortages:
+            raise InsufficientStock(shortages)
+        reserved_until = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+
+    if kept:
+        with connection.cursor() as cursor:
+            cursor.execute(UPSERT_LINES_SQL, [cart.pk, reserved_until, kept, [lines[pk] for pk in kept]])
+    if removed:
+        CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+    cart.update_total_price()
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0001_initial'),
+        ('products', '0006_productcategory_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(condition=models.Q(('reserved_until__isnull', False)), fields=['product', 'reserved_until'], name='cart_items_reservation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(condition=models.Q(('reserved_until__isnull', False)), fields=['reserved_until'], name='cart_items_reserved_until_idx'),
+        ),
+    ]
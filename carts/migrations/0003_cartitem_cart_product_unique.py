@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:51
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_items(apps, schema_editor):
+    Cart = apps.get_model('carts', 'Cart')
+    CartItem = apps.get_model('carts', 'CartItem')
+    duplicated = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(items=Count('id'), last_id=Max('id'))
+        .filter(items__gt=1)
+    )
+    # The newest item is the quantity the customer set last.
+    rows = list(duplicated.values_list('cart_id', 'product_id', 'last_id'))
+    for cart_id, product_id, last_id in rows:
+        CartItem.objects.filter(cart_id=cart_id, product_id=product_id).exclude(pk=last_id).delete()
+
+    totals = (
+        CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        .annotate(total=Sum(F('quantity') * F('product__price'))).values('total')
+    )
+    Cart.objects.filter(pk__in={cart_id for cart_id, _, _ in rows}).update(
+        total_price=Coalesce(Subquery(totals), Value(Decimal('0')), output_field=models.DecimalField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0002_cartitem_reserved_until'),
+        ('products', '0010_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cart_items_cart_product_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0003_cartitem_cart_product_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+    ]
@@ -1,24 +1,89 @@
-from django.db import models
+from decimal import Decimal
 
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.models import ProductImage
+from promotions.engine import get_promotion_index, product_category_ids
 from shared.models import BaseModel
 
 
+class CartQuerySet(models.QuerySet):
+    def update_total_prices(self):
+        """
+        Recompute the carts' ``total_price`` and ``discount`` at the current
+        prices. Without active promotions this is one aggregate UPDATE. With
+        them the items are read once, priced in one pass against the
+        compiled promotions and written back in one UPDATE.
+
+        Totals are recomputed rather than adjusted by each item's change: a
+        running total drifts once a price changes between adding and
+        removing an item.
+        """
+        promotions = get_promotion_index()
+        if not promotions:
+            totals = (
+                CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+                .annotate(total=Sum(F('quantity') * F('product__price'))).values('total')
+            )
+            return self.update(
+                total_price=Coalesce(Subquery(totals), Value(Decimal('0')), output_field=models.DecimalField()),
+                discount=Value(Decimal('0')),
+            )
+
+        cart_ids = list(self.values_list('pk', flat=True))
+        if not cart_ids:
+            return 0
+        items = list(
+            CartItem.objects.filter(cart_id__in=cart_ids).order_by()
+            .values_list('cart_id', 'product_id', 'quantity', 'product__price')
+        )
+        categories = {}
+        if promotions.by_category:
+            categories = product_category_ids({product_id for _, product_id, _, _ in items})
+
+        totals = dict.fromkeys(cart_ids, Decimal('0'))
+        discounts = dict.fromkeys(cart_ids, Decimal('0'))
+        for cart_id, product_id, quantity, price in items:
+            discount = promotions.discount(product_id, quantity, price, categories.get(product_id, ()))
+            totals[cart_id] += price * quantity - discount
+            discounts[cart_id] += discount
+        return Cart.objects.filter(pk__in=cart_ids).update(
+            total_price=Case(*(When(pk=pk, then=Value(total)) for pk, total in totals.items()),
+                             output_field=models.DecimalField()),
+            discount=Case(*(When(pk=pk, then=Value(discount)) for pk, discount in discounts.items()),
+                          output_field=models.DecimalField()),
+        )
+
+
 class Cart(BaseModel):
     user = models.OneToOneField('accounts.CustomUser', on_delete=models.CASCADE, related_name='cart')
     is_ordered = models.BooleanField(default=False)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Taken off by promotions, already deducted from total_price.
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
+    objects = CartQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.email}'s cart"
 
-    @property
-    def get_total_price(self):
-        total = sum(item.product.price * item.quantity for item in self.items.all())
-        return round(total, 2)
+    @staticmethod
+    def lock(cart_id):
+        """
+        Lock a cart's row before changing its items. Item writers take turns,
+        and each one's total is computed from a snapshot that already
+        includes the items committed before it.
+        """
+        Cart.objects.filter(pk=cart_id).select_for_update(no_key=True).values_list('pk').first()
 
     def update_total_price(self):
-        self.total_price = self.get_total_price
-        self.save(update_fields=["total_price"])
+        """Recompute ``total_price`` and ``discount`` in the database, see ``CartQuerySet.update_total_prices``."""
+        Cart.objects.filter(pk=self.pk).update_total_prices()
+        self.refresh_from_db(fields=['total_price', 'discount'])
+
     class Meta:
         db_table = 'carts'
         verbose_name = 'cart'
@@ -26,18 +91,64 @@ class Cart(BaseModel):
         ordering = ['-created_at']
 
 
+class CartItemQuerySet(models.QuerySet):
+    def live_reservations(self):
+        return self.filter(reserved_until__gt=timezone.now())
+
+    def reserved_quantities(self, product_ids, exclude_cart=None):
+        """
+        ``{product_id: quantity}`` held by live reservations. Reads only the
+        reserved items of these products through the reservation index.
+        """
+        items = self.live_reservations().filter(product_id__in=product_ids)
+        if exclude_cart is not None:
+            items = items.exclude(cart=exclude_cart)
+        rows = items.order_by().values('product_id').annotate(quantity=Sum('quantity'))
+        return {row['product_id']: row['quantity'] for row in rows}
+
+    def with_product_thumbnails(self):
+        """Annotate the ``image`` and ``variants`` of each item's product's first image."""
+        images = ProductImage.objects.filter(product=OuterRef('product_id')).order_by('id')
+        return self.annotate(
+            thumbnail_image=Subquery(images.values('image')[:1]),
+            thumbnail_variants=Subquery(images.values('variants')[:1]),
+        )
+
+
 class CartItem(BaseModel):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # Set while the item's quantity is held back from other buyers, see
+    # carts.reservations.
+    reserved_until = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = CartItemQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.cart.user.email} - {self.product.name} ({self.quantity})"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.cart.update_total_price()
+        with transaction.atomic():
+            Cart.lock(self.cart_id)
+            super().save(*args, **kwargs)
+            self.cart.update_total_price()
 
     def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        self.cart.update_total_price()
+        with transaction.atomic():
+            Cart.lock(self.cart_id)
+            result = super().delete(*args, **kwargs)
+            self.cart.update_total_price()
+        return result
+
+    class Meta:
+        constraints = [
+            # One line per product; carts.lines upserts against it.
+            models.UniqueConstraint(fields=['cart', 'product'], name='cart_items_cart_product_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'reserved_until'], condition=Q(reserved_until__isnull=False),
+                         name='cart_items_reservation_idx'),
+            models.Index(fields=['reserved_until'], condition=Q(reserved_until__isnull=False),
+                         name='cart_items_reserved_until_idx'),
+        ]
@@ -5,7 +5,8 @@ from rest_framework.permissions import (SAFE_METHODS, BasePermission,
 class IsOwnerOrAdmin(BasePermission):
 
     def has_object_permission(self, request, view, obj):
-        return request.user.is_staff or obj.user == request.user
+        # user_id, so the owner is not fetched just to compare it.
+        return request.user.is_staff or obj.user_id == request.user.pk
 
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated)
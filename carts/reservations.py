@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+from orders.stock import InsufficientStock, available_stock
+
+
+def reservations_enabled():
+    return settings.CART_RESERVATION_TTL > 0
+
+
+def add_cart_item(cart, product, quantity):
+    """
+    Put ``quantity`` of ``product`` in the cart, replacing the quantity of an
+    item already there, and reserve it when reservations are on. Must run in
+    a transaction. Returns ``(item, created)``.
+
+    Rows are locked cart, then product, then item, the order
+    ``set_cart_lines`` and checkout take them in, so concurrent writers
+    queue up instead of deadlocking.
+    """
+    Cart.lock(cart.pk)
+    reserved_until = None
+    if reservations_enabled():
+        reserved_until = reserve_product(cart.pk, product.pk, quantity)
+
+    item, created = CartItem.objects.get_or_create(
+        cart=cart, product=product, defaults={'quantity': quantity, 'reserved_until': reserved_until}
+    )
+    if not created and item.quantity != quantity:
+        item.quantity = quantity
+        item.reserved_until = reserved_until
+        item.save()
+    elif not created and reserved_until is not None:
+        item.reserved_until = reserved_until
+        # update() keeps CartItem.save() from recomputing the cart total.
+        CartItem.objects.filter(pk=item.pk).update(reserved_until=reserved_until)
+    return item, created
+
+
+def release_cart_reservations(cart, product_ids):
+    CartItem.objects.filter(cart=cart, product_id__in=product_ids, reserved_until__isnull=False).update(
+        reserved_until=None
+    )
+
+
+def reserve_product(cart_id, product_id, quantity):
+    """
+    Lock the product and return until when ``quantity`` of it can be held
+    for the cart, ``CART_RESERVATION_TTL`` seconds from now. Raises
+    ``InsufficientStock`` when other carts and the stock leave less than
+    that. Must run in a transaction.
+    """
+    available = available_stock([product_id], exclude_cart=cart_id, lock=True).get(product_id, 0)
+    if available < quantity:
+        raise InsufficientStock({product_id: available})
+    return timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+
+
+def release_expired_reservations(batch_size=500):
+    """
+    Clear expired reservations in batches, one short transaction each.
+    ``skip_locked`` lets several sweepers share the backlog without waiting
+    on each other. Returns the number of reservations released.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = (
+                CartItem.objects.filter(reserved_until__lte=timezone.now())
+                .order_by('reserved_until')
+                .select_for_update(skip_locked=True)
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            batch = list(expired)
+            if batch:
+                CartItem.objects.filter(pk__in=batch).update(reserved_until=None)
+        released += len(batch)
+        if len(batch) < batch_size:
+            return released
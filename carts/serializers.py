@@ -1,28 +1,157 @@
+from django.db.models import Count, Prefetch
 from rest_framework import serializers
 
 from carts.models import Cart, CartItem
+from products.images import thumbnail_url
 from products.models import Product
 from products.serializers import ProductSerializer
+from promotions.engine import get_promotion_index, product_category_ids
+from shared.serializers import FieldSelection, SparseFieldsMixin
 
 
-class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class CartProductSerializer(SparseFieldsMixin, serializers.Serializer):
+    """
+    The slim product snapshot of a cart item, read from the item itself: the
+    product's columns come with it and the thumbnail from the annotations of
+    ``CartItemQuerySet.with_product_thumbnails``.
+    """
+    id = serializers.IntegerField(source='product_id')
+    name = serializers.CharField(source='product.name')
+    price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2)
+    thumbnail = serializers.SerializerMethodField()
+
+    def get_thumbnail(self, obj):
+        if not hasattr(obj, 'thumbnail_image'):
+            image = obj.product.images.order_by('id').values('image', 'variants').first() or {}
+            obj.thumbnail_image, obj.thumbnail_variants = image.get('image'), image.get('variants')
+        return thumbnail_url(obj.thumbnail_image, obj.thumbnail_variants, self.context.get('request'))
+
+
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product = CartProductSerializer(source='*', read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), write_only=True, source='product')
 
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'product_id', 'quantity']
 
-class CartSerializer(serializers.ModelSerializer):
+    expandable_fields = {
+        'product': (ProductSerializer, {}),
+    }
+
+    @classmethod
+    def get_prefetch_plan(cls, prefix='', selection=None):
+        selection = selection or FieldSelection()
+        if not selection.expands('product'):
+            return []
+        return ProductSerializer.get_prefetch_plan(prefix=f'{prefix}product__', selection=selection.nested('product'))
+
+
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    # 0 removes the product from the cart.
+    quantity = serializers.IntegerField(min_value=0)
+
+
+class CartLinesSerializer(serializers.Serializer):
+    lines = CartLineSerializer(many=True, allow_empty=False)
+
+    def validate_lines(self, value):
+        seen = set()
+        errors = []
+        for line in value:
+            errors.append({'product_id': ['Duplicate product.']} if line['product_id'] in seen else {})
+            seen.add(line['product_id'])
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        # Removing a product that no longer exists is a no-op, not an error.
+        added = {line['product_id'] for line in value if line['quantity']}
+        existing = set(Product.objects.filter(pk__in=added).values_list('pk', flat=True))
+        if added - existing:
+            raise serializers.ValidationError([
+                {'product_id': [f'Invalid pk "{line["product_id"]}" - object does not exist.']}
+                if line['quantity'] and line['product_id'] not in existing else {}
+                for line in value
+            ])
+        return value
+
+
+class LiveCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    name = serializers.CharField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    quantity = serializers.IntegerField()
+
+
+class LiveCartSerializer(serializers.Serializer):
+    """A cart from the cart store, priced at the current prices and promotions."""
+    token = serializers.CharField(required=False)
+    items = LiveCartItemSerializer(many=True)
+    discount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    total_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+    @classmethod
+    def from_lines(cls, lines, token=None):
+        products = Product.objects.filter(pk__in=lines).order_by('pk').values_list('pk', 'name', 'price')
+        items = [
+            {'product_id': pk, 'name': name, 'price': price, 'quantity': lines[pk]}
+            for pk, name, price in products
+        ]
+        promotions = get_promotion_index()
+        categories = product_category_ids(lines) if promotions.by_category else {}
+        subtotal, discount = promotions.price(
+            (item['product_id'], item['quantity'], item['price'], categories.get(item['product_id'], ()))
+            for item in items
+        )
+        cart = {'items': items, 'discount': discount, 'total_price': subtotal - discount}
+        if token is not None:
+            cart['token'] = token
+        return cls(cart)
+
+
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     product_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ('id', 'user', 'items', 'total_price', 'is_ordered', 'product_count')
+        fields = ('id', 'user', 'items', 'discount', 'total_price', 'is_ordered', 'product_count')
         extra_kwargs = {
             'total_price': {'read_only': True},
         }
 
+    @classmethod
+    def get_prefetch_plan(cls, prefix='', selection=None):
+        """
+        The items with their product in one query, and for the slim product
+        its thumbnail too, so a cart reads in a fixed number of queries
+        however many items it has.
+        """
+        selection = selection or FieldSelection()
+        if not selection.includes('items'):
+            return []
+        item_selection = selection.nested('items')
+        items = CartItem.objects.prefetch_related(
+            *CartItemSerializer.get_prefetch_plan(selection=item_selection)
+        ).order_by('id')
+        if item_selection.includes('product'):
+            items = items.select_related('product')
+            if not item_selection.expands('product'):
+                items = items.only('cart', 'quantity', 'product__name', 'product__price')
+                if item_selection.nested('product').includes('thumbnail'):
+                    items = items.with_product_thumbnails()
+        return [Prefetch(f'{prefix}items', queryset=items)]
+
+    @staticmethod
+    def annotate_queryset(queryset, selection=None):
+        """Add the columns the serializer reads from annotations, e.g. ``product_count``."""
+        selection = selection or FieldSelection()
+        if selection.includes('product_count'):
+            queryset = queryset.annotate(product_count=Count('items'))
+        return queryset
+
     def get_product_count(self, obj):
+        if hasattr(obj, 'product_count'):
+            return obj.product_count
         return obj.items.count()
@@ -0,0 +1,305 @@
+"""
+Where live carts are kept, chosen with the ``CART_STORE`` setting.
+
+``DatabaseCartStore`` writes every change straight to ``Cart``/``CartItem``.
+``CacheCartStore`` keeps carts in the cache and writes them behind: each
+change is a cache write plus, the first time a flushed cart changes again,
+an entry in a journal of carts waiting to be flushed. ``flush_pending``
+persists the journal in batches, and a cart is flushed on its own at
+checkout.
+
+Crash safety: a cart lives in the cache until it is flushed, so changes made
+since the last flush are lost with the cache, at most ``CART_FLUSH_INTERVAL``
+seconds of them with a cache that survives restarts (e.g. Redis with AOF).
+A flush replaces the stored cart with a snapshot read while the cart's row
+is locked, so flushes are idempotent and never let an older snapshot win
+over a newer one. Journal entries that are lost or were never written are
+waited for one run and then skipped; their carts are flushed again on
+their next change.
+
+Anonymous carts, keyed by a token the client holds, have no row to be
+flushed to and live in the cache with either store. They are merged into
+the user's cart on login.
+
+Code that changes a user's ``CartItem`` rows itself, like the
+``/carts/<id>/`` endpoints, does so inside ``store.writing(cart)``: the
+cached cart is flushed before the change and reloaded after it, so neither
+the cache nor the next flush undoes it.
+
+Stock reservations (``CART_RESERVATION_TTL``) are only made by
+``DatabaseCartStore``; with ``CacheCartStore`` stock is checked at checkout.
+"""
+import re
+import secrets
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from carts.lines import set_cart_lines
+from carts.models import Cart, CartItem
+from orders.stock import InsufficientStock
+
+CART_TOKEN_RE = re.compile(r'[A-Za-z0-9_-]{16,64}')
+
+JOURNAL_SEQUENCE_KEY = 'carts:journal:sequence'
+JOURNAL_CURSOR_KEY = 'carts:journal:cursor'
+JOURNAL_STALLED_KEY = 'carts:journal:stalled'
+
+# Seconds a writer may hold a cart's cache lock before others take over.
+LOCK_TIMEOUT = 5
+
+DELETE_REMOVED_ITEMS_SQL = """
+    DELETE FROM carts_cartitem item
+    WHERE item.cart_id = ANY(%s) AND NOT EXISTS (
+        SELECT 1 FROM unnest(%s::bigint[], %s::bigint[]) AS line (cart_id, product_id)
+        WHERE line.cart_id = item.cart_id AND line.product_id = item.product_id
+    )
+"""
+
+# Products deleted since they were put in the cart are left out.
+UPSERT_ITEMS_SQL = """
+    INSERT INTO carts_cartitem (cart_id, product_id, quantity, created_at, updated_at)
+    SELECT line.cart_id, line.product_id, line.quantity, now(), now()
+    FROM unnest(%s::bigint[], %s::bigint[], %s::integer[]) AS line (cart_id, product_id, quantity)
+    JOIN products ON products.id = line.product_id
+    ON CONFLICT (cart_id, product_id) DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        updated_at = EXCLUDED.updated_at
+    WHERE carts_cartitem.quantity <> EXCLUDED.quantity
+"""
+
+
+def get_cart_store():
+    return import_string(settings.CART_STORE)()
+
+
+def new_cart_token():
+    return secrets.token_urlsafe(24)
+
+
+def user_cart_key(user_id):
+    return f'user:{user_id}'
+
+
+def anonymous_cart_key(token):
+    if not CART_TOKEN_RE.fullmatch(token or ''):
+        raise ValueError('Invalid cart token.')
+    return f'anonymous:{token}'
+
+
+def _user_id(key):
+    kind, _, value = key.partition(':')
+    return int(value) if kind == 'user' else None
+
+
+def _lines_key(key):
+    return f'carts:lines:{key}'
+
+
+def _dirty_key(key):
+    return f'carts:dirty:{key}'
+
+
+def _journal_key(position):
+    return f'carts:journal:{position}'
+
+
+def _apply(lines, changes):
+    for product_id, quantity in changes.items():
+        if quantity:
+            lines[product_id] = quantity
+        else:
+            lines.pop(product_id, None)
+    return lines
+
+
+class CacheCartStore:
+    """Live carts in the cache, flushed to the database in batches and at checkout."""
+
+    def get_lines(self, key):
+        """``{product_id: quantity}`` of the cart, read through from the database for users' carts."""
+        lines = cache.get(_lines_key(key))
+        if lines is None:
+            lines = self._load(key)
+            # add(), so a change written meanwhile is not overwritten.
+            cache.add(_lines_key(key), lines, timeout=settings.CART_CACHE_TIMEOUT)
+        return lines
+
+    def set_lines(self, key, changes):
+        """
+        Apply ``{product_id: quantity}`` to the cart, 0 removing the product,
+        and return the cart's lines. Nothing is written to the database.
+        """
+        with self._locked(key):
+            lines = _apply(self.get_lines(key), changes)
+            cache.set(_lines_key(key), lines, timeout=settings.CART_CACHE_TIMEOUT)
+        if _user_id(key) is not None and cache.add(_dirty_key(key), True, timeout=settings.CART_CACHE_TIMEOUT):
+            self._journal(key)
+        return lines
+
+    def delete(self, key):
+        cache.delete(_lines_key(key))
+
+    def merge(self, source, target):
+        """Move the lines of cart ``source`` into ``target``; ``source``'s quantities win."""
+        lines = self.get_lines(source)
+        if lines:
+            self.set_lines(target, lines)
+        self.delete(source)
+
+    @contextmanager
+    def writing(self, cart):
+        """
+        Wrap a change made straight to a stored cart's items, which must
+        commit inside the block. The cached cart is flushed first, so the
+        change applies on top of it, and replaced with the stored one after.
+        """
+        key = user_cart_key(cart.user_id)
+        with self._locked(key):
+            self.flush([key])
+            yield
+            cache.set(_lines_key(key), self._load(key), timeout=settings.CART_CACHE_TIMEOUT)
+
+    def flush(self, keys):
+        """
+        Replace the stored users' carts with their cached ones: one upsert,
+        one delete and one total recomputation for the whole batch.
+        """
+        user_ids = sorted({_user_id(key) for key in keys} - {None})
+        if not user_ids:
+            return
+        with transaction.atomic():
+            Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+            # Snapshots are read under the row locks, so a flush always
+            # stores a cart at least as new as the flush before it.
+            carts = dict(
+                Cart.objects.filter(user_id__in=user_ids).order_by('pk').select_for_update(no_key=True)
+                .values_list('user_id', 'pk')
+            )
+            keys = {user_cart_key(user_id): carts[user_id] for user_id in user_ids}
+            cache.delete_many([_dirty_key(key) for key in keys])
+            snapshots = cache.get_many([_lines_key(key) for key in keys])
+
+            # A cart no longer in the cache keeps what was stored for it.
+            cart_ids = []
+            line_carts, line_products, line_quantities = [], [], []
+            for key, cart_id in keys.items():
+                lines = snapshots.get(_lines_key(key))
+                if lines is None:
+                    continue
+                cart_ids.append(cart_id)
+                for product_id, quantity in sorted(lines.items()):
+                    line_carts.append(cart_id)
+                    line_products.append(product_id)
+                    line_quantities.append(quantity)
+            if not cart_ids:
+                return
+            with connection.cursor() as cursor:
+                cursor.execute(DELETE_REMOVED_ITEMS_SQL, [cart_ids, line_carts, line_products])
+                if line_carts:
+                    cursor.execute(UPSERT_ITEMS_SQL, [line_carts, line_products, line_quantities])
+            Cart.objects.filter(pk__in=cart_ids).update_total_prices()
+
+    def flush_pending(self, batch_size=500):
+        """Flush the carts in the journal, ``batch_size`` entries at a time. Returns the number of carts flushed."""
+        flushed = 0
+        while True:
+            cursor = cache.get(JOURNAL_CURSOR_KEY, 0)
+            end = min(cache.get(JOURNAL_SEQUENCE_KEY, 0), cursor + batch_size)
+            if end <= cursor:
+                return flushed
+            positions = range(cursor + 1, end + 1)
+            entries = cache.get_many([_journal_key(position) for position in positions])
+
+            keys = set()
+            stalled = False
+            for position in positions:
+                key = entries.get(_journal_key(position))
+                # Taken but not written yet, or lost: wait for it one run.
+                if key is None and cache.get(JOURNAL_STALLED_KEY) != position:
+                    cache.set(JOURNAL_STALLED_KEY, position, timeout=None)
+                    stalled = True
+                    break
+                if key is not None:
+                    keys.add(key)
+                end = position
+            if end == cursor:
+                return flushed
+
+            self.flush(keys)
+            cache.set(JOURNAL_CURSOR_KEY, end, timeout=None)
+            cache.delete_many([_journal_key(position) for position in range(cursor + 1, end + 1)])
+            flushed += len(keys)
+            if stalled:
+                return flushed
+
+    def _load(self, key):
+        user_id = _user_id(key)
+        if user_id is None:
+            return {}
+        items = CartItem.objects.filter(cart__user_id=user_id).values_list('product_id', 'quantity')
+        return dict(items)
+
+    def _journal(self, key):
+        cache.add(JOURNAL_SEQUENCE_KEY, 0, timeout=None)
+        position = cache.incr(JOURNAL_SEQUENCE_KEY)
+        cache.set(_journal_key(position), key, timeout=settings.CART_CACHE_TIMEOUT)
+
+    @contextmanager
+    def _locked(self, key):
+        """Serialize the read-modify-write of a cached cart, e.g. between a shopper's tabs."""
+        lock_key = f'carts:lock:{key}'
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not cache.add(lock_key, True, timeout=LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                # The holder died without releasing it.
+                cache.set(lock_key, True, timeout=LOCK_TIMEOUT)
+                break
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            cache.delete(lock_key)
+
+
+class DatabaseCartStore(CacheCartStore):
+    """Users' carts written straight to the database, reserving stock when reservations are on."""
+
+    def get_lines(self, key):
+        if _user_id(key) is None:
+            return super().get_lines(key)
+        return self._load(key)
+
+    def set_lines(self, key, changes):
+        user_id = _user_id(key)
+        if user_id is None:
+            return super().set_lines(key, changes)
+        cart, _ = Cart.objects.get_or_create(user_id=user_id)
+        set_cart_lines(cart, changes)
+        return self._load(key)
+
+    def merge(self, source, target):
+        # What cannot be reserved any more is merged at what is left of it.
+        lines = self.get_lines(source)
+        while lines:
+            try:
+                self.set_lines(target, lines)
+                break
+            except InsufficientStock as exc:
+                lines.update({pk: max(available, 0) for pk, available in exc.shortages.items()})
+        self.delete(source)
+
+    @contextmanager
+    def writing(self, cart):
+        # Users' carts are not cached.
+        yield
+
+    def flush(self, keys):
+        """Users' carts are already stored."""
+
+    def flush_pending(self, batch_size=500):
+        return 0
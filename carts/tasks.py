@@ -0,0 +1,13 @@
+from carts.reservations import release_expired_reservations
+from carts.store import get_cart_store
+from config.celery import app
+
+
+@app.task
+def release_expired_cart_reservations(batch_size=500):
+    return release_expired_reservations(batch_size=batch_size)
+
+
+@app.task
+def flush_cached_carts(batch_size=500):
+    return get_cart_store().flush_pending(batch_size=batch_size)
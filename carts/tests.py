@@ -1,3 +1,428 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from accounts.models import CustomUser
+from carts.models import Cart, CartItem
+from carts.reservations import release_expired_reservations
+from carts.store import JOURNAL_SEQUENCE_KEY, CacheCartStore
+from orders.stock import available_stock
+from products.models import Product, ProductImage
+
+
+@override_settings(CART_RESERVATION_TTL=600)
+class CartReservationTestCase(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@gmail.com', password='testpass123')
+        self.other_user = CustomUser.objects.create_user(email='other@gmail.com', password='otherpass123')
+        self.cart = Cart.objects.create(user=self.user)
+        self.other_cart = Cart.objects.create(user=self.other_user)
+        self.lamp = Product.objects.create(name='Lamp', price=10, description='Lamp', count=3)
+
+    def add(self, user, cart, quantity):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('carts-items', args=[cart.pk]), {
+            'product_id': self.lamp.pk, 'quantity': quantity,
+        }, format='json')
+
+    def order(self, user, quantity):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('orders-list'), {
+            'order_items': [{'product': self.lamp.pk, 'quantity': quantity}]
+        }, format='json')
+
+    def test_adding_an_item_reserves_it(self):
+        response = self.add(self.user, self.cart, 2)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        item = CartItem.objects.get(cart=self.cart)
+        self.assertGreater(item.reserved_until, timezone.now())
+        self.assertEqual(available_stock([self.lamp.pk]), {self.lamp.pk: 1})
+        # The physical stock only changes when an order is placed.
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 3)
+
+    def test_reservation_holds_stock_back_from_other_buyers(self):
+        self.add(self.user, self.cart, 2)
+
+        response = self.add(self.other_user, self.other_cart, 2)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['quantity'], ['Only 1 available.'])
+
+        response = self.order(self.other_user, 2)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['order_items'][0]['quantity'], ['Only 1 left in stock.'])
+
+    def test_owner_can_order_their_reserved_stock(self):
+        self.add(self.user, self.cart, 2)
+        self.add(self.other_user, self.other_cart, 1)
+
+        response = self.order(self.user, 2)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 1)
+        self.assertIsNone(CartItem.objects.get(cart=self.cart).reserved_until)
+        self.assertEqual(available_stock([self.lamp.pk], exclude_cart=self.other_cart), {self.lamp.pk: 1})
+
+    def test_changing_the_quantity_refreshes_the_reservation(self):
+        self.add(self.user, self.cart, 1)
+
+        response = self.add(self.user, self.cart, 3)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 3)
+        self.assertEqual(available_stock([self.lamp.pk]), {self.lamp.pk: 0})
+
+    def test_sweeper_releases_expired_reservations(self):
+        self.add(self.user, self.cart, 2)
+        self.add(self.other_user, self.other_cart, 1)
+        CartItem.objects.filter(cart=self.cart).update(reserved_until=timezone.now() - timedelta(seconds=1))
+
+        # An expired reservation no longer counts, even before the sweep.
+        self.assertEqual(available_stock([self.lamp.pk]), {self.lamp.pk: 2})
+        self.assertEqual(release_expired_reservations(batch_size=1), 1)
+
+        self.assertIsNone(CartItem.objects.get(cart=self.cart).reserved_until)
+        self.assertIsNotNone(CartItem.objects.get(cart=self.other_cart).reserved_until)
+
+    def test_product_is_locked_before_the_item(self):
+        self.add(self.user, self.cart, 1)
+        with CaptureQueriesContext(connection) as context:
+            self.add(self.user, self.cart, 2)
+
+        sql = [query['sql'] for query in context.captured_queries]
+        cart_lock, product_lock = [i for i, query in enumerate(sql) if query.endswith('FOR NO KEY UPDATE')][:2]
+        item_read = next(i for i, query in enumerate(sql) if 'AND "carts_cartitem"."product_id" = ' in query)
+        self.assertIn('FROM "carts"', sql[cart_lock])
+        self.assertIn('FROM "products"', sql[product_lock])
+        self.assertLess(cart_lock, product_lock)
+        self.assertLess(product_lock, item_read)
+
+    @override_settings(CART_RESERVATION_TTL=0)
+    def test_reservations_can_be_turned_off(self):
+        response = self.add(self.user, self.cart, 3)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(CartItem.objects.get(cart=self.cart).reserved_until)
+        self.assertEqual(self.order(self.other_user, 3).status_code, status.HTTP_201_CREATED)
+
+
+class CartTotalTestCase(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@gmail.com', password='testpass123')
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price=Decimal('2.50') * (i + 1), description='Product')
+            for i in range(5)
+        ]
+
+    def test_total_follows_item_changes(self):
+        items = [CartItem.objects.create(cart=self.cart, product=product, quantity=2) for product in self.products]
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('75.00'))
+
+        items[0].quantity = 4
+        items[0].save()
+        items[-1].delete()
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('55.00'))
+
+    def test_total_is_one_aggregate_however_many_items(self):
+        for product in self.products:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+        item = CartItem.objects.select_related('cart').get(cart=self.cart, product=self.products[0])
+
+        item.quantity = 3
+        with CaptureQueriesContext(connection) as context:
+            item.save()
+
+        product_queries = [query['sql'] for query in context.captured_queries if '"products"' in query['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertTrue(product_queries[0].startswith('UPDATE "carts"'))
+
+
+class CartTotalConcurrencyTestCase(TransactionTestCase):
+    def test_concurrent_adds_keep_the_total_right(self):
+        user = CustomUser.objects.create_user(email='user@gmail.com', password='testpass123')
+        cart = Cart.objects.create(user=user)
+        products = [
+            Product.objects.create(name=f'Product {i}', price=Decimal('1.25') * (i + 1), description='Product')
+            for i in range(8)
+        ]
+        start = threading.Barrier(len(products))
+        errors = []
+
+        def add(product):
+            try:
+                start.wait()
+                CartItem.objects.create(cart_id=cart.pk, product=product, quantity=3)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add, args=(product,)) for product in products]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_price, sum(product.price * 3 for product in products))
+
+
+class CartLinesTestCase(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@gmail.com', password='testpass123')
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price=Decimal('2.00') * (i + 1), description='Product', count=5)
+            for i in range(10)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def set_lines(self, lines):
+        return self.client.post(reverse('carts-lines', args=[self.cart.pk]), {
+            'lines': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in lines],
+        }, format='json')
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def test_batch_adds_changes_and_removes_lines(self):
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+
+        response = self.set_lines([(self.products[0], 3), (self.products[1], 0), (self.products[2], 2)])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantities(), {self.products[0].pk: 3, self.products[2].pk: 2})
+        self.assertEqual(response.data['total_price'], '18.00')
+        self.assertEqual(len(response.data['items']), 2)
+
+    @override_settings(CART_RESERVATION_TTL=0)
+    def test_statements_do_not_grow_with_the_batch(self):
+        with CaptureQueriesContext(connection) as context:
+            self.set_lines([(product, 1) for product in self.products])
+
+        statements = [query['sql'].strip() for query in context.captured_queries]
+        writes = [sql for sql in statements if sql.startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(writes[0].startswith('INSERT INTO carts_cartitem'))
+        self.assertTrue(writes[1].startswith('UPDATE "carts"'))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('110.00'))
+
+    @override_settings(CART_RESERVATION_TTL=600)
+    def test_batch_is_reserved_all_or_nothing(self):
+        response = self.set_lines([(self.products[0], 2), (self.products[1], 6)])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['lines'], [{}, {'quantity': ['Only 5 available.']}])
+        self.assertEqual(self.quantities(), {})
+
+        self.set_lines([(self.products[0], 2), (self.products[1], 5)])
+        self.assertEqual(available_stock([self.products[0].pk, self.products[1].pk]),
+                         {self.products[0].pk: 3, self.products[1].pk: 0})
+
+    def test_invalid_lines_are_rejected(self):
+        response = self.client.post(reverse('carts-lines', args=[self.cart.pk]), {'lines': [
+            {'product_id': self.products[0].pk, 'quantity': 1},
+            {'product_id': self.products[0].pk, 'quantity': 2},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['lines'], [{}, {'product_id': ['Duplicate product.']}])
+
+        response = self.client.post(reverse('carts-lines', args=[self.cart.pk]), {'lines': [
+            {'product_id': 999999, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.quantities(), {})
+
+
+@override_settings(CART_STORE='carts.store.CacheCartStore')
+class CartStoreTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            CustomUser.objects.create_user(email=f'user{i}@gmail.com', password='testpass123') for i in range(3)
+        ]
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price=Decimal('3.00') * (i + 1), description='Product', count=5)
+            for i in range(4)
+        ]
+
+    def set_lines(self, lines, user=None, token=None):
+        self.client.force_authenticate(user=user)
+        headers = {'X-Cart-Token': token} if token else {}
+        return self.client.post(reverse('current-cart'), {
+            'lines': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in lines],
+        }, format='json', headers=headers)
+
+    def stored(self, user):
+        return dict(CartItem.objects.filter(cart__user=user).values_list('product_id', 'quantity'))
+
+    def test_anonymous_cart_lives_in_the_cache(self):
+        response = self.set_lines([(self.products[0], 2)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = response.data['token']
+
+        response = self.set_lines([(self.products[1], 1)], token=token)
+        self.assertEqual(response.data['token'], token)
+
+        response = self.client.get(reverse('current-cart'), headers={'X-Cart-Token': token})
+        self.assertEqual([item['product_id'] for item in response.data['items']],
+                         [self.products[0].pk, self.products[1].pk])
+        self.assertEqual(response.data['total_price'], '12.00')
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_user_carts_are_written_behind_in_batches(self):
+        for user in self.users:
+            self.set_lines([(self.products[0], 1), (self.products[1], 2)], user=user)
+        self.set_lines([(self.products[1], 0), (self.products[2], 3)], user=self.users[0])
+        self.assertFalse(CartItem.objects.exists())
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(CacheCartStore().flush_pending(), 3)
+        writes = [query['sql'] for query in context.captured_queries
+                  if query['sql'].strip().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 4)
+
+        self.assertEqual(self.stored(self.users[0]), {self.products[0].pk: 1, self.products[2].pk: 3})
+        self.assertEqual(self.stored(self.users[1]), {self.products[0].pk: 1, self.products[1].pk: 2})
+        self.assertEqual(Cart.objects.get(user=self.users[0]).total_price, Decimal('30.00'))
+        self.assertEqual(CacheCartStore().flush_pending(), 0)
+
+        self.set_lines([(self.products[0], 0)], user=self.users[1])
+        self.assertEqual(CacheCartStore().flush_pending(), 1)
+        self.assertEqual(self.stored(self.users[1]), {self.products[1].pk: 2})
+
+    def test_lost_journal_entries_are_skipped_after_one_run(self):
+        self.set_lines([(self.products[0], 1)], user=self.users[0])
+        cache.incr(JOURNAL_SEQUENCE_KEY)
+        self.set_lines([(self.products[0], 1)], user=self.users[1])
+
+        self.assertEqual(CacheCartStore().flush_pending(), 1)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.users[1]).exists())
+        self.assertEqual(CacheCartStore().flush_pending(), 1)
+        self.assertEqual(self.stored(self.users[1]), {self.products[0].pk: 1})
+
+    def test_checkout_flushes_the_cart(self):
+        self.set_lines([(self.products[0], 2)], user=self.users[0])
+
+        response = self.client.post(reverse('orders-list'), {
+            'order_items': [{'product': self.products[1].pk, 'quantity': 1}]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stored(self.users[0]), {self.products[0].pk: 2})
+
+    def test_cart_endpoints_and_the_live_cart_stay_in_step(self):
+        user = self.users[0]
+        self.set_lines([(self.products[0], 2), (self.products[1], 1)], user=user)
+        cart = Cart.objects.create(user=user)
+
+        self.client.post(reverse('carts-items', args=[cart.pk]), {'product_id': self.products[2].pk, 'quantity': 3},
+                         format='json')
+        self.client.post(reverse('carts-lines', args=[cart.pk]), {'lines': [
+            {'product_id': self.products[1].pk, 'quantity': 0},
+        ]}, format='json')
+        expected = {self.products[0].pk: 2, self.products[2].pk: 3}
+        self.assertEqual(self.stored(user), expected)
+
+        items = self.client.get(reverse('current-cart')).data['items']
+        self.assertEqual({item['product_id']: item['quantity'] for item in items}, expected)
+        self.set_lines([(self.products[3], 1)], user=user)
+        CacheCartStore().flush_pending()
+        self.assertEqual(self.stored(user), {**expected, self.products[3].pk: 1})
+
+    def test_login_merges_the_anonymous_cart(self):
+        token = self.set_lines([(self.products[0], 2), (self.products[1], 1)]).data['token']
+        self.set_lines([(self.products[1], 4), (self.products[2], 1)], user=self.users[0])
+
+        self.client.force_authenticate(user=None)
+        response = self.client.post(reverse('token_obtain_pair'), {
+            'email': self.users[0].email, 'password': 'testpass123', 'cart_token': token,
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=self.users[0])
+        items = self.client.get(reverse('current-cart')).data['items']
+        self.assertEqual({item['product_id']: item['quantity'] for item in items},
+                         {self.products[0].pk: 2, self.products[1].pk: 1, self.products[2].pk: 1})
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(reverse('current-cart'), headers={'X-Cart-Token': token}).data['items'], [])
+
+    @override_settings(CART_STORE='carts.store.DatabaseCartStore', CART_RESERVATION_TTL=600)
+    def test_database_store_writes_through_and_reserves(self):
+        response = self.set_lines([(self.products[0], 6)], user=self.users[0])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['lines'], [{'quantity': ['Only 5 available.']}])
+
+        self.set_lines([(self.products[0], 2)], user=self.users[0])
+        self.assertEqual(self.stored(self.users[0]), {self.products[0].pk: 2})
+        self.assertEqual(available_stock([self.products[0].pk]), {self.products[0].pk: 3})
+
+
+class CartReadTestCase(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@gmail.com', password='testpass123')
+        self.cart = Cart.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def add_items(self, count):
+        start = CartItem.objects.count()
+        for i in range(start, start + count):
+            product = Product.objects.create(name=f'Product {i}', price=Decimal('4.00'), description='Product')
+            image = ProductImage.objects.create(product=product, image=f'product_images/{i}.jpg')
+            if i % 2:
+                image.variants = {'thumb': {'width': 160, 'jpeg': f'product_images/variants/{i}/thumb.jpeg'}}
+                image.save()
+            ProductImage.objects.create(product=product, image=f'product_images/{i}-back.jpg')
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+
+    def count_queries(self, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('carts-detail', args=[self.cart.pk]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response.data
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.add_items(2)
+        small, _ = self.count_queries()
+        self.add_items(10)
+        large, data = self.count_queries()
+
+        # The cart with its item count, then the items with their products.
+        self.assertEqual(small, 2)
+        self.assertEqual(large, 2)
+        self.assertEqual(data['product_count'], 12)
+
+    def test_items_carry_a_slim_product(self):
+        self.add_items(2)
+
+        _, data = self.count_queries()
+
+        products = [item['product'] for item in data['items']]
+        self.assertEqual(set(products[0]), {'id', 'name', 'price', 'thumbnail'})
+        self.assertTrue(products[0]['thumbnail'].endswith('/product_images/0.jpg'))
+        self.assertTrue(products[1]['thumbnail'].endswith('/product_images/variants/1/thumb.jpeg'))
+
+    def test_full_product_on_expand(self):
+        self.add_items(1)
+
+        _, data = self.count_queries({'expand': 'items.product'})
+
+        self.assertIn('product_images', data['items'][0]['product'])
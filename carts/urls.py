@@ -1,9 +1,12 @@
-
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
-from carts.views import CartViewSet
+from carts.views import CartViewSet, CurrentCartView
 
 router = DefaultRouter()
 router.register('carts', CartViewSet, basename='carts')
 
-urlpatterns = router.urls
+urlpatterns = [
+    path('cart/', CurrentCartView.as_view(), name='current-cart'),
+    *router.urls,
+]
@@ -1,8 +1,21 @@
-from rest_framework import viewsets
+from django.db import transaction
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from carts.lines import set_cart_lines
 from carts.models import Cart
 from carts.permissions import IsOwnerOrAdmin
-from carts.serializers import CartSerializer
+from carts.reservations import add_cart_item
+from carts.serializers import (CartItemSerializer, CartLinesSerializer,
+                               CartSerializer, LiveCartSerializer)
+from carts.store import (anonymous_cart_key, get_cart_store, new_cart_token,
+                         user_cart_key)
+from orders.stock import InsufficientStock
+from shared.serializers import FieldSelection
 
 
 class CartViewSet(viewsets.ModelViewSet):
@@ -11,11 +24,97 @@ class CartViewSet(viewsets.ModelViewSet):
     permission_classes = [IsOwnerOrAdmin]
 
     def get_queryset(self):
+        selection = FieldSelection.from_request(self.request)
+        serializer_class = self.get_serializer_class()
+        queryset = serializer_class.annotate_queryset(self.queryset, selection).prefetch_related(
+            *serializer_class.get_prefetch_plan(selection=selection)
+        )
         if self.request.user.is_staff:
-            return self.queryset
-        return self.queryset.filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
 
     def get_permissions(self):
         return [permission() for permission in self.permission_classes]
 
+    @action(detail=True, methods=['post'])
+    def items(self, request, pk=None):
+        """Add a product to the cart or change its quantity, reserving the stock when reservations are on."""
+        cart = self.get_object()
+        serializer = CartItemSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        product = serializer.validated_data['product']
+        try:
+            with get_cart_store().writing(cart), transaction.atomic():
+                item, created = add_cart_item(cart, product, serializer.validated_data['quantity'])
+        except InsufficientStock as exc:
+            raise ValidationError({'quantity': [f'Only {exc.shortages[product.pk]} available.']})
+        return Response(
+            CartItemSerializer(item, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
 
+    @action(detail=True, methods=['post'])
+    def lines(self, request, pk=None):
+        """
+        Add, change and remove several products at once: each line sets the
+        product's quantity, 0 removes it. Returns the updated cart.
+        """
+        cart = self.get_object()
+        serializer = CartLinesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data['lines']
+        try:
+            with get_cart_store().writing(cart):
+                set_cart_lines(cart, {line['product_id']: line['quantity'] for line in lines})
+        except InsufficientStock as exc:
+            raise shortage_error(lines, exc)
+        return Response(self.get_serializer(self.get_object()).data)
+
+
+class CurrentCartView(APIView):
+    """
+    The requester's live cart, kept in the configured cart store. Anonymous
+    shoppers are told apart by the ``X-Cart-Token`` header, whose token the
+    first change hands out; logging in with it merges the cart into the
+    user's.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        key, token = self.get_cart_key(request)
+        lines = get_cart_store().get_lines(key) if key is not None else {}
+        return Response(LiveCartSerializer.from_lines(lines, token).data)
+
+    def post(self, request):
+        """Set the quantities of several products at once, 0 removing them."""
+        serializer = CartLinesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data['lines']
+        key, token = self.get_cart_key(request)
+        if key is None:
+            token = new_cart_token()
+            key = anonymous_cart_key(token)
+        try:
+            cart = get_cart_store().set_lines(key, {line['product_id']: line['quantity'] for line in lines})
+        except InsufficientStock as exc:
+            raise shortage_error(lines, exc)
+        return Response(LiveCartSerializer.from_lines(cart, token).data)
+
+    @staticmethod
+    def get_cart_key(request):
+        """``(store key, token)`` of the requester's cart; ``(None, None)`` for a shopper without one yet."""
+        if request.user.is_authenticated:
+            return user_cart_key(request.user.pk), None
+        token = request.headers.get('X-Cart-Token')
+        try:
+            return anonymous_cart_key(token), token
+        except ValueError:
+            return None, None
+
+
+def shortage_error(lines, exc):
+    return ValidationError({'lines': [
+        {'quantity': [f'Only {exc.shortages[line["product_id"]]} available.']}
+        if line['product_id'] in exc.shortages else {}
+        for line in lines
+    ]})
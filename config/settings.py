@@ -1,4 +1,5 @@
 from datetime import timedelta
+from importlib.util import find_spec
 from pathlib import Path
 
 from decouple import config, Csv
@@ -29,6 +30,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     #packages
     'rest_framework',
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
     'carts',
     'orders',
     'products',
+    'promotions',
     'shared',
 ]
 
@@ -91,6 +94,44 @@ DATABASES = {
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='online-shop'),
+    }
+}
+
+# Seconds a cached catalog response is kept. Entries are invalidated earlier
+# through the catalog version whenever products or categories change.
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=300, cast=int)
+
+# Seconds an item added to a cart is held back from other buyers; 0 turns
+# cart reservations off. Expired ones are cleared by the sweeper below.
+CART_RESERVATION_TTL = config('CART_RESERVATION_TTL', default=0, cast=int)
+CART_RESERVATION_SWEEP_INTERVAL = config('CART_RESERVATION_SWEEP_INTERVAL', default=60, cast=int)
+
+# Where live carts are kept, see carts.store: DatabaseCartStore writes every
+# change through, CacheCartStore keeps carts in the cache and flushes them
+# every CART_FLUSH_INTERVAL seconds and at checkout. Changes not flushed yet
+# are lost with the cache, so pair it with one that persists (Redis with
+# AOF). Cached carts, anonymous ones included, expire after
+# CART_CACHE_TIMEOUT seconds. Only DatabaseCartStore makes the
+# CART_RESERVATION_TTL reservations; with CacheCartStore stock is first
+# checked at checkout.
+CART_STORE = config('CART_STORE', default='carts.store.DatabaseCartStore')
+CART_CACHE_TIMEOUT = config('CART_CACHE_TIMEOUT', default=30 * 24 * 3600, cast=int)
+CART_FLUSH_INTERVAL = config('CART_FLUSH_INTERVAL', default=30, cast=int)
+
+# "Frequently bought together": neighbours kept per product, and seconds
+# between the runs folding new orders into the co-purchase counts.
+RECOMMENDATIONS_TOP_K = config('RECOMMENDATIONS_TOP_K', default=10, cast=int)
+RECOMMENDATIONS_UPDATE_INTERVAL = config('RECOMMENDATIONS_UPDATE_INTERVAL', default=3600, cast=int)
+
+# Seconds between checks that slide the 7-day / 24-hour sales windows. The
+# windows move by whole hours, checks in between are no-ops.
+SALES_WINDOW_SLIDE_INTERVAL = config('SALES_WINDOW_SLIDE_INTERVAL', default=300, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -139,11 +180,27 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
+# The browsable API renders a full HTML page per response; production only
+# serves the fast JSON (orjson) and, when msgpack is installed, MessagePack.
+API_BROWSABLE = config('API_BROWSABLE', default=DEBUG, cast=bool)
+MSGPACK_ENABLED = find_spec('msgpack') is not None
+
 REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_RENDERER_CLASSES': [
+        'shared.renderers.FastJSONRenderer',
+        *(['shared.renderers.MessagePackRenderer'] if MSGPACK_ENABLED else []),
+        *(['rest_framework.renderers.BrowsableAPIRenderer'] if API_BROWSABLE else []),
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'shared.parsers.FastJSONParser',
+        *(['shared.parsers.MessagePackParser'] if MSGPACK_ENABLED else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 
 }
 SIMPLE_JWT = {
@@ -188,6 +245,24 @@ SIMPLE_JWT = {
 
 
 CELERY_BROKER_URL = config('CELERY_BROKER_URL')
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-cart-reservations': {
+        'task': 'carts.tasks.release_expired_cart_reservations',
+        'schedule': CART_RESERVATION_SWEEP_INTERVAL,
+    },
+    'flush-cached-carts': {
+        'task': 'carts.tasks.flush_cached_carts',
+        'schedule': CART_FLUSH_INTERVAL,
+    },
+    'update-product-recommendations': {
+        'task': 'products.tasks.update_product_recommendations',
+        'schedule': RECOMMENDATIONS_UPDATE_INTERVAL,
+    },
+    'slide-product-sales-windows': {
+        'task': 'products.tasks.slide_product_sales_windows',
+        'schedule': SALES_WINDOW_SLIDE_INTERVAL,
+    },
+}
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -1,13 +1,34 @@
+from django import forms
 from django.contrib import admin
 
 from orders.models import Order, OrderItem
+from orders.stock import available_stock, order_lines
+
+
+class OrderAdminForm(forms.ModelForm):
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def clean_status(self):
+        # Order.save() takes the stock back when a cancelled order is
+        # restored; refuse it here rather than fail the save.
+        status = self.cleaned_data['status']
+        if self.instance.pk and self.initial.get('status') == Order.CANCELLED and status != Order.CANCELLED:
+            lines = order_lines(self.instance)
+            available = available_stock(lines)
+            if any(available.get(pk, 0) < quantity for pk, quantity in lines.items()):
+                raise forms.ValidationError('Not enough stock to restore this order.')
+        return status
 
 
 class OrderAdmin(admin.ModelAdmin):
+    form = OrderAdminForm
     list_display = ('user__first_name', 'user__last_name', 'status')
     list_filter = ('status',)
     search_fields = ('user__first_name', 'user__last_name')
     ordering = ('-created_at',)
+    readonly_fields = ('completed_at',)
 
 
 class OrderItemAdmin(admin.ModelAdmin):
@@ -16,5 +37,15 @@ class OrderItemAdmin(admin.ModelAdmin):
     search_fields = ('order',)
     ordering = ('order',)
 
+    # Items are fixed once the order is placed, like in the API.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
\ No newline at end of file
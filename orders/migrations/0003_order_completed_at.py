@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:37
+
+from django.db import migrations, models
+
+
+def backfill_completed_at(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    # The last change of an already completed order is the best guess.
+    Order.objects.filter(status='completed').update(completed_at=models.F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_orders_created_id_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_completed_at, migrations.RunPython.noop),
+    ]
@@ -1,27 +1,52 @@
-from django.db import models
+from django.db import models, transaction
 
 from shared.models import BaseModel
 
 
 class Order(BaseModel):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    COMPLETED = 'completed'
+    CANCELLED = 'cancelled'
     STATUS_CHOICES = (
-        ('pending', 'Pending'),
-        ('processing', 'Processing'),
-        ('completed', 'Completed'),
-        ('cancelled', 'Cancelled'),
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (COMPLETED, 'Completed'),
+        (CANCELLED, 'Cancelled'),
     )
+    # Orders whose items are out of stock but not yet sold.
+    OPEN_STATUSES = (PENDING, PROCESSING)
     user = models.ForeignKey('accounts.CustomUser', on_delete=models.CASCADE, related_name='orders')
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    # When the order's items were counted as sold, see products.sales.
+    completed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"Order {self.id} by {self.user.email}"
 
+    def save(self, *args, **kwargs):
+        """Settle a status change with ``orders.status``, see there."""
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding or (update_fields is not None and 'status' not in update_fields):
+            return super().save(*args, **kwargs)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'completed_at'}
+        # orders.status needs products.sales, which imports this module.
+        from orders.status import apply_status_change
+        with transaction.atomic():
+            apply_status_change(self)
+            super().save(*args, **kwargs)
+
 
     class Meta:
         db_table = 'orders'
         verbose_name = 'order'
         verbose_name_plural = 'orders'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='orders_created_id_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='orders_user_created_id_idx'),
+        ]
 
 
 class OrderItem(BaseModel):
@@ -32,6 +57,19 @@ class OrderItem(BaseModel):
     def __str__(self):
         return f"{self.order.id} -> {self.product.name} ({self.quantity})"
 
+    def save(self, *args, **kwargs):
+        """Take the item's stock, or the change in it, see ``orders.status``."""
+        from orders.status import apply_item_change
+        with transaction.atomic():
+            apply_item_change(self)
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        from orders.status import apply_item_change
+        with transaction.atomic():
+            apply_item_change(self, deleting=True)
+            return super().delete(*args, **kwargs)
+
 
     class Meta:
         db_table = 'order_items'
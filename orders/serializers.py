@@ -1,11 +1,55 @@
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
 
+from carts.models import Cart
+from carts.reservations import release_cart_reservations, reservations_enabled
+from carts.store import get_cart_store, user_cart_key
 from products.models import Product
+from products.serializers import ProductSerializer
+from shared.serializers import (FastRepresentation, FieldSelection,
+                                SparseFieldsMixin)
 
 from .models import Order, OrderItem
+from .stock import InsufficientStock, reserve_stock
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemFastRepresentation(FastRepresentation):
+    handler_columns = {
+        'total_price': ('product__price', 'quantity'),
+    }
+
+    def represent_total_price(self, row):
+        return row['product__price'] * row['quantity']
+
+
+class OrderFastRepresentation(FastRepresentation):
+    nested_representations = {
+        'items': OrderItemFastRepresentation,
+    }
+
+    def load(self, rows):
+        self.items = {}
+        self.totals = {}
+        nested = self.nested.get('items')
+        if nested is None and 'total_amount' not in {name for name, _ in self.plan}:
+            return
+
+        columns = {'order_id', 'product__price', 'quantity'} | (nested.columns if nested else set())
+        items = list(OrderItem.objects.filter(order_id__in=[row['id'] for row in rows]).values(*columns))
+        represented = nested.represent(items) if nested is not None else items
+        for item, data in zip(items, represented):
+            self.items.setdefault(item['order_id'], []).append(data)
+            self.totals.setdefault(item['order_id'], []).append(item['product__price'] * item['quantity'])
+
+    def represent_items(self, row):
+        return self.items.get(row['id'], [])
+
+    def represent_total_amount(self, row):
+        return sum(self.totals.get(row['id'], []))
+
+
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -14,41 +58,109 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'product', 'product_name', 'quantity', 'product_price', "total_price"]
 
+    expandable_fields = {
+        'product': (ProductSerializer, {}),
+    }
+
     def get_total_price(self, obj):
         return obj.product.price * obj.quantity
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user_email = serializers.EmailField(source='user.email', read_only=True)
     total_amount = serializers.SerializerMethodField()
-    order_items = serializers.ListField(
-        child=serializers.DictField(),
-        write_only=True,
-        required=False
-    )
+    order_items = OrderLineSerializer(many=True, write_only=True, required=False)
 
     class Meta:
         model = Order
         fields = ['id', 'user', 'user_email', 'status', 'items', 'created_at', 'order_items', 'total_amount',]
         read_only_fields = ['user', 'items', 'total_amount',]
 
+    fast_representation_class = OrderFastRepresentation
+
+    @classmethod
+    def get_prefetch_plan(cls, prefix='', selection=None):
+        selection = selection or FieldSelection()
+        # total_amount reads the prefetched items too.
+        if not (selection.includes('items') or selection.includes('total_amount')):
+            return []
+        items = OrderItem.objects.select_related('product')
+        item_selection = selection.nested('items')
+        if selection.includes('items') and item_selection.expands('product'):
+            items = items.prefetch_related(
+                *ProductSerializer.get_prefetch_plan(prefix='product__', selection=item_selection.nested('product'))
+            )
+        return [Prefetch(f'{prefix}items', queryset=items)]
+
+    def validate_status(self, value):
+        # Staff move orders along; a buyer may only cancel their own open order.
+        request = self.context.get('request')
+        if request is not None and request.user.is_staff:
+            return value
+        current = self.instance.status if self.instance is not None else Order.PENDING
+        if value == current or (value == Order.CANCELLED and current in Order.OPEN_STATUSES):
+            return value
+        raise serializers.ValidationError('You can only cancel a pending or processing order.')
+
     def get_total_amount(self, obj):
         return sum(item.product.price * item.quantity for item in obj.items.all())
 
+    def validate_order_items(self, value):
+        product_ids = {line['product'] for line in value}
+        existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        if product_ids - existing:
+            raise serializers.ValidationError([
+                {} if line['product'] in existing
+                else {'product': [f'Invalid pk "{line["product"]}" - object does not exist.']}
+                for line in value
+            ])
+        return value
+
+    @transaction.atomic
     def create(self, validated_data):
-        items_data = validated_data.pop('order_items')
-        order = Order.objects.create(**validated_data)
+        lines = validated_data.pop('order_items', [])
+        quantities = {}
+        for line in lines:
+            quantities[line['product']] = quantities.get(line['product'], 0) + line['quantity']
 
-        for item_data in items_data:
-            product_id = item_data.get('product')
-            quantity = item_data.get('quantity')
+        # A cart kept in the cache is stored before checking out.
+        get_cart_store().flush([user_cart_key(validated_data['user'].pk)])
 
-            product = Product.objects.get(id=product_id)
+        # The buyer's own cart reservations count as available to them.
+        cart = None
+        if reservations_enabled():
+            cart = Cart.objects.filter(user=validated_data['user']).values_list('pk', flat=True).first()
 
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
+        try:
+            reserve_stock(quantities, cart=cart)
+        except InsufficientStock as exc:
+            raise serializers.ValidationError({'order_items': [
+                {'quantity': [f'Only {exc.shortages[line["product"]]} left in stock.']}
+                if line['product'] in exc.shortages else {}
+                for line in lines
+            ]})
 
-            )
-        return order
\ No newline at end of file
+        if cart is not None:
+            release_cart_reservations(cart, quantities)
+
+        order = Order.objects.create(**validated_data)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product_id=line['product'], quantity=line['quantity'])
+            for line in lines
+        )
+        return order
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        # Items are fixed once the order is placed.
+        validated_data.pop('order_items', None)
+        # Stock and sales follow the status in Order.save().
+        try:
+            return super().update(instance, validated_data)
+        except InsufficientStock:
+            raise serializers.ValidationError({'status': ['Not enough stock to restore this order.']})
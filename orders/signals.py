@@ -1,15 +1,19 @@
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
 from .models import Order, OrderItem
+from .status import release_order
+
+
+@receiver(pre_delete, sender=Order)
+def release_deleted_order(sender, instance, **kwargs):
+    # Also runs for orders deleted by a cascade, e.g. with their user; the
+    # collector sends it inside its transaction.
+    release_order(instance)
 
 
 @receiver([post_save, post_delete], sender=OrderItem)
-def update_order_total(sender, instance, **kwargs):
-    order = instance.order
-    total = sum(
-        item.product.price * item.quantity
-        for item in order.items.select_related('product')
-    )
-    order.total_amount = total
-    order.save()
+def touch_order(sender, instance, **kwargs):
+    # A plain UPDATE: saving a possibly stale order would replay its status.
+    Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
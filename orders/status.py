@@ -0,0 +1,91 @@
+"""
+What an order's status change does besides the status: cancelling puts its
+items back in stock and un-cancelling takes them out again, completing counts
+them as sold (see ``products.sales``) and leaving completed takes that back.
+
+``Order.save()`` and the ``pre_delete`` receiver in ``orders.signals`` run
+these, so the API, the admin, plain ORM saves and cascading deletes all
+settle the same way, and ``OrderItem.save()``/``delete()`` do the same for
+items added to or taken out of an order. ``QuerySet.update()`` and bulk
+writes of items skip them.
+"""
+from collections import Counter
+
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from orders.stock import order_lines, release_stock, reserve_stock
+from products.sales import record_sales
+
+
+def _lock(order_id):
+    # The row lock makes concurrent changes to the order take turns, so
+    # stock and sales move exactly once per transition.
+    return Order.objects.select_for_update().values_list('status', 'completed_at').get(pk=order_id)
+
+
+def apply_status_change(order):
+    """
+    Settle ``order`` moving from its stored status to ``order.status``, and
+    set ``completed_at`` to match. Must run in the transaction that saves
+    the order. Raises ``InsufficientStock`` when a cancelled order cannot be
+    restored.
+    """
+    current, completed_at = _lock(order.pk)
+    if order.status == current:
+        return
+
+    lines = order_lines(order)
+    if order.status == Order.CANCELLED:
+        release_stock(lines)
+    elif current == Order.CANCELLED:
+        reserve_stock(lines)
+
+    # Sales are counted when the order completes, and taken back from the
+    # same hour if it stops being completed.
+    if order.status == Order.COMPLETED:
+        order.completed_at = timezone.now()
+        record_sales(lines, order.completed_at)
+    elif current == Order.COMPLETED:
+        if completed_at is not None:
+            record_sales(lines, completed_at, sign=-1)
+        order.completed_at = None
+
+
+def release_order(order):
+    """
+    Put the items of an open (pending or processing) order back in stock
+    before it is deleted. Cancelled orders gave theirs back already, and a
+    completed order's goods are gone, so its stock and sales stay as they
+    are. Must run in the deleting transaction.
+    """
+    current, _ = _lock(order.pk)
+    if current in Order.OPEN_STATUSES:
+        release_stock(order_lines(order))
+
+
+def apply_item_change(item, deleting=False):
+    """
+    Settle ``item`` being added, changed or, with ``deleting``, removed:
+    the stock its order holds and, once completed, its sales follow the
+    item's new product and quantity. Must run in the transaction that
+    writes the item. Raises ``InsufficientStock`` when the stock cannot
+    cover a larger quantity.
+    """
+    current, completed_at = _lock(item.order_id)
+    lines = Counter()
+    if not deleting:
+        lines[item.product_id] += item.quantity
+    if item.pk is not None:
+        previous = OrderItem.objects.filter(pk=item.pk).values_list('product_id', 'quantity').first()
+        if previous is not None:
+            lines[previous[0]] -= previous[1]
+    taken = {pk: quantity for pk, quantity in lines.items() if quantity > 0}
+    returned = {pk: -quantity for pk, quantity in lines.items() if quantity < 0}
+
+    if current != Order.CANCELLED:
+        release_stock(returned)
+        reserve_stock(taken)
+    if current == Order.COMPLETED and completed_at is not None:
+        record_sales(returned, completed_at, sign=-1)
+        record_sales(taken, completed_at)
@@ -0,0 +1,78 @@
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from carts.models import CartItem
+from products.models import Product
+
+
+class InsufficientStock(Exception):
+    """Raised with ``{product_id: available count}`` for every line that cannot be served."""
+
+    def __init__(self, shortages):
+        super().__init__(shortages)
+        self.shortages = shortages
+
+
+def order_lines(order):
+    """``{product_id: quantity}`` of an order's items."""
+    items = order.items.order_by().values('product_id').annotate(quantity=Sum('quantity'))
+    return {item['product_id']: item['quantity'] for item in items}
+
+
+def lock_products(product_ids):
+    """
+    Lock the products' rows for a stock change and return their counts.
+    Rows are always locked in id order, so transactions sharing products
+    queue up behind each other instead of deadlocking. NO KEY UPDATE still
+    lets rows referencing the products be inserted concurrently.
+    """
+    products = Product.objects.filter(pk__in=product_ids).order_by('pk').select_for_update(no_key=True)
+    return dict(products.values_list('pk', 'count'))
+
+
+def available_stock(product_ids, exclude_cart=None, lock=False):
+    """
+    ``{product_id: count}`` that can still be sold: the stock minus live cart
+    reservations, other than ``exclude_cart``'s own. With ``lock`` the
+    products are locked first, so the numbers hold until the transaction ends.
+    """
+    if lock:
+        stock = lock_products(product_ids)
+    else:
+        stock = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'count'))
+    reserved = CartItem.objects.reserved_quantities(stock, exclude_cart=exclude_cart)
+    return {pk: count - reserved.get(pk, 0) for pk, count in stock.items()}
+
+
+def _quantities(lines):
+    return Case(*(When(pk=pk, then=Value(quantity)) for pk, quantity in lines.items()), output_field=IntegerField())
+
+
+def reserve_stock(lines, cart=None):
+    """
+    Take ``{product_id: quantity}`` out of stock, all lines or none. Must run
+    inside the order's transaction: one ordered ``SELECT ... FOR NO KEY
+    UPDATE`` and one conditional ``UPDATE`` for the whole order. Stock held
+    by other carts' reservations is not available; ``cart``'s own is.
+    """
+    if not lines:
+        return
+    available = available_stock(lines, exclude_cart=cart, lock=True)
+    shortages = {pk: available.get(pk, 0) for pk, quantity in lines.items() if available.get(pk, 0) < quantity}
+    if shortages:
+        raise InsufficientStock(shortages)
+
+    quantities = _quantities(lines)
+    updated = Product.objects.filter(pk__in=lines, count__gte=quantities).update(count=F('count') - quantities)
+    if updated != len(lines):
+        # Unreachable while the rows are locked, kept as the last guard.
+        available = dict(Product.objects.filter(pk__in=lines).values_list('pk', 'count'))
+        raise InsufficientStock({pk: count for pk, count in available.items() if count < lines[pk]})
+
+
+def release_stock(lines):
+    """Put ``{product_id: quantity}`` back in stock, e.g. when an order is cancelled."""
+    if not lines:
+        return
+    lock_products(lines)
+    quantities = _quantities(lines)
+    Product.objects.filter(pk__in=lines).update(count=F('count') + quantities)
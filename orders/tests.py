@@ -1,10 +1,15 @@
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 from accounts.models import CustomUser
 from orders.models import Order, OrderItem
-from products.models import Product
+from orders.serializers import OrderSerializer
+from products.models import Product, ProductSales
 
 
 class TestOrderViewSet(APITestCase):
@@ -27,7 +32,8 @@ class TestOrderViewSet(APITestCase):
         self.product = Product.objects.create(
             name='Test Product',
             price=10.00,
-            description='Test description'
+            description='Test description',
+            count=10
         )
 
         self.order = Order.objects.create(user=self.user)
@@ -93,3 +99,206 @@ class TestOrderViewSet(APITestCase):
         response = self.client.delete(self.order_detail_url(self.order.pk))
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(Order.objects.filter(pk=self.order.pk).exists())
+
+    def test_list_query_count_does_not_depend_on_order_count(self):
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.order_list_url)
+        single_order_queries = len(context.captured_queries)
+
+        for _ in range(5):
+            order = Order.objects.create(user=self.user)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.order_list_url)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(context.captured_queries), single_order_queries)
+
+    def test_sparse_fields_and_expanded_product(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.order_list_url, {
+            'fields': 'id,items.product,items.quantity',
+            'expand': 'items.product',
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        order = response.data['results'][0]
+        self.assertEqual(set(order), {'id', 'items'})
+        self.assertEqual(set(order['items'][0]), {'product', 'quantity'})
+        self.assertEqual(order['items'][0]['product']['name'], 'Test Product')
+
+    def test_list_matches_serializer_output(self):
+        other = Product.objects.create(name='Other Product', price=2.50, description='Other', count=4)
+        OrderItem.objects.create(order=self.order, product=other, quantity=4)
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.order_list_url)
+
+        expected = OrderSerializer(Order.objects.filter(user=self.user), many=True).data
+        self.assertEqual(response.data['results'], expected)
+        self.assertEqual(response.data['results'][0]['total_amount'], Decimal('30.00'))
+
+
+class OrderStockTestCase(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@gmail.com', password='testpass123')
+        self.admin_user = CustomUser.objects.create_superuser(email='admin@gmail.com', password='adminpass123')
+        self.lamp = Product.objects.create(name='Lamp', price=10, description='Lamp', count=5)
+        self.desk = Product.objects.create(name='Desk', price=80, description='Desk', count=1)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('orders-list')
+
+    def place(self, *lines):
+        return self.client.post(self.url, {
+            'order_items': [{'product': product.pk, 'quantity': quantity} for product, quantity in lines]
+        }, format='json')
+
+    def test_order_takes_items_out_of_stock(self):
+        response = self.place((self.lamp, 2), (self.desk, 1), (self.lamp, 1))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.lamp.refresh_from_db()
+        self.desk.refresh_from_db()
+        self.assertEqual((self.lamp.count, self.desk.count), (2, 0))
+
+    def test_out_of_stock_line_fails_the_whole_order(self):
+        response = self.place((self.lamp, 2), (self.desk, 2))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['order_items'][0], {})
+        self.assertEqual(response.data['order_items'][1]['quantity'], ['Only 1 left in stock.'])
+        self.assertFalse(Order.objects.exists())
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 5)
+
+    def test_unknown_product_is_reported_per_line(self):
+        response = self.client.post(self.url, {
+            'order_items': [{'product': self.lamp.pk, 'quantity': 1}, {'product': 9999, 'quantity': 1}]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('product', response.data['order_items'][1])
+
+    def test_stock_is_locked_in_id_order_with_one_update(self):
+        with CaptureQueriesContext(connection) as context:
+            self.place((self.desk, 1), (self.lamp, 1))
+
+        sql = [query['sql'] for query in context.captured_queries]
+        locks = [index for index, query in enumerate(sql) if query.endswith('ORDER BY 1 ASC FOR NO KEY UPDATE')]
+        updates = [index for index, query in enumerate(sql) if query.startswith('UPDATE "products"')]
+        self.assertEqual(len(locks), 1)
+        # Only the read of live cart reservations sits between the two.
+        self.assertEqual(updates, [locks[0] + 2])
+        self.assertIn('FROM "carts_cartitem"', sql[locks[0] + 1])
+
+    def test_cancel_restores_stock_once(self):
+        order_id = self.place((self.lamp, 3)).data['id']
+        url = reverse('orders-detail', kwargs={'pk': order_id})
+        self.client.force_authenticate(user=self.admin_user)
+
+        self.client.patch(url, {'status': 'cancelled'}, format='json')
+        self.client.patch(url, {'status': 'cancelled'}, format='json')
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 5)
+
+        self.client.patch(url, {'status': 'pending'}, format='json')
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 2)
+
+    def test_saving_the_order_elsewhere_moves_stock_too(self):
+        order = Order.objects.get(pk=self.place((self.lamp, 3)).data['id'])
+
+        order.status = Order.CANCELLED
+        order.save()
+        order.save()
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 5)
+
+        order.status = 'processing'
+        order.save(update_fields=['status'])
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 2)
+
+    def test_deleting_an_order_gives_its_stock_back(self):
+        kept = self.place((self.lamp, 2)).data['id']
+        cancelled = self.place((self.lamp, 1)).data['id']
+        self.client.force_authenticate(user=self.admin_user)
+        self.client.patch(reverse('orders-detail', kwargs={'pk': cancelled}), {'status': 'cancelled'}, format='json')
+
+        for order_id in (kept, cancelled):
+            response = self.client.delete(reverse('orders-detail', kwargs={'pk': order_id}))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 5)
+
+    def test_deleting_a_completed_order_keeps_stock_and_sales(self):
+        order = Order.objects.get(pk=self.place((self.lamp, 3)).data['id'])
+        order.status = Order.COMPLETED
+        order.save()
+
+        self.client.force_authenticate(user=self.admin_user)
+        self.client.delete(reverse('orders-detail', kwargs={'pk': order.pk}))
+
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 2)
+        self.assertEqual(ProductSales.objects.get(product=self.lamp).total, 3)
+
+    def test_buyers_can_only_delete_pending_orders(self):
+        order = Order.objects.get(pk=self.place((self.lamp, 3)).data['id'])
+        order.status = Order.PROCESSING
+        order.save()
+
+        response = self.client.delete(reverse('orders-detail', kwargs={'pk': order.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(Order.objects.filter(pk=order.pk).exists())
+
+    def test_deleting_the_buyer_gives_open_orders_stock_back(self):
+        self.place((self.lamp, 2))
+        self.place((self.lamp, 1))
+
+        self.user.delete()
+
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 5)
+
+    def test_items_written_outside_the_api_move_stock(self):
+        order = Order.objects.create(user=self.user)
+        item = OrderItem.objects.create(order=order, product=self.lamp, quantity=2)
+        item.quantity = 3
+        item.save()
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 2)
+
+        order.status = Order.CANCELLED
+        order.save()
+        item.quantity = 1
+        item.save()
+        order.refresh_from_db()
+        self.lamp.refresh_from_db()
+        self.assertEqual((order.status, self.lamp.count), (Order.CANCELLED, 5))
+
+    def test_buyers_can_only_cancel_their_open_orders(self):
+        order_id = self.place((self.lamp, 2)).data['id']
+        url = reverse('orders-detail', kwargs={'pk': order_id})
+
+        response = self.client.patch(url, {'status': Order.COMPLETED}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(Order.objects.get(pk=order_id).completed_at)
+
+        response = self.client.patch(url, {'status': Order.CANCELLED}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.count, 5)
+
+        response = self.client.patch(url, {'status': Order.PENDING}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_buyers_cannot_place_orders_in_another_status(self):
+        response = self.client.post(self.url, {
+            'status': Order.COMPLETED, 'order_items': [{'product': self.lamp.pk, 'quantity': 1}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,26 +1,38 @@
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
 
 from carts.permissions import IsOwnerOrAdmin
 from orders.filters import OrderFilter
 from orders.models import Order
 from orders.serializers import OrderSerializer
-from products.pagination import CustomPagination
+from products.pagination import SelectablePagination
+from shared.serializers import FastListMixin, FieldSelection
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
     filter_backends = [DjangoFilterBackend]
     filterset_class = OrderFilter
-    pagination_class = CustomPagination
+    pagination_class = SelectablePagination
 
     def get_queryset(self):
         user = self.request.user
+        selection = FieldSelection.from_request(self.request)
+        queryset = Order.objects.prefetch_related(*self.get_serializer_class().get_prefetch_plan(selection=selection))
+        if selection.includes('user_email'):
+            queryset = queryset.select_related('user')
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        # Buyers may only withdraw an order nobody has started on.
+        if not self.request.user.is_staff and instance.status != Order.PENDING:
+            raise PermissionDenied('Only pending orders can be deleted.')
+        instance.delete()
@@ -9,7 +9,8 @@ class ProductAdmin(admin.ModelAdmin):
 
 
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name',)
+    list_display = ('name', 'parent')
+    list_select_related = ('parent',)
     search_fields = ('name',)
 
 
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a flushed cache never reuses old versions.
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def _increment_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog response. The version is bumped right
+    away and again once the transaction commits, so a response cached from
+    uncommitted-at-the-time data never outlives the commit.
+    """
+    _increment_catalog_version()
+    transaction.on_commit(_increment_catalog_version)
+
+
+def catalog_cache_key(namespace, request, version):
+    params = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+    accepted = getattr(request, 'accepted_media_type', '')
+    # Cached bodies carry absolute URLs, so the origin is part of the key.
+    raw = json.dumps([request.scheme, request.get_host(), request.path, params, accepted, version], default=str)
+    return f'catalog:{namespace}:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+
+class CatalogCacheMixin:
+    """
+    Caches ``list`` and ``retrieve`` responses under the normalized query
+    params and the catalog version, with a strong ETag derived from the same
+    key. ``If-None-Match`` with the current ETag is answered with 304
+    without touching the database.
+    """
+    catalog_cache_timeout = settings.CATALOG_CACHE_TIMEOUT
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        version = get_catalog_version()
+        key = catalog_cache_key(self.basename, request, version)
+        etag = quote_etag(key.rsplit(':', 1)[1][:32])
+
+        # If-None-Match uses the weak comparison, so W/"x" matches "x".
+        if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = cache.get(key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, self.catalog_cache_timeout)
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        response['Vary'] = 'Accept, Authorization'
+        return response
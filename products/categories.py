@@ -0,0 +1,41 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from products.models import Category
+
+CATEGORY_TREE_KEY = 'catalog:category-tree'
+
+
+def build_category_tree():
+    """
+    The whole category hierarchy as nested ``{'id', 'name', 'children'}``
+    nodes, siblings sorted by name, from a single query.
+    """
+    nodes = {}
+    roots = []
+    rows = list(Category.objects.order_by('name', 'id').values_list('id', 'name', 'parent_id'))
+    for category_id, name, _ in rows:
+        nodes[category_id] = {'id': category_id, 'name': name, 'children': []}
+    for category_id, _, parent_id in rows:
+        siblings = nodes[parent_id]['children'] if parent_id is not None else roots
+        siblings.append(nodes[category_id])
+    return roots
+
+
+def get_category_tree():
+    """
+    The serialized tree, kept in the cache until a category changes. Unlike
+    the catalog responses it does not follow the catalog version, so product
+    edits do not rebuild it.
+    """
+    tree = cache.get(CATEGORY_TREE_KEY)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(CATEGORY_TREE_KEY, tree, timeout=None)
+    return tree
+
+
+def invalidate_category_tree():
+    # Dropped again after commit, in case a reader rebuilt it from the old data meanwhile.
+    cache.delete(CATEGORY_TREE_KEY)
+    transaction.on_commit(lambda: cache.delete(CATEGORY_TREE_KEY))
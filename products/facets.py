@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from django.db.models import Count, Max, Min, Q
+
+from products.models import Product, ProductCategory
+
+# Upper bounds of the price histogram buckets; the last bucket is open.
+PRICE_BUCKET_BOUNDS = (Decimal('50.00'), Decimal('100.00'), Decimal('250.00'), Decimal('500.00'), Decimal('1000.00'))
+
+
+def price_buckets():
+    """``[(low, high), ...]`` covering every price, ``None`` means unbounded."""
+    lows = (None,) + PRICE_BUCKET_BOUNDS
+    highs = PRICE_BUCKET_BOUNDS + (None,)
+    return list(zip(lows, highs))
+
+
+def _price(value):
+    # Prices are strings everywhere else in the API.
+    return str(value) if value is not None else None
+
+
+def product_facets(queryset):
+    """
+    Category counts and a price histogram of the products in ``queryset``.
+    Two aggregate queries over the filtered ids, however many categories
+    and buckets there are: one for the count, price range and histogram,
+    one grouping the links by category.
+    """
+    product_ids = queryset.order_by().values('pk')
+
+    buckets = price_buckets()
+    bucket_counts = {}
+    for index, (low, high) in enumerate(buckets):
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        bucket_counts[f'bucket_{index}'] = Count('pk', filter=condition)
+
+    prices = Product.objects.filter(pk__in=product_ids).aggregate(
+        count=Count('pk'),
+        min_price=Min('price'),
+        max_price=Max('price'),
+        **bucket_counts,
+    )
+
+    categories = (
+        ProductCategory.objects
+        .filter(product__in=product_ids)
+        .values('category_id', 'category__name')
+        .annotate(count=Count('product_id'))
+        .order_by('-count', 'category__name')
+    )
+
+    return {
+        'count': prices['count'],
+        'categories': [
+            {'id': row['category_id'], 'name': row['category__name'], 'count': row['count']}
+            for row in categories
+        ],
+        'price': {
+            'min': _price(prices['min_price']),
+            'max': _price(prices['max_price']),
+            'buckets': [
+                {'min': _price(low), 'max': _price(high), 'count': prices[f'bucket_{index}']}
+                for index, (low, high) in enumerate(buckets)
+            ],
+        },
+    }
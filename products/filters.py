@@ -1,16 +1,59 @@
 import django_filters
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Coalesce
+from rest_framework.filters import OrderingFilter
 
-from products.models import Product
+from products.models import Category, Product, ProductCategory
+from products.search import filter_by_name, resolve_category_ids
 
 
 class ProductFilter(django_filters.FilterSet):
     price = django_filters.NumberFilter()
     price__gt = django_filters.NumberFilter(field_name='price', lookup_expr='gt')
     price__lt = django_filters.NumberFilter(field_name='price', lookup_expr='lt')
-    name = django_filters.CharFilter(lookup_expr='icontains')
-    category_name = django_filters.CharFilter(field_name='product_categories__category__name', lookup_expr='icontains')
-    category = django_filters.NumberFilter(field_name='product_categories__category__id')
+    name = django_filters.CharFilter(method='filter_name')
+    category_name = django_filters.CharFilter(method='filter_category_name')
+    category = django_filters.NumberFilter(method='filter_category')
 
     class Meta:
         model = Product
         fields = ('price', 'name', 'category_name', 'category')
+
+    def filter_name(self, queryset, name, value):
+        return filter_by_name(queryset, 'name', value)
+
+    def filter_category_name(self, queryset, name, value):
+        links = ProductCategory.objects.filter(product=OuterRef('pk'), category_id__in=resolve_category_ids(value))
+        return queryset.filter(Exists(links))
+
+    def filter_category(self, queryset, name, value):
+        # The category and its whole subtree.
+        links = ProductCategory.objects.filter(
+            product=OuterRef('pk'), category__in=Category.objects.subtree(value).values('pk')
+        )
+        return queryset.filter(Exists(links))
+
+
+class ProductOrderingFilter(OrderingFilter):
+    """
+    ``OrderingFilter`` that also sorts by the sales counters, e.g.
+    ``?ordering=-best_selling``. The counters are only joined when asked for.
+    """
+    sales_orderings = {
+        'best_selling': 'sales__total',
+        'trending': 'sales__last_24_hours',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if not ordering:
+            return queryset
+
+        names = {term.lstrip('-') for term in ordering}
+        aliases = {name: Coalesce(field, 0) for name, field in self.sales_orderings.items() if name in names}
+        if aliases:
+            # Counters tie a lot, id keeps the pages stable.
+            queryset = queryset.alias(**aliases)
+            if not names & {'id', 'pk'}:
+                ordering = [*ordering, '-id']
+        return queryset.order_by(*ordering)
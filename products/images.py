@@ -0,0 +1,111 @@
+import io
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from shared.storage import content_addressed_storage, derived_directory
+
+# Variant name -> target width in pixels. Images are never upscaled.
+VARIANT_WIDTHS = {
+    'thumb': 160,
+    'card': 480,
+    'full': 1200,
+}
+
+# File extension -> Pillow format and save options.
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_name(image_name, variant, extension):
+    """
+    Deterministic storage name of a variant, in the original's derived
+    directory: ``product_images/ab/<sha>.jpg`` ->
+    ``product_images/ab/variants/<sha>/thumb.webp``.
+    """
+    return str(PurePosixPath(derived_directory(image_name)) / f'{variant}.{extension}')
+
+
+def render_variants(content):
+    """
+    Resizes the original image bytes into every variant and format.
+    Pure CPU work on bytes, so it can run in worker processes.
+
+    Returns ``{variant: (width, {extension: bytes})}``.
+    """
+    with Image.open(io.BytesIO(content)) as original:
+        original = original.convert('RGB')
+        rendered = {}
+        for variant, width in VARIANT_WIDTHS.items():
+            resized = original
+            if original.width > width:
+                height = max(1, round(original.height * width / original.width))
+                resized = original.resize((width, height), Image.Resampling.LANCZOS)
+
+            encoded = {}
+            for extension, (image_format, options) in VARIANT_FORMATS.items():
+                buffer = io.BytesIO()
+                resized.save(buffer, format=image_format, **options)
+                encoded[extension] = buffer.getvalue()
+            rendered[variant] = (resized.width, encoded)
+    return rendered
+
+
+def store_variants(image_name, rendered):
+    """
+    Writes rendered variants under their deterministic names, replacing
+    older files, and returns the mapping stored in ``ProductImage.variants``.
+    """
+    storage = content_addressed_storage()
+    variants = {}
+    for variant, (width, encoded) in rendered.items():
+        variants[variant] = {'width': width}
+        for extension, content in encoded.items():
+            name = variant_name(image_name, variant, extension)
+            variants[variant][extension] = storage.save_derived(name, ContentFile(content))
+    return variants
+
+
+def read_image(image_name):
+    with content_addressed_storage().open(image_name, 'rb') as file:
+        return file.read()
+
+
+def build_srcset(image, request=None):
+    """
+    ``src``/``srcset`` description of a ``ProductImage`` for the API. Falls
+    back to the original file until its variants have been generated.
+    """
+    return build_srcset_from_values(image.id, image.image.name, image.variants, request)
+
+
+def _url(name, request=None):
+    location = content_addressed_storage().url(name)
+    return request.build_absolute_uri(location) if request is not None else location
+
+
+def build_srcset_from_values(image_id, image_name, variants, request=None):
+    """``build_srcset`` for the ``id``, ``image`` and ``variants`` columns of a row."""
+    if not variants:
+        return {'id': image_id, 'src': _url(image_name, request), 'srcset': {}}
+
+    return {
+        'id': image_id,
+        'src': _url(variants['card']['jpeg'], request),
+        'srcset': {
+            extension: ', '.join(
+                f'{_url(variant[extension], request)} {variant["width"]}w' for variant in variants.values()
+            )
+            for extension in VARIANT_FORMATS
+        },
+    }
+
+
+def thumbnail_url(image_name, variants, request=None):
+    """URL of an image's thumbnail variant, or of the original until the variants exist."""
+    if not image_name:
+        return None
+    return _url(variants['thumb']['jpeg'] if variants else image_name, request)
@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from orders.models import Order
+from orders.serializers import OrderSerializer
+from products.models import Product
+from products.serializers import ProductSerializer
+from shared.renderers import FastJSONRenderer, MessagePackRenderer, msgpack, orjson
+
+
+class Command(BaseCommand):
+    help = 'Compares response renderers on large product and order pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20, help='Renders per case')
+
+    def handle(self, *args, **options):
+        renderers = [('stdlib json', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', FastJSONRenderer()))
+        else:
+            self.stdout.write(self.style.WARNING('orjson is not installed, FastJSONRenderer uses the stdlib'))
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+
+        cases = [
+            ('products', ProductSerializer, Product.objects.order_by('-created_at', '-id')),
+            ('orders', OrderSerializer, Order.objects.order_by('-created_at', '-id')),
+        ]
+        for label, serializer_class, queryset in cases:
+            representation = serializer_class.fast_representation_class(serializer_class(context={}))
+            data = {'results': representation.represent(representation.values(queryset)[:options['page_size']])}
+            if not data['results']:
+                self.stdout.write(self.style.WARNING(f'No {label}, run populate_db first'))
+                continue
+
+            self.stdout.write(f'{label}: page of {len(data["results"])}')
+            for name, renderer in renderers:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    body = renderer.render(data)
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.report(f'  {name}', timings, len(body))
+
+    def report(self, label, timings, size):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'{label:<16} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms   {size / 1024:8.1f} KiB'
+        )
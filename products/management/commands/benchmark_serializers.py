@@ -0,0 +1,73 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.models import Order
+from orders.serializers import OrderSerializer
+from products.models import Product
+from products.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares DRF serializers with the fast values() representation on product and order list pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20, help='Pages per case')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.page_size = options['page_size']
+        self.repeat = options['repeat']
+
+        cases = [
+            ('products', ProductSerializer, Product.objects.defer('search_vector').order_by('-created_at', '-id')),
+            ('orders', OrderSerializer, Order.objects.select_related('user').order_by('-created_at', '-id')),
+        ]
+        # No request: image URLs stay relative, which costs the same on both paths.
+        context = {}
+        for label, serializer_class, queryset in cases:
+            total = queryset.count()
+            if not total:
+                self.stdout.write(self.style.WARNING(f'No {label}, run populate_db first'))
+                continue
+            offsets = [self.rng.randrange(max(total - self.page_size, 0) + 1) for _ in range(self.repeat)]
+
+            serializer_pages = self.measure(offsets, lambda offset: self.serialize(
+                serializer_class, queryset, offset, context
+            ))
+            fast_pages = self.measure(offsets, lambda offset: self.represent(
+                serializer_class, queryset, offset, context
+            ))
+            if serializer_pages[1] != fast_pages[1]:
+                self.stderr.write(f'{label}: fast representation differs from the serializer output')
+
+            self.stdout.write(f'{label}: {total} rows, pages of {self.page_size}')
+            self.report('  serializer', serializer_pages[0])
+            self.report('  values() representation', fast_pages[0])
+
+    def serialize(self, serializer_class, queryset, offset, context):
+        page = queryset.prefetch_related(*serializer_class.get_prefetch_plan())[offset:offset + self.page_size]
+        return serializer_class(page, many=True, context=context).data
+
+    def represent(self, serializer_class, queryset, offset, context):
+        representation = serializer_class.fast_representation_class(serializer_class(context=context))
+        return representation.represent(representation.values(queryset)[offset:offset + self.page_size])
+
+    def measure(self, offsets, run):
+        timings = []
+        last = None
+        for offset in offsets:
+            started = time.perf_counter()
+            data = run(offset)
+            timings.append((time.perf_counter() - started) * 1000)
+            last = data
+        return timings, last
+
+    def report(self, label, timings):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f'{label:<30} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms')
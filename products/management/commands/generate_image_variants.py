@@ -0,0 +1,79 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from products.cache import bump_catalog_version
+from products.images import read_image, render_variants, store_variants
+from products.models import ProductImage
+
+
+def render_or_none(content):
+    try:
+        return render_variants(content)
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Generates resized variants for existing product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used to resize images')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true', help='Regenerate images that already have variants')
+
+    def handle(self, *args, **options):
+        queryset = ProductImage.objects.order_by('id')
+        if not options['force']:
+            queryset = queryset.filter(variants={})
+
+        # Many rows can share one file; each file is resized once per run.
+        done = {}
+        updated = 0
+        executor = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        try:
+            rows = queryset.values_list('id', 'image').iterator(chunk_size=options['batch_size'])
+            batch = defaultdict(list)
+            for image_id, image_name in rows:
+                batch[image_name].append(image_id)
+                if len(batch) >= options['batch_size']:
+                    updated += self.process(batch, done, executor)
+                    batch = defaultdict(list)
+            if batch:
+                updated += self.process(batch, done, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if updated:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Variants generated for {len(done)} files, {updated} images updated'))
+
+    def process(self, batch, done, executor):
+        pending = []
+        contents = []
+        for name in batch:
+            if name in done:
+                continue
+            try:
+                contents.append(read_image(name))
+            except OSError as exc:
+                self.stderr.write(f'Skipping {name}: {exc}')
+                continue
+            pending.append(name)
+
+        rendered = executor.map(render_or_none, contents) if executor else map(render_or_none, contents)
+        for name, variants in zip(pending, rendered):
+            if variants is None:
+                self.stderr.write(f'Skipping {name}: not a readable image')
+                continue
+            done[name] = store_variants(name, variants)
+
+        updated = 0
+        for name, image_ids in batch.items():
+            if name in done:
+                updated += ProductImage.objects.filter(pk__in=image_ids).update(variants=done[name])
+        return updated
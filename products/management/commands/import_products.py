@@ -0,0 +1,168 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from products.cache import bump_catalog_version
+from products.models import Category, Product, ProductCategory
+from products.search import update_search_vectors
+
+UPDATE_FIELDS = ['price', 'description', 'count', 'updated_at']
+
+
+class Command(BaseCommand):
+    help = 'Streams products from a CSV or NDJSON feed and upserts them by name in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Feed format, guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--category-separator', default='|',
+                            help='Separator of the category names in the CSV "categories" column')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'{path} does not exist')
+
+        feed_format = options['format'] or ('ndjson' if path.suffix in ('.ndjson', '.jsonl') else 'csv')
+        self.category_separator = options['category_separator']
+        self.category_ids = {}
+        self.skipped = 0
+        self.unchanged = 0
+
+        started = time.perf_counter()
+        imported = 0
+        with path.open(newline='', encoding='utf-8') as feed:
+            rows = self.read_csv(feed) if feed_format == 'csv' else self.read_ndjson(feed)
+            while batch := list(islice(rows, options['batch_size'])):
+                imported += self.import_batch(batch)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{imported} rows imported ({imported / elapsed:.0f} rows/s)')
+
+        if imported > self.unchanged:
+            bump_catalog_version()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{imported} products imported ({self.unchanged} unchanged), {self.skipped} rows skipped '
+            f'in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+
+    def read_csv(self, feed):
+        for line, row in enumerate(csv.DictReader(feed), start=2):
+            categories = row.get('categories')
+            if categories is not None:
+                row['categories'] = categories.split(self.category_separator)
+            yield from self.clean_row(line, row)
+
+    def read_ndjson(self, feed):
+        for line, raw in enumerate(feed, start=1):
+            if not raw.strip():
+                continue
+            try:
+                row = json.loads(raw)
+            except json.JSONDecodeError as exc:
+                self.skip(line, f'invalid JSON ({exc.msg})')
+                continue
+            yield from self.clean_row(line, row)
+
+    def clean_row(self, line, row):
+        name = (row.get('name') or '').strip()
+        if not name or len(name) > Product._meta.get_field('name').max_length:
+            self.skip(line, 'missing or too long name')
+            return
+
+        try:
+            price = Decimal(str(row['price'])).quantize(Decimal('0.01'))
+            count = int(row.get('count') or 1)
+        except (KeyError, InvalidOperation, ValueError):
+            self.skip(line, 'invalid price or count')
+            return
+        # The model's own validators, so a bad row is skipped rather than
+        # failing its whole batch in the database.
+        for field, value in (('price', price), ('count', count)):
+            try:
+                Product._meta.get_field(field).run_validators(value)
+            except ValidationError as exc:
+                self.skip(line, f'invalid {field} ({" ".join(exc.messages)})')
+                return
+
+        categories = row.get('categories')
+        if categories is not None:
+            categories = {category.strip() for category in categories if category and category.strip()}
+
+        yield {
+            'name': name,
+            'price': price,
+            'description': row.get('description') or '',
+            'count': count,
+            'categories': categories,
+        }
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        self.stderr.write(f'Line {line} skipped: {reason}')
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        # The same name twice in one INSERT ... ON CONFLICT is an error, the
+        # last occurrence wins like it would across batches.
+        rows = {row['name']: row for row in batch}
+
+        # Rows that match the stored product are not written again.
+        product_ids = {}
+        stored = Product.objects.filter(name__in=rows).values_list('name', 'pk', 'price', 'description', 'count')
+        for name, pk, price, description, count in stored:
+            row = rows[name]
+            if (price, description, count) == (row['price'], row['description'], row['count']):
+                product_ids[name] = pk
+
+        changed = Product.objects.bulk_create(
+            [
+                Product(name=name, price=row['price'], description=row['description'], count=row['count'])
+                for name, row in rows.items()
+                if name not in product_ids
+            ],
+            update_conflicts=True,
+            unique_fields=['name'],
+            update_fields=UPDATE_FIELDS,
+        )
+        product_ids.update((product.name, product.pk) for product in changed)
+        self.unchanged += len(rows) - len(changed)
+
+        self.resolve_categories({name for row in rows.values() for name in row['categories'] or ()})
+        relinked = ProductCategory.objects.sync({
+            product_ids[name]: {self.category_ids[category] for category in row['categories']}
+            for name, row in rows.items()
+            if row['categories'] is not None
+        })
+
+        # The sync already rebuilt the vectors of the relinked products.
+        refreshed = [product.pk for product in changed if product.pk not in relinked]
+        if refreshed:
+            update_search_vectors(refreshed)
+        return len(rows)
+
+    def resolve_categories(self, names):
+        """Looks up unknown category names once and creates the missing ones."""
+        missing = names - self.category_ids.keys()
+        if not missing:
+            return
+
+        # Names are not unique, the oldest category with a name wins.
+        for category_id, name in Category.objects.filter(name__in=missing).order_by('-id').values_list('id', 'name'):
+            self.category_ids[name] = category_id
+
+        created = Category.objects.bulk_create(
+            Category(name=name) for name in missing - self.category_ids.keys()
+        )
+        for category in created:
+            self.category_ids[category.name] = category.pk
@@ -1,52 +1,224 @@
 import io
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import islice
 
+from django.contrib.auth.hashers import make_password
 from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from faker import Faker
 from PIL import Image
 
+from accounts.models import CustomUser
+from carts.models import Cart, CartItem
+from orders.models import Order, OrderItem
+from products.cache import bump_catalog_version
 from products.models import Category, Product, ProductCategory, ProductImage
+from products.sales import rebuild_sales
+from products.search import update_search_vectors
+from shared.storage import add_blob_references
+
+
+def render_image(color):
+    """Encodes one solid-colour JPEG. Module level so worker processes can run it."""
+    image = Image.new('RGB', (300, 300), color=color)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
-fake = Faker()
 
 class Command(BaseCommand):
-    help = 'Populates the database with fake product data'
+    help = 'Populates the database with fake catalog, user, cart and order data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--products', type=int, default=20)
+        parser.add_argument('--users', type=int, default=0)
+        parser.add_argument('--carts', type=int, default=0, help='Carts, one per user without a cart')
+        parser.add_argument('--orders', type=int, default=0)
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--image-pool', type=int, default=16,
+                            help='Distinct images generated; product images reuse them')
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Processes used to encode the image pool')
 
-    def handle(self, *args, **kwargs):
-        self.create_categories(10)
-        self.create_products(20)
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        self.batch_size = options['batch_size']
+
+        started = time.perf_counter()
+        self.create_categories(options['categories'])
+        if options['products']:
+            self.create_images(options['image_pool'], options['workers'])
+            self.create_products(options['products'])
+            bump_catalog_version()
+        self.create_users(options['users'])
+        self.create_carts(options['carts'])
+        self.create_orders(options['orders'])
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
 
     def create_categories(self, count):
-        for _ in range(count):
-            Category.objects.create(name=fake.unique.word().capitalize())
+        taken = set(Category.objects.values_list('name', flat=True))
+        categories = []
+        for i in range(count):
+            name = self.fake.word().capitalize()
+            if name in taken:
+                name = f'{name} {i}'
+            taken.add(name)
+            categories.append(Category(name=name))
+        Category.objects.bulk_create(categories, batch_size=self.batch_size)
 
         self.stdout.write(self.style.SUCCESS(f'{count} categories created'))
 
+    def create_images(self, count, workers):
+        """
+        Encodes a small pool of images once (in parallel) and stores each of
+        them once. Product images point at the pool instead of re-encoding
+        and re-writing a file per row.
+        """
+        colors = [tuple(self.rng.randint(0, 255) for _ in range(3)) for _ in range(max(count, 1))]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                images = list(executor.map(render_image, colors))
+        else:
+            images = [render_image(color) for color in colors]
+
+        # Content-addressed: rerunning the command stores nothing new.
+        storage = ProductImage._meta.get_field('image').storage
+        self.image_names = [
+            storage.save(f'product_images/{self.fake.slug()}.jpg', ContentFile(content))
+            for content in images
+        ]
+
     def create_products(self, count):
-        categories = list(Category.objects.all())
-
-        for _ in range(count):
-            product = Product.objects.create(
-                name=fake.unique.word().capitalize(),
-                price=round(random.uniform(10, 1000), 2),
-                description=fake.text(max_nb_chars=500),
-                count=random.randint(1, 20)
+        category_ids = list(Category.objects.order_by('id').values_list('id', flat=True))
+        offset = Product.objects.count()
+
+        for batch in batched(range(offset, offset + count), self.batch_size):
+            with transaction.atomic():
+                products = Product.objects.bulk_create(
+                    Product(
+                        name=f'{self.fake.word().capitalize()} {self.fake.word()} {i}',
+                        price=round(self.rng.uniform(10, 1000), 2),
+                        description=self.fake.text(max_nb_chars=500),
+                        count=self.rng.randint(1, 20)
+                    )
+                    for i in batch
+                )
+                ProductCategory.objects.bulk_create(
+                    ProductCategory(product=product, category_id=category_id)
+                    for product in products
+                    for category_id in self.rng.sample(category_ids, min(len(category_ids), self.rng.randint(1, 3)))
+                )
+                images = ProductImage.objects.bulk_create(
+                    ProductImage(product=product, image=self.rng.choice(self.image_names))
+                    for product in products
+                    for _ in range(self.rng.randint(1, 3))
+                )
+                references = {}
+                for image in images:
+                    references[image.image.name] = references.get(image.image.name, 0) + 1
+                add_blob_references(references)
+                update_search_vectors([product.pk for product in products])
+            self.stdout.write(f'{batch[-1] - offset + 1}/{count} products')
+
+        self.stdout.write(self.style.SUCCESS(f'{count} products created with images and categories'))
+
+    def create_users(self, count):
+        if not count:
+            return
+        # Hashing is deliberately slow, every generated user shares one hash.
+        password = make_password('password123')
+        offset = CustomUser.objects.count()
+
+        for batch in batched(range(offset, offset + count), self.batch_size):
+            CustomUser.objects.bulk_create(
+                CustomUser(
+                    email=f'user{i}@example.com',
+                    first_name=self.fake.first_name(),
+                    last_name=self.fake.last_name(),
+                    phone_number=self.fake.numerify('+998#########'),
+                    password=password,
+                )
+                for i in batch
             )
 
-            assigned_categories = random.sample(categories, random.randint(1, 3))
-            for category in assigned_categories:
-                ProductCategory.objects.create(product=product, category=category)
+        self.stdout.write(self.style.SUCCESS(f'{count} users created (password: password123)'))
 
-            for _ in range(random.randint(1, 3)):
-                image_file = self.generate_fake_image()
-                ProductImage.objects.create(product=product, image=image_file)
+    def create_carts(self, count):
+        if not count:
+            return
+        users_without_cart = CustomUser.objects.filter(cart__isnull=True).order_by('id')
+        user_ids = list(users_without_cart.values_list('id', flat=True)[:count])
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        if not user_ids or not product_ids:
+            self.stdout.write(self.style.WARNING('Carts need users without a cart and products'))
+            return
 
-        self.stdout.write(self.style.SUCCESS(f'{count} products created with images and categories'))
+        for batch in batched(user_ids, self.batch_size):
+            with transaction.atomic():
+                carts = Cart.objects.bulk_create(Cart(user_id=user_id) for user_id in batch)
+                CartItem.objects.bulk_create(
+                    CartItem(cart=cart, product_id=product_id, quantity=self.rng.randint(1, 5))
+                    for cart in carts
+                    for product_id in self.rng.sample(product_ids, min(len(product_ids), self.rng.randint(1, 5)))
+                )
+                # bulk_create skips CartItem.save(), so totals are set in one UPDATE.
+                item_totals = (
+                    CartItem.objects.filter(cart=OuterRef('pk'))
+                    .values('cart')
+                    .annotate(total=Sum(F('product__price') * F('quantity')))
+                    .values('total')
+                )
+                Cart.objects.filter(pk__in=[cart.pk for cart in carts]).update(
+                    total_price=Coalesce(Subquery(item_totals), 0, output_field=DecimalField())
+                )
+
+        self.stdout.write(self.style.SUCCESS(f'{len(user_ids)} carts created'))
+
+    def create_orders(self, count):
+        if not count:
+            return
+        user_ids = list(CustomUser.objects.order_by('id').values_list('id', flat=True))
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        statuses = [choice for choice, _ in Order.STATUS_CHOICES]
+        if not user_ids or not product_ids:
+            self.stdout.write(self.style.WARNING('Orders need users and products'))
+            return
+
+        now = timezone.now()
+        for batch in batched(range(count), self.batch_size):
+            with transaction.atomic():
+                orders = Order.objects.bulk_create(self.new_order(user_ids, statuses, now) for _ in batch)
+                OrderItem.objects.bulk_create(
+                    OrderItem(order=order, product_id=product_id, quantity=self.rng.randint(1, 5))
+                    for order in orders
+                    for product_id in self.rng.sample(product_ids, min(len(product_ids), self.rng.randint(1, 5)))
+                )
 
-    def generate_fake_image(self):
+        # bulk_create skips Order.save(), so the leaderboards are counted afresh.
+        rebuild_sales()
+        self.stdout.write(self.style.SUCCESS(f'{count} orders created'))
 
-        image = Image.new('RGB', (300, 300), color=(random.randint(0,255), random.randint(0,255), random.randint(0,255)))
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG')
-        return ContentFile(buffer.getvalue(), name=fake.slug() + '.jpg')
+    def new_order(self, user_ids, statuses, now):
+        order = Order(user_id=self.rng.choice(user_ids), status=self.rng.choice(statuses))
+        if order.status == Order.COMPLETED:
+            # Spread over the last month, so every sales window has some.
+            order.completed_at = now - timedelta(minutes=self.rng.randint(0, 30 * 24 * 60))
+        return order
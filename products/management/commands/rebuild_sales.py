@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from products.models import ProductSales
+from products.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the hourly sales buckets and rolling sales counters from the completed orders'
+
+    def handle(self, *args, **options):
+        rebuild_sales()
+        self.stdout.write(self.style.SUCCESS(f'Sales counters rebuilt for {ProductSales.objects.count()} products'))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.recommendations import update_co_purchases
+
+
+class Command(BaseCommand):
+    help = 'Folds orders placed since the last run into the co-purchase counts and refreshes recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders per transaction')
+        parser.add_argument('--top-k', type=int, help='Recommendations kept per product')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        processed = update_co_purchases(batch_size=options['batch_size'], top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{processed} orders processed in {time.perf_counter() - started:.1f}s'
+        ))
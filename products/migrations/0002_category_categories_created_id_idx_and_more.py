@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['created_at', 'id'], name='categories_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='products_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='products_price_id_idx'),
+        ),
+    ]
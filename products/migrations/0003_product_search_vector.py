@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:36
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def build_search_vectors(apps, schema_editor):
+    from products.search import build_search_vector
+
+    Product = apps.get_model('products', 'Product')
+    ProductCategory = apps.get_model('products', 'ProductCategory')
+    Product.objects.update(search_vector=build_search_vector(ProductCategory))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_category_categories_created_id_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='products_search_vector_idx'),
+        ),
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+# pg_trgm ships with contrib and is not available on every server, so the
+# extension and its GIN indexes are only created where it can be installed.
+# Without them the name filters keep working as plain ``icontains``.
+CREATE_TRIGRAM_INDEXES = """
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON products USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS categories_name_trgm_idx ON categories USING gin (name gin_trgm_ops);
+    END IF;
+END
+$$;
+"""
+
+DROP_TRIGRAM_INDEXES = """
+DROP INDEX IF EXISTS products_name_trgm_idx;
+DROP INDEX IF EXISTS categories_name_trgm_idx;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productcategory',
+            index=models.Index(fields=['category', 'product'], name='product_cat_category_prod_idx'),
+        ),
+        migrations.RunSQL(CREATE_TRIGRAM_INDEXES, DROP_TRIGRAM_INDEXES),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
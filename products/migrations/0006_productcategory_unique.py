@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:50
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_links(apps, schema_editor):
+    ProductCategory = apps.get_model('products', 'ProductCategory')
+    first_links = (
+        ProductCategory.objects
+        .values('product_id', 'category_id')
+        .annotate(first_id=Min('id'))
+        .values('first_id')
+    )
+    ProductCategory.objects.exclude(pk__in=first_links).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_links, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productcategory',
+            constraint=models.UniqueConstraint(fields=('product', 'category'), name='product_categories_unique'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Cast, Concat
+
+
+def fill_root_paths(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    # Every existing category is a root.
+    Category.objects.update(path=Concat(Cast('id', models.CharField()), Value('/')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_productcategory_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='products.category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='categories_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(fill_root_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:32
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_category_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchaseWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.IntegerField(null=True)),
+                ('last_order_created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'product_co_purchase_watermark',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendation', serialize=False, to='products.product')),
+                ('product_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'product_recommendations',
+            },
+        ),
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField()),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'db_table': 'product_co_purchases',
+                'constraints': [models.UniqueConstraint(fields=('product', 'other'), name='product_co_purchases_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_co_purchases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesWindowWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'product_sales_watermark',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales', serialize=False, to='products.product')),
+                ('total', models.IntegerField(default=0)),
+                ('last_7_days', models.IntegerField(default=0)),
+                ('last_24_hours', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'product_sales',
+                'indexes': [models.Index(fields=['-total', 'product'], name='product_sales_total_idx'), models.Index(fields=['-last_7_days', 'product'], name='product_sales_7_days_idx'), models.Index(fields=['-last_24_hours', 'product'], name='product_sales_24_hours_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSalesBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'db_table': 'product_sales_buckets',
+                'indexes': [models.Index(fields=['hour'], name='product_sales_buckets_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'hour'), name='product_sales_buckets_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:43
+
+import shared.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_sales_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=shared.storage.content_addressed_storage, upload_to='product_images/'),
+        ),
+    ]
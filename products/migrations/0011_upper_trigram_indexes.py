@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# Django compiles icontains to UPPER(column) LIKE UPPER(pattern), which the
+# trigram indexes of migration 0004 on the bare columns cannot serve; those
+# stay for the ``%`` operator of the fuzzy matches. Only created where
+# pg_trgm is installed, like the others.
+CREATE_UPPER_TRIGRAM_INDEXES = """
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS products_name_upper_trgm_idx ON products USING gin (UPPER(name) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS categories_name_upper_trgm_idx ON categories USING gin (UPPER(name) gin_trgm_ops);
+    END IF;
+END
+$$;
+"""
+
+DROP_UPPER_TRIGRAM_INDEXES = """
+DROP INDEX IF EXISTS products_name_upper_trgm_idx;
+DROP INDEX IF EXISTS categories_name_upper_trgm_idx;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_UPPER_TRIGRAM_INDEXES, DROP_UPPER_TRIGRAM_INDEXES),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:38
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_upper_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
@@ -1,14 +1,25 @@
-from django.core.validators import MaxLengthValidator
-from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxLengthValidator, MinValueValidator
+from django.db import connection, models, transaction
+from django.db.models import Max, Subquery, Value
+from django.db.models.functions import Concat, Length, Replace, Substr
+from django.dispatch import Signal
 
 from shared.models import BaseModel
+from shared.storage import content_addressed_storage
 
 
 class Product(BaseModel):
     name = models.CharField(max_length=150, unique=True)
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     description = models.TextField(validators=[MaxLengthValidator(5000)])
     count = models.PositiveIntegerField(default=1)
+    # Weighted name/category/description document, kept up to date by
+    # products.signals. See products.search.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -17,10 +28,18 @@ class Product(BaseModel):
         db_table = 'products'
         verbose_name = 'product'
         verbose_name_plural = 'products'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='products_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='products_price_id_idx'),
+            GinIndex(fields=['search_vector'], name='products_search_vector_idx'),
+        ]
 
 class ProductImage(BaseModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='product_images/')
+    image = models.ImageField(upload_to='product_images/', storage=content_addressed_storage)
+    # Resized copies written by products.tasks.generate_image_variants:
+    # {variant: {'width': ..., 'webp': name, 'jpeg': name}}
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.product.name}'s image"
@@ -32,22 +51,246 @@ class ProductImage(BaseModel):
         verbose_name_plural = 'product images'
 
 
+# Sent after categories were created in bulk, where the per-row model
+# signals do not fire.
+categories_changed = Signal()
+
+
+class PatternGreaterThanOrEqual(models.Lookup):
+    """``~>=~``, the byte-wise comparison a ``varchar_pattern_ops`` index serves."""
+    lookup_name = 'pattern_gte'
+    operator = '~>=~'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} {self.operator} {rhs}', (*lhs_params, *rhs_params)
+
+
+class PatternLessThan(PatternGreaterThanOrEqual):
+    lookup_name = 'pattern_lt'
+    operator = '~<~'
+
+
+class CategoryQuerySet(models.QuerySet):
+    def subtree(self, category_id):
+        """
+        The category and all of its descendants, in one query. The root's
+        path is read by subqueries, so instead of ``LIKE`` with a pattern the
+        planner cannot see, the prefix match is the range of paths from
+        ``'1/5/'`` up to ``'1/50'`` ('/' sorts right before '0'), which the
+        ``path`` index serves.
+        """
+        root = self.model.objects.filter(pk=category_id)
+        upper = Concat(Substr('path', 1, Length('path') - 1), Value('0'), output_field=models.CharField())
+        return self.filter(
+            path__pattern_gte=Subquery(root.values('path')),
+            path__pattern_lt=Subquery(root.annotate(upper=upper).values('upper')),
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        created = [obj for obj in objs if obj.pk is not None]
+        if not created:
+            return objs
+
+        # Parents in the same batch must come before their children.
+        paths = dict(
+            self.model.objects.filter(pk__in={obj.parent_id for obj in created if obj.parent_id})
+            .values_list('pk', 'path')
+        )
+        for obj in created:
+            obj.path = f'{paths.get(obj.parent_id, "")}{obj.pk}/'
+            paths[obj.pk] = obj.path
+        self.model.objects.bulk_update(created, ['path'], batch_size=kwargs.get('batch_size'))
+        categories_changed.send(sender=self.model)
+        return objs
+
+
 class Category(BaseModel):
     name = models.CharField(max_length=150)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # Materialized path: the ids from the root down to this category, e.g.
+    # '1/5/12/'. A subtree is every category whose path starts with its
+    # root's. Maintained by save() and bulk_create().
+    path = models.CharField(max_length=255, editable=False, default='')
+
+    # Every level adds at most 20 characters to the path (a bigint id and
+    # '/'), so this many levels always fit in its 255.
+    MAX_DEPTH = 12
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        super().clean()
+        categories = Category.objects.all()
+        parent_path = ''
+        if self.parent_id is not None:
+            parent_path = categories.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+        old_path = ''
+        if not self._state.adding:
+            old_path = categories.filter(pk=self.pk).values_list('path', flat=True).first() or ''
+        if old_path and parent_path.startswith(old_path):
+            raise ValidationError({'parent': 'A category cannot be moved under itself or its descendants.'})
+
+        # The deepest category of the subtree ends up this many levels down.
+        depth = parent_path.count('/') + 1
+        if old_path:
+            slashes = Length('path') - Length(Replace('path', Value('/'), Value('')))
+            deepest = categories.filter(path__startswith=old_path).aggregate(depth=Max(slashes))['depth']
+            depth += deepest - old_path.count('/')
+        if depth > self.MAX_DEPTH:
+            raise ValidationError({'parent': f'Categories cannot be nested more than {self.MAX_DEPTH} levels deep.'})
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'parent' not in update_fields:
+            return super().save(*args, **kwargs)
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._move_subtree(adding)
+
+    def _move_subtree(self, adding):
+        categories = Category.objects.all()
+        # The stored path, the instance's own may be stale.
+        old_path = '' if adding else categories.filter(pk=self.pk).values_list('path', flat=True).get()
+        parent_path = ''
+        if self.parent_id is not None:
+            parent_path = categories.filter(pk=self.parent_id).values_list('path', flat=True).get()
+            # A guard only, clean() reports this to forms and the API.
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError('A category cannot be moved under itself or its descendants.')
+
+        path = f'{parent_path}{self.pk}/'
+        self.path = path
+        if path == old_path:
+            return
+        if not old_path:
+            categories.filter(pk=self.pk).update(path=path)
+            return
+        # One statement rewrites the prefix of the whole subtree.
+        categories.filter(path__startswith=old_path).update(
+            path=Concat(Value(path), Substr('path', len(old_path) + 1), output_field=models.CharField())
+        )
+
     class Meta:
         db_table = 'categories'
         verbose_name = 'category'
         verbose_name_plural = 'categories'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='categories_created_id_idx'),
+            # varchar_pattern_ops lets LIKE 'prefix%' use the index under any collation.
+            models.Index(fields=['path'], name='categories_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+
+Category._meta.get_field('path').register_lookup(PatternGreaterThanOrEqual)
+Category._meta.get_field('path').register_lookup(PatternLessThan)
+
+
+# Sent with ``product_ids`` after ProductCategory rows were added or removed
+# in bulk, where the per-row model signals do not fire.
+product_categories_changed = Signal()
+
+ASSIGN_LINKS_SQL = """
+    INSERT INTO product_categories (product_id, category_id, created_at, updated_at)
+    SELECT product_id, category_id, now(), now()
+    FROM unnest(%s::bigint[]) AS product_id CROSS JOIN unnest(%s::bigint[]) AS category_id
+    ON CONFLICT (product_id, category_id) DO NOTHING
+    RETURNING product_id
+"""
+
+UNASSIGN_LINKS_SQL = """
+    DELETE FROM product_categories
+    WHERE product_id = ANY(%s) AND category_id = ANY(%s)
+    RETURNING product_id
+"""
+
+DELETE_LINKS_SQL = "DELETE FROM product_categories WHERE id = ANY(%s) RETURNING product_id"
+
+
+class ProductCategoryManager(models.Manager):
+    """
+    Set-based link maintenance. Every method issues a fixed number of
+    statements regardless of how many links it touches, and links that
+    already exist are left alone.
+    """
+
+    def sync(self, wanted):
+        """
+        Make the links of each product match ``wanted``, a mapping of
+        ``product_id -> category ids``: one select, one delete of the removed
+        links and one insert of the added ones. Returns the ids of the
+        products whose links changed.
+        """
+        wanted = {product_id: set(category_ids) for product_id, category_ids in wanted.items()}
+        if not wanted:
+            return set()
+
+        removed = []
+        changed = set()
+        existing = self.filter(product_id__in=wanted).values_list('id', 'product_id', 'category_id')
+        for link_id, product_id, category_id in existing:
+            if category_id in wanted[product_id]:
+                wanted[product_id].discard(category_id)
+            else:
+                removed.append(link_id)
+                changed.add(product_id)
+
+        if removed:
+            self._execute(DELETE_LINKS_SQL, [removed])
+        self.bulk_create(
+            [
+                self.model(product_id=product_id, category_id=category_id)
+                for product_id, category_ids in wanted.items()
+                for category_id in category_ids
+            ],
+            ignore_conflicts=True,
+        )
+        changed.update(product_id for product_id, category_ids in wanted.items() if category_ids)
+        self._changed(changed)
+        return changed
+
+    def assign(self, product_ids, category_ids, batch_size=5000):
+        """
+        Link every product to every category, at most ``batch_size`` links
+        per statement. Returns the number of links added.
+        """
+        product_ids, category_ids = list(product_ids), list(category_ids)
+        step = max(1, batch_size // max(1, len(category_ids)))
+        added = []
+        for start in range(0, len(product_ids), step):
+            added += self._execute(ASSIGN_LINKS_SQL, [product_ids[start:start + step], category_ids])
+        self._changed(set(added))
+        return len(added)
+
+    def unassign(self, product_ids, category_ids):
+        """Remove the links between the products and categories. Returns the number of links removed."""
+        removed = self._execute(UNASSIGN_LINKS_SQL, [list(product_ids), list(category_ids)])
+        self._changed(set(removed))
+        return len(removed)
+
+    def _execute(self, sql, params):
+        # Plain SQL; the bulk signal below replaces the per-row ones.
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [product_id for product_id, in cursor.fetchall()]
+
+    def _changed(self, product_ids):
+        if product_ids:
+            product_categories_changed.send(sender=self.model, product_ids=list(product_ids))
 
 
 class ProductCategory(BaseModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_categories')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='product_categories')
 
+    objects = ProductCategoryManager()
+
     def __str__(self):
         return f"{self.category.name}'s products"
 
@@ -55,3 +298,90 @@ class ProductCategory(BaseModel):
         db_table = 'product_categories'
         verbose_name = 'product category'
         verbose_name_plural = 'product categories'
+        indexes = [
+            models.Index(fields=['category', 'product'], name='product_cat_category_prod_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'category'], name='product_categories_unique'),
+        ]
+
+
+class CoPurchase(models.Model):
+    """
+    Number of orders that contained both products. Every pair is stored in
+    both directions, so a product's neighbours are one index range.
+    Accumulated by products.recommendations.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = 'product_co_purchases'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='product_co_purchases_unique'),
+        ]
+
+
+class ProductRecommendation(models.Model):
+    """The top co-purchased products of a product, best first."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='recommendation')
+    product_ids = ArrayField(models.IntegerField(), default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_recommendations'
+
+
+class CoPurchaseWatermark(models.Model):
+    """Single row: the last order folded into the co-purchase counts."""
+    last_order_id = models.IntegerField(null=True)
+    last_order_created_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_co_purchase_watermark'
+
+
+class ProductSales(models.Model):
+    """
+    Rolling sales counters of a product, maintained incrementally by
+    products.sales from the hourly buckets below.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sales')
+    total = models.IntegerField(default=0)
+    last_7_days = models.IntegerField(default=0)
+    last_24_hours = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'product_sales'
+        indexes = [
+            models.Index(fields=['-total', 'product'], name='product_sales_total_idx'),
+            models.Index(fields=['-last_7_days', 'product'], name='product_sales_7_days_idx'),
+            models.Index(fields=['-last_24_hours', 'product'], name='product_sales_24_hours_idx'),
+        ]
+
+
+class ProductSalesBucket(models.Model):
+    """Units of a product sold in the hour starting at ``hour``."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    hour = models.DateTimeField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'product_sales_buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'hour'], name='product_sales_buckets_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='product_sales_buckets_hour_idx'),
+        ]
+
+
+class SalesWindowWatermark(models.Model):
+    """Single row: the hour the rolling sales windows currently end at."""
+    hour = models.DateTimeField()
+
+    class Meta:
+        db_table = 'product_sales_watermark'
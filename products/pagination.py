@@ -1,7 +1,235 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages on an indexed ``(field, id)`` tuple instead of ``OFFSET``, so every
+    page costs the same no matter how deep it is. No ``COUNT(*)`` is run.
+
+    The view may set ``keyset_fields`` (fields that can lead the ordering,
+    each one needs a ``(field, id)`` index) and ``keyset_ordering`` (the
+    default ordering). If the view uses ``OrderingFilter``, the requested
+    ordering is used as long as its first field is a keyset field.
+
+    Results ranked by relevance (``search_products``) are rejected: a cursor
+    can only follow a keyset ordering, which would drop the ranking.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    keyset_fields = ('created_at', 'price', 'id')
+    keyset_ordering = '-created_at'
+    invalid_cursor_message = 'Invalid cursor'
+    ranked_message = 'Search results are ordered by relevance and can only be paged by page number.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if 'search_rank' in queryset.query.annotations:
+            raise ValidationError({'pagination': self.ranked_message})
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        cursor = self.decode_cursor(request)
+        self.has_cursor = cursor is not None
+        self.reverse = bool(cursor and cursor['reverse'])
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(self._invert(term) for term in ordering)
+
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_position_filter(queryset.model, ordering, cursor['position']))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = self.has_cursor
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.has_cursor
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        keyset_fields = getattr(view, 'keyset_fields', self.keyset_fields)
+        ordering = getattr(view, 'keyset_ordering', self.keyset_ordering)
+
+        backends = getattr(view, 'filter_backends', ())
+        if view is not None and any(issubclass(backend, OrderingFilter) for backend in backends):
+            requested = OrderingFilter().get_ordering(request, queryset, view)
+            if requested and requested[0] != ordering:
+                if requested[0].lstrip('-') not in keyset_fields:
+                    raise ValidationError({
+                        'ordering': f'Keyset pagination can only order by {", ".join(keyset_fields)}.'
+                    })
+                ordering = requested[0]
+
+        # ``id`` breaks ties in the same direction, so the tuple is unique.
+        tiebreaker = '-id' if ordering.startswith('-') else 'id'
+        if ordering.lstrip('-') == 'id':
+            return (tiebreaker,)
+        return (ordering, tiebreaker)
+
+    def get_position_filter(self, model, ordering, position):
+        """
+        Row-value comparison ``(a, id) > (x, y)`` spelled as
+        ``a > x OR (a = x AND id > y)`` so the ``(a, id)`` index is used.
+        """
+        position_filter = Q()
+        equal = Q()
+        for term, value in zip(ordering, position):
+            name = term.lstrip('-')
+            lookup = 'lt' if term.startswith('-') else 'gt'
+            field = model._meta.get_field(name)
+            try:
+                value = field.to_python(value)
+            except DjangoValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            position_filter |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return position_filter
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position = cursor['p']
+            reverse = bool(cursor.get('r'))
+            ordering = tuple(cursor['o'])
+        except (TypeError, ValueError, KeyError, UnicodeError, BinasciiError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor is only meaningful for the ordering it was issued for.
+        if ordering != self.ordering or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return {'position': position, 'reverse': reverse}
+
+    def encode_cursor(self, instance, reverse):
+        position = [str(self._position_value(instance, term.lstrip('-'))) for term in self.ordering]
+        cursor = {'p': position, 'o': self.ordering}
+        if reverse:
+            cursor['r'] = 1
+        encoded = b64encode(json.dumps(cursor, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def _position_value(instance, name):
+        # Fast list paths paginate values() rows instead of instances.
+        return instance[name] if isinstance(instance, dict) else getattr(instance, name)
+
+    @staticmethod
+    def _invert(term):
+        return term[1:] if term.startswith('-') else f'-{term}'
+
+
+class SelectablePagination(BasePagination):
+    """
+    Page-number pagination by default and keyset pagination on request.
+
+    Keyset mode is used when the request carries a ``cursor``, asks for
+    ``?pagination=keyset``, or the view sets ``pagination_mode = 'keyset'``.
+    """
+    mode_query_param = 'pagination'
+    page_number_class = CustomPagination
+    keyset_class = KeysetPagination
+
+    def __init__(self):
+        self.paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request, view):
+            self.paginator = self.keyset_class()
+        else:
+            self.paginator = self.page_number_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def use_keyset(self, request, view):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            return True
+        mode = request.query_params.get(self.mode_query_param) or getattr(view, 'pagination_mode', 'page')
+        return mode == 'keyset'
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number_class().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.page_number_class().get_schema_operation_parameters(view)
+            + self.keyset_class().get_schema_operation_parameters(view)
+        )
+
+    def to_html(self):
+        return self.paginator.to_html() if self.paginator else ''
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from products.cache import bump_catalog_version
+from products.models import CoPurchaseWatermark, ProductRecommendation
+
+# Orders younger than this are left for the next run, so an order whose
+# transaction commits late cannot slip in behind the watermark.
+SETTLE_TIME = timedelta(minutes=5)
+
+ADD_PAIRS_SQL = """
+    INSERT INTO product_co_purchases (product_id, other_id, orders)
+    SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+    FROM order_items a
+    JOIN order_items b ON b.order_id = a.order_id AND b.product_id <> a.product_id
+    WHERE a.order_id = ANY(%s)
+    GROUP BY a.product_id, b.product_id
+    ON CONFLICT (product_id, other_id) DO UPDATE SET orders = product_co_purchases.orders + EXCLUDED.orders
+"""
+
+TOP_K_SQL = """
+    INSERT INTO product_recommendations (product_id, product_ids, updated_at)
+    SELECT product_id, (array_agg(other_id ORDER BY orders DESC, other_id))[1:%s], now()
+    FROM product_co_purchases
+    WHERE product_id = ANY(%s)
+    GROUP BY product_id
+    ON CONFLICT (product_id) DO UPDATE SET product_ids = EXCLUDED.product_ids, updated_at = EXCLUDED.updated_at
+"""
+
+
+def update_co_purchases(batch_size=1000, top_k=None):
+    """
+    Fold the orders placed since the last run into the co-purchase counts and
+    refresh the top-K of every product they touched. Orders are streamed in
+    ``(created_at, id)`` order, each batch in one transaction with the
+    watermark, so an interrupted run resumes where it stopped. Counting is
+    left to the database: one grouped self-join per batch, however many
+    pairs it produces. Returns the number of orders processed.
+    """
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    cutoff = timezone.now() - SETTLE_TIME
+    processed = 0
+    while True:
+        with transaction.atomic():
+            # The lock keeps concurrent runs from counting a batch twice.
+            watermark, _ = CoPurchaseWatermark.objects.select_for_update().get_or_create(pk=1)
+            orders = Order.objects.exclude(status=Order.CANCELLED).filter(created_at__lt=cutoff)
+            if watermark.last_order_id is not None:
+                orders = orders.filter(
+                    Q(created_at__gt=watermark.last_order_created_at)
+                    | Q(created_at=watermark.last_order_created_at, id__gt=watermark.last_order_id)
+                )
+            batch = list(orders.order_by('created_at', 'id').values_list('id', 'created_at')[:batch_size])
+            if not batch:
+                break
+
+            order_ids = [order_id for order_id, _ in batch]
+            with connection.cursor() as cursor:
+                cursor.execute(ADD_PAIRS_SQL, [order_ids])
+            items = OrderItem.objects.filter(order_id__in=order_ids).order_by()
+            product_ids = list(items.values_list('product_id', flat=True).distinct())
+            refresh_recommendations(product_ids, top_k)
+
+            watermark.last_order_id, watermark.last_order_created_at = batch[-1]
+            watermark.save()
+        processed += len(batch)
+
+    if processed:
+        # Recommendation responses are cached with the catalog.
+        bump_catalog_version()
+    return processed
+
+
+def refresh_recommendations(product_ids, top_k):
+    """Recompute the stored top-K neighbours of ``product_ids`` in one statement."""
+    if product_ids:
+        with connection.cursor() as cursor:
+            cursor.execute(TOP_K_SQL, [top_k, list(product_ids)])
+
+
+def recommended_product_ids(product_id):
+    """The stored recommendations of a product, one primary key lookup."""
+    ids = ProductRecommendation.objects.filter(pk=product_id).values_list('product_ids', flat=True).first()
+    return ids or []
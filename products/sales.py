@@ -0,0 +1,139 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from orders.models import Order
+from products.models import ProductSales, ProductSalesBucket, SalesWindowWatermark
+
+DAY = timedelta(hours=24)
+WEEK = timedelta(days=7)
+
+# ?window= of the leaderboards -> ProductSales counter.
+SALES_WINDOWS = {
+    'all': 'total',
+    '7d': 'last_7_days',
+    '24h': 'last_24_hours',
+}
+
+RECORD_BUCKETS_SQL = """
+    INSERT INTO product_sales_buckets (product_id, hour, quantity)
+    SELECT product_id, %s, quantity FROM unnest(%s::bigint[], %s::integer[]) AS line (product_id, quantity)
+    ON CONFLICT (product_id, hour) DO UPDATE SET quantity = product_sales_buckets.quantity + EXCLUDED.quantity
+"""
+
+RECORD_COUNTERS_SQL = """
+    INSERT INTO product_sales (product_id, total, last_7_days, last_24_hours)
+    SELECT * FROM unnest(%s::bigint[], %s::integer[], %s::integer[], %s::integer[])
+    ON CONFLICT (product_id) DO UPDATE SET
+        total = product_sales.total + EXCLUDED.total,
+        last_7_days = product_sales.last_7_days + EXCLUDED.last_7_days,
+        last_24_hours = product_sales.last_24_hours + EXCLUDED.last_24_hours
+"""
+
+# {column} is one of the window counters, never user input.
+SLIDE_SQL = """
+    UPDATE product_sales SET {column} = product_sales.{column} - expired.quantity
+    FROM (
+        SELECT product_id, SUM(quantity) AS quantity FROM product_sales_buckets
+        WHERE hour > %s AND hour <= %s
+        GROUP BY product_id
+    ) AS expired
+    WHERE product_sales.product_id = expired.product_id
+"""
+
+REBUILD_BUCKETS_SQL = """
+    INSERT INTO product_sales_buckets (product_id, hour, quantity)
+    SELECT item.product_id, date_trunc('hour', orders.completed_at), SUM(item.quantity)
+    FROM order_items item
+    JOIN orders ON orders.id = item.order_id
+    WHERE orders.status = %s AND orders.completed_at IS NOT NULL
+    GROUP BY 1, 2
+"""
+
+REBUILD_COUNTERS_SQL = """
+    INSERT INTO product_sales (product_id, total, last_7_days, last_24_hours)
+    SELECT product_id, SUM(quantity),
+           COALESCE(SUM(quantity) FILTER (WHERE hour > %s), 0),
+           COALESCE(SUM(quantity) FILTER (WHERE hour > %s), 0)
+    FROM product_sales_buckets
+    GROUP BY product_id
+"""
+
+
+def truncate_to_hour(value):
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _window_end(lock):
+    """
+    The hour the windows end at. Sales take a shared lock on it and the
+    slide an exclusive one, so a sale is never judged against a window that
+    is moving at the same time.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT hour FROM product_sales_watermark WHERE id = 1 {lock}')
+        row = cursor.fetchone()
+    if row is None:
+        SalesWindowWatermark.objects.get_or_create(pk=1, defaults={'hour': truncate_to_hour(timezone.now())})
+        return _window_end(lock)
+    return row[0]
+
+
+def record_sales(lines, sold_at, sign=1):
+    """
+    Count ``{product_id: quantity}`` as sold at ``sold_at``, or take them
+    back with ``sign=-1``. Two upserts, however many lines: the hour's
+    bucket and the product counters, whose windows only get the units when
+    the bucket is inside them. Must run in a transaction.
+    """
+    if not lines:
+        return
+    hour = truncate_to_hour(sold_at)
+    window_end = _window_end('FOR SHARE')
+
+    product_ids = sorted(lines)
+    quantities = [sign * lines[pk] for pk in product_ids]
+    last_7_days = quantities if hour > window_end - WEEK else [0] * len(quantities)
+    last_24_hours = quantities if hour > window_end - DAY else [0] * len(quantities)
+    with connection.cursor() as cursor:
+        cursor.execute(RECORD_BUCKETS_SQL, [hour, product_ids, quantities])
+        cursor.execute(RECORD_COUNTERS_SQL, [product_ids, quantities, last_7_days, last_24_hours])
+
+
+@transaction.atomic
+def slide_sales_windows():
+    """
+    Move the windows' end up to the current hour. Only the buckets that fell
+    out of a window are read, one grouped UPDATE per window, so the cost
+    does not depend on how much history there is. Returns the hours moved.
+    """
+    start = _window_end('FOR UPDATE')
+    end = truncate_to_hour(timezone.now())
+    if end <= start:
+        return 0
+    with connection.cursor() as cursor:
+        for column, length in (('last_7_days', WEEK), ('last_24_hours', DAY)):
+            cursor.execute(SLIDE_SQL.format(column=column), [start - length, end - length])
+    SalesWindowWatermark.objects.filter(pk=1).update(hour=end)
+    return int((end - start) / timedelta(hours=1))
+
+
+@transaction.atomic
+def rebuild_sales():
+    """Recompute every bucket and counter from the completed orders."""
+    _window_end('FOR UPDATE')
+    end = truncate_to_hour(timezone.now())
+    ProductSalesBucket.objects.all().delete()
+    ProductSales.objects.all().delete()
+    with connection.cursor() as cursor:
+        cursor.execute(REBUILD_BUCKETS_SQL, [Order.COMPLETED])
+        cursor.execute(REBUILD_COUNTERS_SQL, [end - WEEK, end - DAY])
+    SalesWindowWatermark.objects.filter(pk=1).update(hour=end)
+
+
+def top_sellers(window, limit):
+    """``[(product_id, units sold)]`` of the best sellers in ``window``, from the counter's index."""
+    counter = SALES_WINDOWS[window]
+    sales = ProductSales.objects.filter(**{f'{counter}__gt': 0}).order_by(f'-{counter}', 'product_id')
+    return list(sales.values_list('product_id', counter)[:limit])
@@ -0,0 +1,153 @@
+from functools import lru_cache
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
+from django.db import connection
+from django.db.models import (Case, Exists, F, FloatField, OuterRef, Q,
+                              Subquery, TextField, Value, When)
+from django.db.models.functions import Coalesce
+from rest_framework.filters import BaseFilterBackend
+
+from products.models import Category, Product, ProductCategory
+
+SEARCH_CONFIG = 'english'
+
+# Fields that feed the search document. Saving a product without touching
+# any of them leaves its vector alone.
+SEARCH_SOURCE_FIELDS = frozenset({'name', 'description'})
+
+
+def build_search_vector(product_category_model=ProductCategory):
+    """
+    Expression for a product's search document: name (A), category names (B)
+    and description (C). Evaluated entirely in the database, so it can be
+    used in ``UPDATE`` statements over any number of rows.
+    """
+    category_names = Subquery(
+        product_category_model.objects
+        .filter(product=OuterRef('pk'))
+        .values('product')
+        .annotate(names=StringAgg('category__name', delimiter=' '))
+        .values('names')
+    )
+    category_names = Coalesce(category_names, Value(''), output_field=TextField())
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(category_names, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(product_ids=None):
+    """
+    Rebuild the search vector of the given products (a list or a values
+    queryset of ids) in a single statement, or of every product if None.
+    """
+    queryset = Product.objects.all()
+    if product_ids is not None:
+        queryset = queryset.filter(pk__in=product_ids)
+    return queryset.update(search_vector=build_search_vector())
+
+
+def search_products(queryset, query):
+    """
+    Restrict ``queryset`` to products matching the web-style ``query`` and
+    order them by relevance. The match uses the GIN index on the vector.
+    """
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    return (
+        queryset
+        .filter(search_vector=search_query)
+        .annotate(search_rank=SearchRank(F('search_vector'), search_query))
+        .order_by('-search_rank', 'id')
+    )
+
+
+@lru_cache(maxsize=None)
+def trigram_enabled():
+    """
+    Whether pg_trgm is installed. The trigram indexes are only created
+    where the extension is available, see migration 0004.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def filter_by_name(queryset, field, value):
+    """
+    ``icontains`` on ``field``. If nothing matches and pg_trgm is available,
+    the similar values are returned instead, best match first, so typos
+    still find something. Either way it is a single query: Django compiles
+    ``icontains`` to ``UPPER(field) LIKE UPPER(...)``, served by the trigram
+    index on ``UPPER(field)``, and the fuzzy ``%`` match of the
+    ``trigram_similar`` lookup by the one on ``field`` (migration 0011). The
+    fuzzy branch is guarded by an uncorrelated ``NOT EXISTS`` on the exact
+    match, which the database evaluates once.
+    """
+    exact = Q(**{f'{field}__icontains': value})
+    if not trigram_enabled():
+        return queryset.filter(exact)
+
+    has_exact = Exists(queryset.filter(exact))
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    fuzzy_rank = Case(When(has_exact, then=Value(0.0)), default=-TrigramSimilarity(field, value),
+                      output_field=FloatField())
+    return (
+        queryset
+        .filter(exact | (Q(**{f'{field}__trigram_similar': value}) & ~has_exact))
+        .order_by(fuzzy_rank, *ordering, 'id')
+    )
+
+
+def resolve_category_ids(name):
+    """
+    Ids of the categories whose name matches ``name``, resolved up front so
+    product queries filter on ``category_id`` instead of joining names.
+    """
+    return list(filter_by_name(Category.objects.all(), 'name', name).values_list('id', flat=True))
+
+
+def suggest_product_names(query, limit=5):
+    """Product names most similar to ``query``, for "did you mean" hints."""
+    if not trigram_enabled():
+        return []
+    # trigram_similar is the indexable ``%`` operator; similarity() is only
+    # computed for the rows it lets through.
+    return list(
+        Product.objects
+        .filter(name__trigram_similar=query)
+        .annotate(similarity=TrigramSimilarity('name', query))
+        .order_by('-similarity', 'id')
+        .values_list('name', flat=True)[:limit]
+    )
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    Full-text search over the maintained product search vector, ranked by
+    relevance. Uses the same ``search`` parameter as DRF's ``SearchFilter``.
+    """
+    search_param = 'search'
+    search_description = 'Full-text search over product name, categories and description.'
+
+    def get_search_query(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if not query:
+            return queryset
+        return search_products(queryset, query)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': self.search_description,
+                'schema': {'type': 'string'},
+            },
+        ]
@@ -1,40 +1,158 @@
+from collections import Counter
+from copy import copy
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils import timezone
 from rest_framework import serializers
 
-from products.models import Category, Product, ProductCategory, ProductImage
+from carts.models import Cart, CartItem
+from orders.models import OrderItem
+from products.cache import bump_catalog_version
+from products.images import build_srcset, build_srcset_from_values
+from products.models import (Category, Product, ProductCategory, ProductImage,
+                             product_categories_changed)
+from products.search import SEARCH_SOURCE_FIELDS, update_search_vectors
+from shared.serializers import (DeduplicatedImageField, FastRepresentation,
+                                FieldSelection, SparseFieldsMixin)
+from shared.storage import add_blob_references
+
+DELETE_IMAGES_SQL = "DELETE FROM product_images WHERE product_id = ANY(%s) RETURNING image"
 
+DELETE_LINKS_SQL = "DELETE FROM product_categories WHERE product_id = ANY(%s)"
 
-class CategorySerializer(serializers.ModelSerializer):
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ('id', 'name')
+        fields = ('id', 'name', 'parent')
         extra_kwargs = {
             "id": {"read_only": True},
         }
 
+    def validate_parent(self, value):
+        category = copy(self.instance) if self.instance is not None else Category()
+        category.parent = value
+        try:
+            category.clean()
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(error.message_dict['parent'])
+        return value
+
+
+class ProductImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image = DeduplicatedImageField(write_only=True)
 
-class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
         fields = ('id', 'image', 'product')
         extra_kwargs = {
             "id": {"read_only": True},
-            "image": {"write_only": True},
         }
 
 
-class ProductCategorySerializer(serializers.ModelSerializer):
+class ProductCategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
+    category_id = serializers.PrimaryKeyRelatedField(
+        queryset=Category.objects.all(),
+        source='category',
+        write_only=True
+    )
 
     class Meta:
         model = ProductCategory
-        fields = ('id', 'product', 'category')
+        fields = ('id', 'product', 'category', 'category_id')
         extra_kwargs = {
             "id": {"read_only": True},
         }
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductCategoryBulkSerializer(serializers.Serializer):
+    ASSIGN = 'assign'
+    UNASSIGN = 'unassign'
+
+    action = serializers.ChoiceField(choices=[ASSIGN, UNASSIGN])
+    product_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                        max_length=10000)
+    category_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                         max_length=100)
+
+    def validate_product_ids(self, value):
+        return self._existing(Product, value)
+
+    def validate_category_ids(self, value):
+        return self._existing(Category, value)
+
+    def _existing(self, model, ids):
+        # One query for the whole list instead of one per id.
+        ids = set(ids)
+        missing = ids - set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Invalid ids: {', '.join(map(str, sorted(missing)))}")
+        return sorted(ids)
+
+    def save(self, **kwargs):
+        data = self.validated_data
+        if data['action'] == self.ASSIGN:
+            count = ProductCategory.objects.assign(data['product_ids'], data['category_ids'])
+        else:
+            count = ProductCategory.objects.unassign(data['product_ids'], data['category_ids'])
+        return count
+
+
+class ProductImageFastRepresentation(FastRepresentation):
+    pass
+
+
+class ProductFastRepresentation(FastRepresentation):
+    nested_representations = {
+        'product_images': ProductImageFastRepresentation,
+    }
+
+    def load(self, rows):
+        product_ids = [row['id'] for row in rows]
+        selected = {name for name, _ in self.plan}
+        self.images = {}
+        self.srcsets = {}
+        self.categories = {}
+
+        nested = self.nested.get('product_images')
+        if nested is not None or 'image_srcset' in selected:
+            # One query feeds both image fields, like the prefetch does.
+            columns = {'id', 'product_id', 'image', 'variants'} | (nested.columns if nested else set())
+            images = list(ProductImage.objects.filter(product_id__in=product_ids).order_by('id').values(*columns))
+            request = self.context.get('request')
+            represented = nested.represent(images) if nested is not None else images
+            for image, data in zip(images, represented):
+                self.images.setdefault(image['product_id'], []).append(data)
+                self.srcsets.setdefault(image['product_id'], []).append(
+                    build_srcset_from_values(image['id'], image['image'], image['variants'], request)
+                )
+
+        if 'category_names' in selected:
+            links = (
+                ProductCategory.objects.filter(product_id__in=product_ids).order_by('id')
+                .values_list('product_id', 'category_id', 'category__name', 'category__parent_id')
+            )
+            for product_id, category_id, name, parent_id in links:
+                self.categories.setdefault(product_id, []).append(
+                    {'id': category_id, 'name': name, 'parent': parent_id}
+                )
+
+    def represent_product_images(self, row):
+        return self.images.get(row['id'], [])
+
+    def represent_image_srcset(self, row):
+        return self.srcsets.get(row['id'], [])
+
+    def represent_category_names(self, row):
+        return self.categories.get(row['id'], [])
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_images = ProductImageSerializer(source='images', many=True, read_only=True)
+    image_srcset = serializers.SerializerMethodField()
     category_names = serializers.SerializerMethodField()
     category_ids = serializers.PrimaryKeyRelatedField(
         many=True,
@@ -45,24 +163,218 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'price', 'description', 'product_images', 'category_names', 'category_ids')
+        fields = ('id', 'name', 'price', 'description', 'product_images', 'image_srcset', 'category_names',
+                  'category_ids')
         extra_kwargs = {
             "id": {"read_only": True},
         }
 
+    fast_representation_class = ProductFastRepresentation
+
+    @classmethod
+    def get_prefetch_plan(cls, prefix='', selection=None):
+        """
+        Lookups that have to be prefetched for this serializer to run without
+        extra queries. ``prefix`` is the path to the product from the queryset
+        being prefetched, e.g. ``'product__'`` for cart items. Relations only
+        read by fields left out of ``selection`` are skipped.
+        """
+        selection = selection or FieldSelection()
+        plan = []
+        if selection.includes('product_images') or selection.includes('image_srcset'):
+            plan.append(Prefetch(f'{prefix}images', queryset=ProductImage.objects.order_by('id')))
+        if selection.includes('category_names'):
+            plan.append(Prefetch(f'{prefix}product_categories',
+                                 queryset=ProductCategory.objects.select_related('category').order_by('id')))
+        return plan
+
+    def get_image_srcset(self, obj):
+        request = self.context.get('request')
+        return [build_srcset(image, request) for image in obj.images.all()]
+
     def get_category_names(self, obj):
-        categories = Category.objects.filter(product_categories__product=obj)
+        categories = [link.category for link in obj.product_categories.all()]
         return CategorySerializer(categories, many=True).data
 
+    def create(self, validated_data):
+        categories = validated_data.pop('category_ids', None)
+        instance = super().create(validated_data)
+
+        if categories:
+            ProductCategory.objects.sync({instance.pk: [category.pk for category in categories]})
+
+        return instance
+
     def update(self, instance, validated_data):
-        category_ids = validated_data.pop('category_ids', None)
+        categories = validated_data.pop('category_ids', None)
         instance = super().update(instance, validated_data)
 
-        if category_ids is not None:
-
-            ProductCategory.objects.filter(product=instance).delete()
-            for category in category_ids:
-                ProductCategory.objects.create(product=instance, category=category)
+        if categories is not None:
+            ProductCategory.objects.sync({instance.pk: [category.pk for category in categories]})
 
         return instance
 
+
+class ProductSearchSerializer(ProductSerializer):
+    rank = serializers.FloatField(source='search_rank', read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ('rank',)
+
+
+class ProductBatchItemSerializer(serializers.ModelSerializer):
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    op = serializers.ChoiceField(choices=[CREATE, UPDATE, DELETE])
+    id = serializers.IntegerField(min_value=1, required=False)
+
+    class Meta:
+        model = Product
+        fields = ('op', 'id', 'name', 'price', 'description', 'count')
+        extra_kwargs = {
+            # Uniqueness is checked for the whole batch at once.
+            "name": {"required": False, "validators": []},
+            "price": {"required": False},
+            "description": {"required": False},
+        }
+
+    def validate(self, attrs):
+        if attrs['op'] == self.CREATE:
+            if 'id' in attrs:
+                raise serializers.ValidationError({"id": "Not allowed when creating a product."})
+            missing = [field for field in ('name', 'price', 'description') if field not in attrs]
+            if missing:
+                raise serializers.ValidationError({field: "This field is required." for field in missing})
+        elif 'id' not in attrs:
+            raise serializers.ValidationError({"id": "This field is required."})
+        return attrs
+
+
+class ProductBatchSerializer(serializers.Serializer):
+    """
+    Applies a list of create/update/delete operations with one lookup query
+    and one statement per operation type. Invalid items are reported in the
+    results and skipped, the valid ones are applied together.
+    """
+    operations = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=10000)
+
+    def save(self, **kwargs):
+        results = []
+        items = []
+        for index, data in enumerate(self.validated_data['operations']):
+            item = ProductBatchItemSerializer(data=data)
+            if item.is_valid():
+                items.append((index, item.validated_data))
+                results.append({'index': index, 'op': item.validated_data['op'], 'status': None})
+            else:
+                results.append({'index': index, 'op': data.get('op'), 'status': 'error', 'errors': item.errors})
+
+        ids = {data['id'] for _, data in items if 'id' in data}
+        names = {data['name'] for _, data in items if 'name' in data}
+        products = Product.objects.defer('search_vector').filter(Q(pk__in=ids) | Q(name__in=names)).annotate(
+            ordered=Exists(OrderItem.objects.filter(product=OuterRef('pk'))),
+        )
+        by_id = {}
+        taken_names = {}
+        for product in products:
+            by_id[product.pk] = product
+            taken_names[product.name] = product.pk
+
+        created, updated, deleted = [], {}, set()
+        updated_fields = set()
+        now = timezone.now()
+        for index, data in items:
+            op = data.pop('op')
+            error = self._check(op, data, by_id, taken_names, updated, deleted)
+            if error:
+                results[index].update(status='error', errors=error)
+                continue
+
+            if op == ProductBatchItemSerializer.CREATE:
+                product = Product(**data)
+                created.append((index, product))
+                taken_names[product.name] = None
+                continue
+
+            product = by_id[data.pop('id')]
+            if op == ProductBatchItemSerializer.DELETE:
+                deleted.add(product.pk)
+                results[index].update(id=product.pk, status='deleted')
+                continue
+
+            if 'name' in data:
+                taken_names.pop(product.name, None)
+                taken_names[data['name']] = product.pk
+            for field, value in data.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            updated[product.pk] = product
+            updated_fields.update(data)
+            results[index].update(id=product.pk, status='updated')
+
+        if created:
+            Product.objects.bulk_create([product for _, product in created])
+            for index, product in created:
+                results[index].update(id=product.pk, status='created')
+        if updated:
+            Product.objects.bulk_update(list(updated.values()), [*updated_fields, 'updated_at'])
+        if deleted:
+            self._delete(deleted)
+
+        refreshed = [product.pk for _, product in created]
+        if SEARCH_SOURCE_FIELDS & updated_fields:
+            refreshed.extend(updated)
+        if refreshed:
+            update_search_vectors(refreshed)
+        if created or updated or deleted:
+            bump_catalog_version()
+        return results
+
+    def _delete(self, product_ids):
+        """
+        Delete the products in a fixed number of queries. Their images and
+        links go first as plain DELETEs instead of the cascade's per-row
+        signals: the blobs are released in one upsert and the link change
+        is announced with the bulk signal. Cart lines are removed up front
+        so their carts are repriced once; ``_check`` keeps ordered products
+        out of here.
+        """
+        product_ids = sorted(product_ids)
+        cart_items = CartItem.objects.filter(product_id__in=product_ids)
+        # Carts are locked before their items, in id order, as Cart.lock does.
+        cart_ids = list(
+            Cart.objects.filter(pk__in=cart_items.values('cart_id')).order_by('pk')
+            .select_for_update(no_key=True).values_list('pk', flat=True)
+        )
+        cart_items.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(DELETE_IMAGES_SQL, [product_ids])
+            released = Counter(name for name, in cursor.fetchall())
+            cursor.execute(DELETE_LINKS_SQL, [product_ids])
+        add_blob_references({name: -count for name, count in released.items()})
+        Product.objects.filter(pk__in=product_ids).delete()
+        if cart_ids:
+            Cart.objects.filter(pk__in=cart_ids).update_total_prices()
+        product_categories_changed.send(sender=ProductCategory, product_ids=product_ids)
+
+    def _check(self, op, data, by_id, taken_names, updated, deleted):
+        product_id = data.get('id')
+        if op != ProductBatchItemSerializer.CREATE:
+            if product_id not in by_id or product_id in deleted:
+                return {"id": f"Product {product_id} does not exist."}
+            if op == ProductBatchItemSerializer.DELETE and product_id in updated:
+                return {"id": f"Product {product_id} is already updated in this batch."}
+            if op == ProductBatchItemSerializer.DELETE and by_id[product_id].ordered:
+                return {"id": f"Product {product_id} has orders and cannot be deleted."}
+        if op == ProductBatchItemSerializer.DELETE:
+            return None
+        name = data.get('name')
+        if op == ProductBatchItemSerializer.CREATE:
+            conflict = name in taken_names
+        else:
+            conflict = name is not None and taken_names.get(name, product_id) != product_id
+        if conflict:
+            return {"name": "product with this name already exists."}
+        return None
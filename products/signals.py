@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from products.cache import bump_catalog_version
+from products.categories import invalidate_category_tree
+from products.models import (Category, Product, ProductCategory, ProductImage,
+                             categories_changed, product_categories_changed)
+from products.search import SEARCH_SOURCE_FIELDS, update_search_vectors
+from products.tasks import generate_image_variants
+from shared.storage import previous_blob_name, track_blob_references
+
+track_blob_references(ProductImage, 'image')
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=ProductCategory)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_tree_cache(sender, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(categories_changed)
+def update_bulk_created_categories(sender, **kwargs):
+    invalidate_category_tree()
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_SOURCE_FIELDS & set(update_fields):
+        return
+    update_search_vectors([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductCategory)
+def update_linked_product_search_vector(sender, instance, **kwargs):
+    update_search_vectors([instance.product_id])
+
+
+@receiver(product_categories_changed)
+def update_relinked_products(sender, product_ids, **kwargs):
+    update_search_vectors(product_ids)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Category)
+def update_category_products_search_vector(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return
+    update_search_vectors(
+        ProductCategory.objects.filter(category=instance).values('product_id')
+    )
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    # Only a new picture needs new variants.
+    if instance.image.name == previous_blob_name(instance, 'image'):
+        return
+    image_id = instance.pk
+    transaction.on_commit(lambda: generate_image_variants.delay(image_id))
@@ -0,0 +1,33 @@
+from config.celery import app
+from products.cache import bump_catalog_version
+from products.images import read_image, render_variants, store_variants
+from products.models import ProductImage
+from products.recommendations import update_co_purchases
+from products.sales import slide_sales_windows
+
+
+@app.task
+def generate_image_variants(image_id):
+    image_name = ProductImage.objects.filter(pk=image_id).values_list('image', flat=True).first()
+    if not image_name:
+        return
+
+    # Rows sharing a content-addressed file share its variants as well.
+    variants = (
+        ProductImage.objects.filter(image=image_name).exclude(variants={})
+        .values_list('variants', flat=True).first()
+    )
+    if variants is None:
+        variants = store_variants(image_name, render_variants(read_image(image_name)))
+    ProductImage.objects.filter(pk=image_id, image=image_name).update(variants=variants)
+    bump_catalog_version()
+
+
+@app.task
+def update_product_recommendations(batch_size=1000):
+    return update_co_purchases(batch_size=batch_size)
+
+
+@app.task
+def slide_product_sales_windows():
+    return slide_sales_windows()
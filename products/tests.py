@@ -1,10 +1,37 @@
+import json
+import tempfile
+from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase, APIClient
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
 from rest_framework import status
-from products.models import Product, Category, ProductCategory
+from carts.models import Cart, CartItem
+from orders.models import Order, OrderItem
+from products.models import (CoPurchase, Product, Category, ProductCategory, ProductImage,
+                             ProductRecommendation, ProductSales, ProductSalesBucket,
+                             SalesWindowWatermark, product_categories_changed)
+from products.management.commands.populate_db import render_image
+from products.recommendations import update_co_purchases
+from products.sales import rebuild_sales, slide_sales_windows, truncate_to_hour
+from products.search import search_products, trigram_enabled
+from products.serializers import ProductSearchSerializer, ProductSerializer
+from products.tasks import generate_image_variants
+from shared.models import Blob
 
 User = get_user_model()
 
@@ -270,3 +297,1112 @@ class CategoryAPITestCase(APITestCase):
         response = self.client.delete(url)
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class ProductQueryCountTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='userpass123'
+        )
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+
+        for i in range(30):
+            product = Product.objects.create(
+                name=f"Product {i}",
+                price=Decimal('10.00') + i,
+                description="Description",
+            )
+            ProductImage.objects.create(product=product, image=f'product_images/{i}.jpg')
+            for category in categories[:i % 3 + 1]:
+                ProductCategory.objects.create(product=product, category=category)
+
+        self.client.force_authenticate(user=self.user)
+
+    def count_list_queries(self, page_size):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('products-list'), {'page_size': page_size})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        self.assertEqual(self.count_list_queries(5), self.count_list_queries(30))
+
+    def test_list_reads_categories_and_images_from_prefetch(self):
+        response = self.client.get(reverse('products-list'), {'page_size': 30})
+        by_name = {item['name']: item for item in response.data['results']}
+
+        self.assertEqual(len(by_name['Product 2']['category_names']), 3)
+        self.assertEqual(len(by_name['Product 2']['product_images']), 1)
+
+
+class KeysetPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='userpass123'
+        )
+        for i in range(25):
+            Product.objects.create(
+                name=f"Product {i}",
+                price=Decimal('10.00') + i % 5,
+                description="Description",
+            )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('products-list')
+
+    def walk(self, params):
+        ids = []
+        response = self.client.get(self.url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_walks_every_product_once_in_created_order(self):
+        ids, _ = self.walk({'pagination': 'keyset', 'page_size': 10})
+
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_follows_ordering_filter_with_id_tiebreaker(self):
+        ids, _ = self.walk({'pagination': 'keyset', 'ordering': 'price', 'page_size': 4})
+
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_the_previous_page(self):
+        first = self.client.get(self.url, {'pagination': 'keyset', 'page_size': 10})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        self.assertEqual(
+            [item['id'] for item in back.data['results']],
+            [item['id'] for item in first.data['results']],
+        )
+        self.assertIsNone(first.data['previous'])
+
+    def test_ordering_without_index_is_rejected(self):
+        response = self.client.get(self.url, {'pagination': 'keyset', 'ordering': 'name'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ranked_search_is_not_keyset_paginated(self):
+        for url, params in ((self.url, {'search': 'product'}), (reverse('products-search'), {'q': 'product'})):
+            response = self.client.get(url, {'pagination': 'keyset', **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('pagination', response.data)
+
+    def test_invalid_cursor_not_found(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_pagination_is_still_the_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['count'], 25)
+
+
+class ProductSearchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='userpass123'
+        )
+        self.laptop = Product.objects.create(
+            name="Gaming laptop",
+            price=Decimal('999.99'),
+            description="Fast machine with a large screen",
+        )
+        self.bag = Product.objects.create(
+            name="Travel bag",
+            price=Decimal('49.99'),
+            description="Fits a laptop up to 15 inches",
+        )
+        self.kettle = Product.objects.create(
+            name="Kettle",
+            price=Decimal('19.99'),
+            description="Boils water",
+        )
+        self.category = Category.objects.create(name="Kitchen")
+        ProductCategory.objects.create(product=self.kettle, category=self.category)
+        self.client.force_authenticate(user=self.user)
+
+    def test_search_filter_ranks_name_matches_first(self):
+        response = self.client.get(reverse('products-list'), {'search': 'laptops'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [self.laptop.id, self.bag.id]
+        )
+
+    def test_search_matches_category_names(self):
+        response = self.client.get(reverse('products-list'), {'search': 'kitchen'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.kettle.id])
+
+    def test_search_vector_follows_category_changes(self):
+        self.category.name = "Appliances"
+        self.category.save()
+        ProductCategory.objects.create(product=self.bag, category=self.category)
+
+        response = self.client.get(reverse('products-list'), {'search': 'appliances'})
+        self.assertEqual(
+            {item['id'] for item in response.data['results']},
+            {self.kettle.id, self.bag.id}
+        )
+
+    def test_search_vector_follows_product_changes(self):
+        self.kettle.description = "Boils water for tea"
+        self.kettle.save()
+
+        response = self.client.get(reverse('products-list'), {'search': 'tea'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.kettle.id])
+
+    def test_search_endpoint_returns_rank(self):
+        response = self.client.get(reverse('products-search'), {'q': 'laptop'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ranks = [item['rank'] for item in response.data['results']]
+        self.assertEqual(len(ranks), 2)
+        self.assertGreater(ranks[0], ranks[1])
+
+    def test_search_endpoint_requires_query(self):
+        response = self.client.get(reverse('products-search'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductNameFilterTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='userpass123'
+        )
+        self.phone = Product.objects.create(name="Smartphone", price=Decimal('500.00'), description="Phone")
+        self.charger = Product.objects.create(name="Charger", price=Decimal('20.00'), description="Charger")
+        electronics = Category.objects.create(name="Electronics")
+        accessories = Category.objects.create(name="Phone accessories")
+        ProductCategory.objects.create(product=self.phone, category=electronics)
+        ProductCategory.objects.create(product=self.charger, category=electronics)
+        ProductCategory.objects.create(product=self.charger, category=accessories)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('products-list')
+
+    def test_name_filter_matches_substring(self):
+        response = self.client.get(self.url, {'name': 'PHONE'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.phone.id])
+
+    def test_category_name_filter_returns_each_product_once(self):
+        response = self.client.get(self.url, {'category_name': 'o'})
+        self.assertEqual(
+            sorted(item['id'] for item in response.data['results']),
+            sorted([self.phone.id, self.charger.id])
+        )
+
+    def test_category_name_filter_without_match_is_empty(self):
+        response = self.client.get(self.url, {'category_name': 'garden'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_name_filter_falls_back_to_similar_names(self):
+        if not trigram_enabled():
+            self.skipTest('pg_trgm is not installed')
+
+        response = self.client.get(self.url, {'name': 'smartfone'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.phone.id])
+
+    def test_suggestions(self):
+        response = self.client.get(reverse('products-suggestions'), {'q': 'smartfone'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = ['Smartphone'] if trigram_enabled() else []
+        self.assertEqual(response.data['did_you_mean'], expected)
+
+
+class CatalogCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='userpass123'
+        )
+        self.product = Product.objects.create(name="Lamp", price=Decimal('30.00'), description="Desk lamp")
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('products-list')
+
+    def test_unchanged_list_is_served_from_cache(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(response.data['results'][0]['name'], "Lamp")
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_query_param_order_does_not_change_the_key(self):
+        first = self.client.get(self.url, {'page_size': 5, 'ordering': 'price'})
+        second = self.client.get(f'{self.url}?ordering=price&page_size=5')
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'shop.example'])
+    def test_each_origin_gets_its_own_urls(self):
+        ProductImage.objects.create(product=self.product, image='product_images/lamp.jpg')
+        self.client.get(self.url)
+
+        response = self.client.get(self.url, HTTP_HOST='shop.example', secure=True)
+
+        image = response.data['results'][0]['image_srcset'][0]['src']
+        self.assertTrue(image.startswith('https://shop.example/'), image)
+
+    def test_catalog_change_invalidates_cached_responses(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.product.name = "Floor lamp"
+        self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['results'][0]['name'], "Floor lamp")
+
+    def test_category_detail_is_cached(self):
+        category = Category.objects.create(name="Lighting")
+        url = reverse('category-detail', kwargs={'pk': category.pk})
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class ImportProductsCommandTestCase(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        Category.objects.create(name="Books")
+
+    def write(self, name, content):
+        path = Path(self.directory.name) / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def run_import(self, path, **options):
+        call_command('import_products', path, stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_imports_csv_and_resolves_categories(self):
+        path = self.write('feed.csv', (
+            'name,price,description,count,categories\n'
+            'Novel,12.50,A story,4,Books|Fiction\n'
+            'Atlas,30,Maps,2,Books\n'
+        ))
+
+        self.run_import(path)
+
+        novel = Product.objects.get(name='Novel')
+        self.assertEqual(novel.price, Decimal('12.50'))
+        self.assertEqual(novel.count, 4)
+        self.assertEqual(
+            set(novel.product_categories.values_list('category__name', flat=True)),
+            {'Books', 'Fiction'}
+        )
+        self.assertEqual(Category.objects.filter(name='Books').count(), 1)
+        self.assertTrue(Product.objects.filter(search_vector='fiction').exists())
+
+    def test_reimport_is_idempotent_and_updates_by_name(self):
+        first = self.write('first.ndjson', '\n'.join(json.dumps(row) for row in [
+            {'name': 'Novel', 'price': '12.50', 'categories': ['Books', 'Fiction']},
+            {'name': 'Atlas', 'price': '30', 'categories': ['Books']},
+        ]))
+        second = self.write('second.ndjson', json.dumps(
+            {'name': 'Novel', 'price': '10.00', 'categories': ['Fiction']}
+        ))
+
+        self.run_import(first, batch_size=1)
+        self.run_import(first, batch_size=1)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(ProductCategory.objects.count(), 3)
+
+        self.run_import(second)
+        novel = Product.objects.get(name='Novel')
+        self.assertEqual(novel.price, Decimal('10.00'))
+        self.assertEqual(list(novel.product_categories.values_list('category__name', flat=True)), ['Fiction'])
+
+    def test_unchanged_rows_are_not_rewritten(self):
+        path = self.write('feed.ndjson', '\n'.join(json.dumps(row) for row in [
+            {'name': 'Novel', 'price': '12.50', 'description': 'A story', 'categories': ['Books']},
+            {'name': 'Atlas', 'price': '30', 'description': 'Maps'},
+        ]))
+        self.run_import(path)
+        stamps = dict(Product.objects.values_list('name', 'updated_at'))
+
+        with CaptureQueriesContext(connection) as context:
+            self.run_import(path)
+        self.assertEqual(dict(Product.objects.values_list('name', 'updated_at')), stamps)
+        self.assertFalse([query for query in context.captured_queries if 'search_vector' in query['sql']])
+
+        changed = self.write('changed.ndjson', '\n'.join(json.dumps(row) for row in [
+            {'name': 'Novel', 'price': '12.50', 'description': 'A long story', 'categories': ['Fiction']},
+            {'name': 'Atlas', 'price': '35', 'description': 'Maps'},
+        ]))
+        with CaptureQueriesContext(connection) as context:
+            self.run_import(changed)
+        # Each product once: Novel with its new links, Atlas on its own.
+        rebuilt = [query['sql'].rsplit(' IN ', 1)[1] for query in context.captured_queries
+                   if 'SET "search_vector"' in query['sql']]
+        novel, atlas = (Product.objects.get(name=name).pk for name in ('Novel', 'Atlas'))
+        self.assertEqual(sorted(rebuilt), sorted([f'({novel})', f'({atlas})']))
+        self.assertTrue(Product.objects.filter(search_vector='fiction', name='Novel').exists())
+
+    def test_invalid_rows_are_skipped(self):
+        path = self.write('feed.csv', (
+            'name,price\n'
+            ',10\n'
+            'Pen,not-a-price\n'
+            'Vase,-1\n'
+            'Yacht,123456789012\n'
+            'Pencil,1.20\n'
+        ))
+
+        self.run_import(path)
+
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Pencil'])
+
+
+class PopulateDbCommandTestCase(APITestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def populate(self, **options):
+        call_command('populate_db', stdout=StringIO(), workers=1, image_pool=2, **options)
+
+    def test_creates_requested_volumes_in_batches(self):
+        self.populate(categories=5, products=40, users=6, carts=4, orders=10, seed=7, batch_size=15)
+
+        self.assertEqual(Category.objects.count(), 5)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(Cart.objects.count(), 4)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertTrue(OrderItem.objects.exists())
+        completed = Order.objects.filter(status=Order.COMPLETED)
+        self.assertFalse(completed.filter(completed_at__isnull=True).exists())
+        self.assertEqual(ProductSales.objects.aggregate(sold=Sum('total'))['sold'],
+                         OrderItem.objects.filter(order__in=completed).aggregate(sold=Sum('quantity'))['sold'])
+        self.assertEqual(ProductImage.objects.values('image').distinct().count(), 2)
+        self.assertFalse(Product.objects.filter(product_categories__isnull=True).exists())
+        for cart in Cart.objects.all():
+            expected = sum(item.product.price * item.quantity for item in cart.items.all())
+            self.assertEqual(cart.total_price, expected)
+
+    def test_same_seed_generates_same_catalog(self):
+        self.populate(categories=3, products=10, seed=3)
+        first = list(Product.objects.order_by('id').values_list('name', 'price'))
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+
+        self.populate(categories=3, products=10, seed=3)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('name', 'price')), first)
+
+
+class ImageVariantsTestCase(APITestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(email='user@test.com', password='userpass123')
+        self.product = Product.objects.create(name="Poster", price=Decimal('5.00'), description="Poster")
+        name = default_storage.save('product_images/poster.jpg', ContentFile(render_image((10, 20, 30))))
+        self.image = ProductImage.objects.create(product=self.product, image=name)
+        self.client.force_authenticate(user=self.user)
+
+    def test_task_writes_variants_with_deterministic_names(self):
+        generate_image_variants(self.image.pk)
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.variants['thumb']['width'], 160)
+        self.assertEqual(self.image.variants['thumb']['webp'], 'product_images/variants/poster/thumb.webp')
+        self.assertEqual(self.image.variants['full']['width'], 300)
+        self.assertTrue(default_storage.exists('product_images/variants/poster/card.jpeg'))
+
+    def test_serializer_exposes_srcset(self):
+        generate_image_variants(self.image.pk)
+
+        response = self.client.get(reverse('products-detail', kwargs={'pk': self.product.pk}))
+
+        srcset = response.data['image_srcset'][0]
+        self.assertTrue(srcset['src'].endswith('/media/product_images/variants/poster/card.jpeg'))
+        self.assertIn('/media/product_images/variants/poster/thumb.webp 160w', srcset['srcset']['webp'])
+
+    def test_srcset_falls_back_to_original(self):
+        response = self.client.get(reverse('products-detail', kwargs={'pk': self.product.pk}))
+
+        srcset = response.data['image_srcset'][0]
+        self.assertTrue(srcset['src'].endswith('/media/product_images/poster.jpg'))
+        self.assertEqual(srcset['srcset'], {})
+
+    def test_variants_are_queued_only_for_a_new_picture(self):
+        with mock.patch.object(generate_image_variants, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.image.save()
+            delay.assert_not_called()
+
+            self.image.image = default_storage.save('product_images/other.jpg',
+                                                    ContentFile(render_image((40, 50, 60))))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.image.save()
+            delay.assert_called_once_with(self.image.pk)
+
+    def test_backfill_command_processes_shared_files_once(self):
+        other = ProductImage.objects.create(product=self.product, image=self.image.image.name)
+
+        call_command('generate_image_variants', workers=1, stdout=StringIO())
+
+        self.image.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.image.variants, other.variants)
+        self.assertEqual(self.image.variants['card']['jpeg'], 'product_images/variants/poster/card.jpeg')
+
+
+class ProductCategoryAssignmentTestCase(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_user(
+            email='admin@test.com', password='adminpass123', is_staff=True, is_superuser=True
+        )
+        self.phones = Category.objects.create(name="Phones")
+        self.books = Category.objects.create(name="Books")
+        self.toys = Category.objects.create(name="Toys")
+        self.product = Product.objects.create(name="Pocket phone", price=Decimal('10.00'), description="Phone")
+        self.other = Product.objects.create(name="Picture book", price=Decimal('5.00'), description="Book")
+        self.client.force_authenticate(user=self.admin_user)
+
+    def test_sync_keeps_unchanged_links(self):
+        kept = ProductCategory.objects.create(product=self.product, category=self.phones)
+        ProductCategory.objects.create(product=self.product, category=self.books)
+
+        ProductCategory.objects.sync({self.product.pk: [self.phones.pk, self.toys.pk]})
+
+        links = ProductCategory.objects.filter(product=self.product)
+        self.assertEqual(set(links.values_list('category_id', flat=True)), {self.phones.pk, self.toys.pk})
+        self.assertTrue(links.filter(pk=kept.pk).exists())
+
+    def test_sync_updates_search_vector(self):
+        ProductCategory.objects.sync({self.product.pk: [self.toys.pk]})
+
+        self.assertTrue(Product.objects.filter(pk=self.product.pk, search_vector='toys').exists())
+
+    def test_update_product_without_category_changes_does_not_touch_links(self):
+        link = ProductCategory.objects.create(product=self.product, category=self.phones)
+        url = reverse('products-detail', kwargs={'pk': self.product.pk})
+
+        response = self.client.patch(url, {'category_ids': [self.phones.pk]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(ProductCategory.objects.filter(product=self.product)), [link])
+
+    def test_create_product_with_categories(self):
+        data = {
+            'name': 'Tablet',
+            'price': '199.99',
+            'description': 'Tablet',
+            'count': 3,
+            'category_ids': [self.phones.pk, self.books.pk],
+        }
+
+        response = self.client.post(reverse('products-list'), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        links = ProductCategory.objects.filter(product_id=response.data['id'])
+        self.assertEqual(set(links.values_list('category_id', flat=True)), {self.phones.pk, self.books.pk})
+
+    def test_bulk_assign_and_unassign(self):
+        url = reverse('product-categories-bulk')
+        products = [self.product.pk, self.other.pk]
+        ProductCategory.objects.create(product=self.product, category=self.toys)
+
+        response = self.client.post(url, {
+            'action': 'assign', 'product_ids': products, 'category_ids': [self.toys.pk, self.books.pk],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(ProductCategory.objects.filter(product__in=products).count(), 4)
+
+        response = self.client.post(url, {
+            'action': 'unassign', 'product_ids': products, 'category_ids': [self.toys.pk],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            set(ProductCategory.objects.values_list('category_id', flat=True)), {self.books.pk}
+        )
+
+    def test_bulk_assign_announces_only_changed_products(self):
+        ProductCategory.objects.create(product=self.product, category=self.toys)
+        announced = []
+
+        def receiver(sender, product_ids, **kwargs):
+            announced.append(sorted(product_ids))
+
+        product_categories_changed.connect(receiver)
+        self.addCleanup(product_categories_changed.disconnect, receiver)
+        added = ProductCategory.objects.assign([self.product.pk, self.other.pk], [self.toys.pk])
+
+        self.assertEqual(added, 1)
+        self.assertEqual(announced, [[self.other.pk]])
+        self.assertEqual(ProductCategory.objects.assign([self.product.pk], [self.toys.pk]), 0)
+        self.assertEqual(announced, [[self.other.pk]])
+
+    def test_bulk_rejects_unknown_ids(self):
+        response = self.client.post(reverse('product-categories-bulk'), {
+            'action': 'assign', 'product_ids': [self.product.pk, 9999], 'category_ids': [self.toys.pk],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('product_ids', response.data)
+        self.assertFalse(ProductCategory.objects.exists())
+
+
+class ProductBatchTestCase(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_user(
+            email='admin@test.com', password='adminpass123', is_staff=True, is_superuser=True
+        )
+        self.regular_user = User.objects.create_user(email='user@test.com', password='userpass123')
+        self.products = [
+            Product.objects.create(name=f"Product {i}", price=Decimal('10.00'), description="Item", count=1)
+            for i in range(3)
+        ]
+        self.url = reverse('products-batch')
+        self.client.force_authenticate(user=self.admin_user)
+
+    def test_applies_operations_and_reports_each_item(self):
+        operations = [
+            {'op': 'create', 'name': 'Lamp', 'price': '25.00', 'description': 'Desk lamp', 'count': 4},
+            {'op': 'update', 'id': self.products[0].pk, 'price': '12.50', 'count': 7},
+            {'op': 'update', 'id': self.products[1].pk, 'name': 'Renamed'},
+            {'op': 'delete', 'id': self.products[2].pk},
+        ]
+
+        response = self.client.post(self.url, {'operations': operations}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(statuses, ['created', 'updated', 'updated', 'deleted'])
+        self.assertTrue(Product.objects.filter(pk=response.data['results'][0]['id'], name='Lamp').exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual((self.products[0].price, self.products[0].count), (Decimal('12.50'), 7))
+        self.assertTrue(Product.objects.filter(pk=self.products[1].pk, search_vector='renamed').exists())
+        self.assertFalse(Product.objects.filter(pk=self.products[2].pk).exists())
+
+    def test_invalid_items_are_reported_and_skipped(self):
+        operations = [
+            {'op': 'update', 'id': 9999, 'price': '1.00'},
+            {'op': 'create', 'name': self.products[1].name, 'price': '1.00', 'description': 'Dup'},
+            {'op': 'create', 'name': 'No price', 'description': 'Missing'},
+            {'op': 'update', 'id': self.products[0].pk, 'price': '-'},
+            {'op': 'update', 'id': self.products[0].pk, 'count': 3},
+        ]
+
+        response = self.client.post(self.url, {'operations': operations}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['error'] * 4 + ['updated'])
+        self.assertIn('id', results[0]['errors'])
+        self.assertIn('name', results[1]['errors'])
+        self.assertIn('price', results[2]['errors'])
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        category = Category.objects.create(name="Doomed")
+        blob = f'product_images/ab/{"ab" * 32}.jpg'
+        cart = Cart.objects.create(user=self.regular_user)
+
+        def run(count):
+            doomed = [
+                Product.objects.create(name=f'Doomed {count} {i}', price=Decimal('1.00'), description='Doomed')
+                for i in range(count)
+            ]
+            for product in doomed:
+                ProductCategory.objects.create(product=product, category=category)
+                ProductImage.objects.create(product=product, image=blob)
+                CartItem.objects.create(cart=cart, product=product, quantity=2)
+            operations = [
+                {'op': 'update', 'id': product.pk, 'price': str(20 + count)} for product in self.products
+            ] + [
+                {'op': 'create', 'name': f'New {count} {i}', 'price': '1.00', 'description': 'New'}
+                for i in range(count)
+            ] + [
+                {'op': 'delete', 'id': product.pk} for product in doomed
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, {'operations': operations}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(ProductImage.objects.exists())
+            self.assertEqual(Blob.objects.get(name=blob).reference_count, 0)
+            cart.refresh_from_db()
+            self.assertEqual(cart.total_price, 0)
+            return len(queries)
+
+        self.assertEqual(run(2), run(20))
+
+    def test_ordered_products_are_not_deleted(self):
+        order = Order.objects.create(user=self.regular_user)
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=1)
+        operations = [{'op': 'delete', 'id': product.pk} for product in self.products[:2]]
+
+        response = self.client.post(self.url, {'operations': operations}, format='json')
+
+        self.assertEqual([result['status'] for result in response.data['results']], ['error', 'deleted'])
+        self.assertEqual(list(Product.objects.filter(pk__in=[p.pk for p in self.products[:2]])), [self.products[0]])
+        self.assertEqual(order.items.count(), 1)
+
+    def test_regular_user_forbidden(self):
+        self.client.force_authenticate(user=self.regular_user)
+
+        response = self.client.post(self.url, {'operations': [{'op': 'delete', 'id': self.products[0].pk}]},
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProductFacetsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='userpass123')
+        self.lamps = Category.objects.create(name="Lamps")
+        self.desks = Category.objects.create(name="Desks")
+        for name, price, categories in [
+            ("Desk lamp", '30.00', [self.lamps, self.desks]),
+            ("Floor lamp", '120.00', [self.lamps]),
+            ("Standing desk", '640.00', [self.desks]),
+        ]:
+            product = Product.objects.create(name=name, price=Decimal(price), description=name)
+            for category in categories:
+                ProductCategory.objects.create(product=product, category=category)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('products-facets')
+
+    def test_counts_categories_and_price_buckets(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(
+            [(row['name'], row['count']) for row in response.data['categories']],
+            [("Desks", 2), ("Lamps", 2)]
+        )
+        self.assertEqual((response.data['price']['min'], response.data['price']['max']), ('30.00', '640.00'))
+        self.assertEqual([bucket['count'] for bucket in response.data['price']['buckets']], [1, 0, 1, 0, 1, 0])
+        aggregates = [query for query in context.captured_queries if 'COUNT(' in query['sql']]
+        self.assertEqual(len(aggregates), 2)
+
+    def test_follows_product_filters(self):
+        response = self.client.get(self.url, {'category': self.lamps.pk, 'price__lt': 100})
+
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(
+            {row['name']: row['count'] for row in response.data['categories']}, {"Lamps": 1, "Desks": 1}
+        )
+
+    def test_cached_until_links_change(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.url)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        ProductCategory.objects.unassign(Product.objects.values_list('pk', flat=True), [self.desks.pk])
+
+        response = self.client.get(self.url)
+        self.assertEqual([row['name'] for row in response.data['categories']], ["Lamps"])
+
+
+class SparseFieldsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='userpass123')
+        category = Category.objects.create(name="Lamps")
+        self.product = Product.objects.create(name="Lamp", price=Decimal('30.00'), description="Desk lamp")
+        ProductCategory.objects.create(product=self.product, category=category)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('products-list')
+
+    def test_returns_only_requested_fields(self):
+        response = self.client.get(self.url, {'fields': 'id,name,price'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {'id': self.product.pk, 'name': "Lamp", 'price': '30.00'})
+
+    def test_drops_unused_prefetches_and_columns(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.url, {'fields': 'id,name,price'})
+
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('product_images', sql)
+        self.assertNotIn('product_categories', sql)
+        self.assertNotIn('description', sql)
+
+    def test_dotted_paths_trim_nested_serializers(self):
+        response = self.client.get(self.url, {'fields': 'id,category_names'})
+
+        self.assertEqual(response.data['results'][0]['category_names'][0]['name'], "Lamps")
+
+    def test_writes_ignore_fields(self):
+        admin = User.objects.create_user(email='admin@test.com', password='adminpass123', is_staff=True)
+        self.client.force_authenticate(user=admin)
+
+        response = self.client.post(f'{self.url}?fields=id', {
+            'name': 'Desk', 'price': '80.00', 'description': 'Desk',
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['name'], 'Desk')
+
+
+class FastListTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='userpass123')
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        for i in range(12):
+            product = Product.objects.create(
+                name=f"Lamp {i}", price=Decimal('10.50') + i, description=f"Desk lamp number {i}"
+            )
+            image = ProductImage.objects.create(product=product, image=f'product_images/{i}.jpg')
+            if i % 2:
+                variants = {
+                    variant: {'width': width, 'webp': f'v/{i}/{variant}.webp', 'jpeg': f'v/{i}/{variant}.jpeg'}
+                    for variant, width in (('thumb', 160), ('card', 480))
+                }
+                ProductImage.objects.filter(pk=image.pk).update(variants=variants)
+            for category in categories[:i % 3]:
+                ProductCategory.objects.create(product=product, category=category)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('products-list')
+
+    def serializer_data(self, serializer_class, queryset, path, params):
+        request = Request(APIRequestFactory().get(path, params))
+        return serializer_class(queryset, many=True, context={'request': request}).data
+
+    def test_list_matches_serializer_output(self):
+        params = {'page_size': 100, 'ordering': 'price'}
+        response = self.client.get(self.url, params)
+
+        expected = self.serializer_data(ProductSerializer, Product.objects.order_by('price'), self.url, params)
+        self.assertEqual(response.data['results'], expected)
+
+    def test_search_matches_serializer_output(self):
+        url = reverse('products-search')
+        params = {'q': 'lamp number', 'page_size': 100}
+        response = self.client.get(url, params)
+
+        expected = self.serializer_data(ProductSearchSerializer, search_products(Product.objects.all(), 'lamp number'),
+                                        url, params)
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual(response.data['results'], expected)
+
+    def test_keyset_cursor_from_rows(self):
+        first = self.client.get(self.url, {'pagination': 'keyset', 'page_size': 5})
+        second = self.client.get(first.data['next'])
+
+        names = [item['name'] for item in first.data['results'] + second.data['results']]
+        self.assertEqual(len(set(names)), 10)
+
+
+class CategoryTreeTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin_user = User.objects.create_user(
+            email='admin@test.com',
+            password='adminpass123',
+            is_staff=True,
+            is_superuser=True
+        )
+        self.electronics = Category.objects.create(name="Electronics")
+        self.phones = Category.objects.create(name="Phones", parent=self.electronics)
+        self.cases = Category.objects.create(name="Cases", parent=self.phones)
+        self.books = Category.objects.create(name="Books")
+
+        self.phone = Product.objects.create(name="Smartphone", price=Decimal('500.00'), description="Phone")
+        self.case = Product.objects.create(name="Phone case", price=Decimal('15.00'), description="Case")
+        self.novel = Product.objects.create(name="Novel", price=Decimal('12.00'), description="Novel")
+        ProductCategory.objects.create(product=self.phone, category=self.phones)
+        ProductCategory.objects.create(product=self.case, category=self.cases)
+        ProductCategory.objects.create(product=self.case, category=self.electronics)
+        ProductCategory.objects.create(product=self.novel, category=self.books)
+        self.client.force_authenticate(user=self.admin_user)
+
+    def filter_by_category(self, category):
+        response = self.client.get(reverse('products-list'), {'category': category.pk})
+        return sorted(item['id'] for item in response.data['results'])
+
+    def test_paths_follow_the_hierarchy(self):
+        self.assertEqual(self.cases.path, f'{self.electronics.pk}/{self.phones.pk}/{self.cases.pk}/')
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                set(Category.objects.subtree(self.phones.pk)), {self.phones, self.cases}
+            )
+        self.assertEqual(list(Category.objects.subtree(0)), [])
+
+    def test_category_filter_matches_the_subtree_once(self):
+        self.assertEqual(self.filter_by_category(self.electronics), sorted([self.phone.pk, self.case.pk]))
+        self.assertEqual(self.filter_by_category(self.cases), [self.case.pk])
+
+    def test_moving_a_category_moves_its_subtree(self):
+        response = self.client.patch(
+            reverse('category-detail', kwargs={'pk': self.phones.pk}), {'parent': self.books.pk}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.cases.refresh_from_db()
+        self.assertEqual(self.cases.path, f'{self.books.pk}/{self.phones.pk}/{self.cases.pk}/')
+        self.assertEqual(self.filter_by_category(self.books), sorted([self.phone.pk, self.case.pk, self.novel.pk]))
+
+    def test_category_cannot_move_under_its_descendant(self):
+        response = self.client.patch(
+            reverse('category-detail', kwargs={'pk': self.electronics.pk}), {'parent': self.cases.pk}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('parent', response.data)
+
+    def test_category_cannot_be_nested_too_deep(self):
+        parent = self.books
+        for level in range(Category.MAX_DEPTH - 3):
+            parent = Category.objects.create(name=f"Level {level}", parent=parent)
+        url = reverse('category-detail', kwargs={'pk': self.electronics.pk})
+
+        response = self.client.patch(url, {'parent': parent.pk}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('parent', response.data)
+        response = self.client.patch(url, {'parent': parent.parent_id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_admin_reports_a_move_under_a_descendant(self):
+        self.client.force_login(self.admin_user)
+
+        response = self.client.post(
+            reverse('admin:products_category_change', args=[self.electronics.pk]),
+            {'name': "Electronics", 'parent': self.cases.pk},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('parent', response.context['adminform'].form.errors)
+        self.electronics.refresh_from_db()
+        self.assertIsNone(self.electronics.parent_id)
+
+    def test_tree_is_served_from_cache_until_a_category_changes(self):
+        url = reverse('category-tree')
+        response = self.client.get(url)
+        self.assertEqual(response.data, [
+            {'id': self.books.pk, 'name': "Books", 'children': []},
+            {'id': self.electronics.pk, 'name': "Electronics", 'children': [
+                {'id': self.phones.pk, 'name': "Phones", 'children': [
+                    {'id': self.cases.pk, 'name': "Cases", 'children': []},
+                ]},
+            ]},
+        ])
+
+        # Product changes leave the tree alone.
+        Product.objects.create(name="Tablet", price=Decimal('300.00'), description="Tablet")
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.books.name = "Novels"
+        self.books.save()
+        self.assertEqual(self.client.get(url).data[1]['name'], "Novels")
+
+    def test_bulk_created_categories_get_paths(self):
+        created = Category.objects.bulk_create([
+            Category(name="Chargers", parent=self.electronics), Category(name="Garden"),
+        ])
+
+        self.assertEqual(
+            [category.path for category in created],
+            [f'{self.electronics.pk}/{created[0].pk}/', f'{created[1].pk}/'],
+        )
+        self.assertEqual(Category.objects.get(pk=created[0].pk).path, created[0].path)
+
+
+class RecommendationsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='userpass123')
+        self.phone, self.case, self.charger, self.novel = [
+            Product.objects.create(name=name, price=Decimal('10.00'), description=name)
+            for name in ("Phone", "Case", "Charger", "Novel")
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def place(self, *products, age=timedelta(hours=1), order_status='pending'):
+        order = Order.objects.create(user=self.user, status=order_status)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=1) for product in products)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - age)
+        return order
+
+    def recommendations(self, product):
+        response = self.client.get(reverse('products-recommendations', kwargs={'pk': product.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.data]
+
+    def test_products_bought_together_are_ranked_by_orders(self):
+        self.place(self.phone, self.case, self.charger)
+        self.place(self.phone, self.case)
+        self.place(self.phone, self.case, self.case)
+        self.place(self.novel)
+
+        self.assertEqual(update_co_purchases(batch_size=2), 4)
+
+        self.assertEqual(self.recommendations(self.phone), ["Case", "Charger"])
+        self.assertEqual(CoPurchase.objects.get(product=self.case, other=self.phone).orders, 3)
+        self.assertEqual(self.recommendations(self.novel), [])
+
+    def test_runs_are_incremental(self):
+        self.place(self.phone, self.charger)
+        update_co_purchases()
+        self.place(self.phone, self.case, age=timedelta(minutes=30))
+        self.place(self.phone, self.case, age=timedelta(minutes=20))
+        # Too recent and cancelled orders are not counted.
+        self.place(self.phone, self.novel, age=timedelta(seconds=10))
+        self.place(self.phone, self.novel, order_status=Order.CANCELLED)
+
+        self.assertEqual(update_co_purchases(), 2)
+        self.assertEqual(update_co_purchases(), 0)
+
+        self.assertEqual(self.recommendations(self.phone), ["Case", "Charger"])
+        self.assertEqual(CoPurchase.objects.get(product=self.phone, other=self.charger).orders, 1)
+
+    def test_top_k_limits_the_stored_neighbours(self):
+        self.place(self.phone, self.case, self.charger, self.novel)
+        self.place(self.phone, self.novel)
+
+        update_co_purchases(top_k=2)
+
+        self.assertEqual(
+            ProductRecommendation.objects.get(product=self.phone).product_ids, [self.novel.pk, self.case.pk]
+        )
+
+    def test_recommendations_are_read_by_primary_key(self):
+        self.place(self.phone, self.case)
+        update_co_purchases()
+
+        with CaptureQueriesContext(connection) as context:
+            self.recommendations(self.phone)
+        recommendation_queries = [query['sql'] for query in context.captured_queries
+                                  if 'product_recommendations' in query['sql']]
+        self.assertEqual(len(recommendation_queries), 1)
+        self.assertIn('"product_recommendations"."product_id" =', recommendation_queries[0])
+
+
+class SalesLeaderboardTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin_user = User.objects.create_user(
+            email='admin@test.com',
+            password='adminpass123',
+            is_staff=True,
+            is_superuser=True
+        )
+        self.lamp, self.desk, self.chair = [
+            Product.objects.create(name=name, price=Decimal('10.00'), description=name, count=100)
+            for name in ("Lamp", "Desk", "Chair")
+        ]
+        self.client.force_authenticate(user=self.admin_user)
+
+    def complete(self, *lines):
+        order = Order.objects.create(user=self.admin_user)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=quantity)
+                                      for product, quantity in lines)
+        self.set_status(order, Order.COMPLETED)
+        return order
+
+    def set_status(self, order, order_status):
+        response = self.client.patch(reverse('orders-detail', kwargs={'pk': order.pk}),
+                                     {'status': order_status}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def counters(self, product):
+        sales = ProductSales.objects.get(product=product)
+        return sales.total, sales.last_7_days, sales.last_24_hours
+
+    def test_completed_orders_are_counted_once(self):
+        order = self.complete((self.lamp, 2), (self.desk, 1))
+        self.complete((self.lamp, 3))
+        self.set_status(order, Order.COMPLETED)
+
+        self.assertEqual(self.counters(self.lamp), (5, 5, 5))
+        self.assertEqual(self.counters(self.desk), (1, 1, 1))
+
+    def test_leaving_completed_takes_the_sales_back(self):
+        order = self.complete((self.lamp, 2))
+
+        self.set_status(order, Order.CANCELLED)
+
+        self.assertEqual(self.counters(self.lamp), (0, 0, 0))
+        order.refresh_from_db()
+        self.assertIsNone(order.completed_at)
+
+    def test_orders_completed_outside_the_api_are_counted(self):
+        order = Order.objects.create(user=self.admin_user)
+        OrderItem.objects.create(order=order, product=self.lamp, quantity=2)
+
+        order.status = Order.COMPLETED
+        order.save()
+        self.assertEqual(self.counters(self.lamp), (2, 2, 2))
+        self.assertIsNotNone(order.completed_at)
+
+        # The goods of a completed order are gone; deleting it keeps the sale.
+        order.delete()
+        self.assertEqual(self.counters(self.lamp), (2, 2, 2))
+
+    def test_windows_slide_by_the_hour(self):
+        hour = truncate_to_hour(timezone.now())
+        SalesWindowWatermark.objects.create(pk=1, hour=hour - timedelta(hours=30))
+        order = self.complete((self.lamp, 2))
+        # As if it completed 30 hours ago.
+        ProductSalesBucket.objects.filter(product=self.lamp).update(hour=hour - timedelta(hours=30))
+        self.assertEqual(self.counters(self.lamp), (2, 2, 2))
+
+        self.assertEqual(slide_sales_windows(), 30)
+        self.assertEqual(slide_sales_windows(), 0)
+
+        self.assertEqual(self.counters(self.lamp), (2, 2, 0))
+        Order.objects.filter(pk=order.pk).update(completed_at=hour - timedelta(hours=30))
+        rebuild_sales()
+        self.assertEqual(self.counters(self.lamp), (2, 2, 0))
+
+    def test_products_can_be_ordered_by_sales(self):
+        self.complete((self.lamp, 1), (self.desk, 4))
+
+        response = self.client.get(reverse('products-list'), {'ordering': '-best_selling'})
+
+        self.assertEqual([item['name'] for item in response.data['results']], ["Desk", "Lamp", "Chair"])
+
+    def test_best_sellers_endpoint(self):
+        self.complete((self.lamp, 1), (self.desk, 4))
+        url = reverse('products-best-sellers')
+
+        response = self.client.get(url, {'window': '24h', 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(item['name'], item['sold']) for item in response.data], [("Desk", 4)])
+
+        response = self.client.get(url, {'window': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
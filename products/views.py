@@ -1,28 +1,121 @@
+from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, permissions, status, viewsets
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from products.filters import ProductFilter
+from products.cache import CatalogCacheMixin
+from products.categories import get_category_tree
+from products.facets import product_facets
+from products.filters import ProductFilter, ProductOrderingFilter
 from products.models import Category, Product, ProductCategory, ProductImage
-from products.pagination import CustomPagination
+from products.pagination import SelectablePagination
 from products.permissions import IsAdminUser, IsAdminUserOrReadOnly
-from products.serializers import (CategorySerializer,
+from products.recommendations import recommended_product_ids
+from products.sales import SALES_WINDOWS, top_sellers
+from products.search import (FullTextSearchFilter, search_products,
+                             suggest_product_names)
+from products.serializers import (CategorySerializer, ProductBatchSerializer,
+                                  ProductCategoryBulkSerializer,
                                   ProductCategorySerializer,
-                                  ProductImageSerializer, ProductSerializer)
+                                  ProductImageSerializer,
+                                  ProductSearchSerializer, ProductSerializer)
+from shared.serializers import FastListMixin, FieldSelection
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CatalogCacheMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminUserOrReadOnly]
-    pagination_class = CustomPagination
+    pagination_class = SelectablePagination
     filterset_class = ProductFilter
     filter_backends = (
         DjangoFilterBackend,
-        filters.SearchFilter,
-        filters.OrderingFilter,
+        FullTextSearchFilter,
+        ProductOrderingFilter,
     )
+    ordering_fields = ('price', 'name', 'created_at', 'id', 'best_selling', 'trending')
+    best_sellers_max_limit = 100
+    fast_extra_columns = ('created_at', 'price')
+
+    def get_queryset(self):
+        serializer_class = self.get_serializer_class()
+        selection = FieldSelection.from_request(self.request)
+        queryset = self.queryset.defer('search_vector', *serializer_class.get_deferred_fields(selection))
+        return queryset.prefetch_related(*serializer_class.get_prefetch_plan(selection=selection))
+
+    def get_serializer_class(self):
+        if self.action == 'search':
+            return ProductSearchSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"q": ["This query parameter is required."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = search_products(self.filter_queryset(self.get_queryset()), query)
+        return self.get_list_response(queryset)
+
+    @action(detail=False, methods=['get'])
+    def suggestions(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"q": ["This query parameter is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"did_you_mean": suggest_product_names(query)})
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        return self.get_cached_response(self._facets, request)
+
+    def _facets(self, request):
+        return Response(product_facets(self.filter_queryset(self.get_queryset())))
+
+    @action(detail=False, methods=['get'], url_path='best-sellers')
+    def best_sellers(self, request):
+        """
+        Top sellers of ``?window=all|7d|24h`` with the units sold. Served
+        from the cache, so counts can lag by the catalog cache timeout.
+        """
+        window = request.query_params.get('window', 'all')
+        if window not in SALES_WINDOWS:
+            return Response({"window": [f"Must be one of: {', '.join(SALES_WINDOWS)}."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return self.get_cached_response(self._best_sellers, request, window)
+
+    def _best_sellers(self, request, window):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), self.best_sellers_max_limit)
+        except ValueError:
+            return Response({"limit": ["A valid integer is required."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        sellers = top_sellers(window, limit)
+        products = self.get_queryset().in_bulk([product_id for product_id, _ in sellers])
+        ranked = [(products[product_id], sold) for product_id, sold in sellers if product_id in products]
+        data = self.get_serializer([product for product, _ in ranked], many=True).data
+        return Response([{**item, 'sold': sold} for item, (_, sold) in zip(data, ranked)])
+
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        """Products frequently bought together with this one, best first."""
+        return self.get_cached_response(self._recommendations, request, pk)
+
+    def _recommendations(self, request, pk):
+        product = self.get_object()
+        ids = recommended_product_ids(product.pk)
+        products = self.get_queryset().in_bulk(ids)
+        ranked = [products[product_id] for product_id in ids if product_id in products]
+        return Response(self.get_serializer(ranked, many=True).data)
+
+    @action(detail=False, methods=['post'], serializer_class=ProductBatchSerializer)
+    def batch(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            results = serializer.save()
+        return Response({"results": results}, status=status.HTTP_200_OK)
 
     # def create(self, request, *args, ** kwargs):
     #     if not (request.user.is_staff or request.user.is_superuser):
@@ -49,17 +142,32 @@ class ProductViewSet(viewsets.ModelViewSet):
     #                         status=status.HTTP_403_FORBIDDEN)
     #     return super().destroy(request, *args, **kwargs)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminUserOrReadOnly]
-    pagination_class = CustomPagination
+    pagination_class = SelectablePagination
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        return Response(get_category_tree())
 
 
 class ProductCategoryViewSet(viewsets.ModelViewSet):
-    queryset = ProductCategory.objects.all()
+    queryset = ProductCategory.objects.select_related('category')
     serializer_class = ProductCategorySerializer
     permission_classes = [IsAdminUserOrReadOnly]
-    pagination_class = CustomPagination
+    pagination_class = SelectablePagination
+
+    @action(detail=False, methods=['post'], serializer_class=ProductCategoryBulkSerializer)
+    def bulk(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            count = serializer.save()
+        return Response({
+            'action': serializer.validated_data['action'],
+            'count': count,
+        }, status=status.HTTP_200_OK)
 
 
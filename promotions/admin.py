@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from promotions.models import Promotion
+
+
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'kind', 'value', 'product', 'category', 'is_active', 'starts_at', 'ends_at')
+    list_filter = ('kind', 'is_active')
+    list_select_related = ('product', 'category')
+    raw_id_fields = ('product',)
+    search_fields = ('name',)
+
+
+admin.site.register(Promotion, PromotionAdmin)
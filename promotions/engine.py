@@ -0,0 +1,164 @@
+"""
+Pricing against the active promotions. The rules are compiled once into a
+``PromotionIndex`` keyed by product and category id and kept in each
+worker's memory, so pricing an item is a couple of dict lookups instead of
+a scan over the rules or a query. The index follows a version in the cache,
+bumped whenever a promotion changes, and is also rebuilt when the next
+promotion starts or ends.
+"""
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from products.models import ProductCategory
+from promotions.models import Promotion
+
+PROMOTIONS_VERSION_KEY = 'promotions:version'
+
+ZERO = Decimal('0')
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+
+# The index of this worker, replaced as a whole when it goes stale.
+_compiled = None
+
+
+def get_promotions_version():
+    version = cache.get(PROMOTIONS_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a flushed cache never reuses old versions.
+        cache.add(PROMOTIONS_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(PROMOTIONS_VERSION_KEY)
+    return version
+
+
+def _increment_promotions_version():
+    try:
+        cache.incr(PROMOTIONS_VERSION_KEY)
+    except ValueError:
+        cache.set(PROMOTIONS_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_promotions_version():
+    """Make every worker recompile its index, now and again once the transaction commits."""
+    _increment_promotions_version()
+    transaction.on_commit(_increment_promotions_version)
+
+
+class Rule:
+    """An active promotion, reduced to what pricing an item needs."""
+
+    def __init__(self, promotion_id, kind, value=ZERO, buy_quantity=0, get_quantity=0,
+                 product_id=None, category_id=None):
+        self.promotion_id = promotion_id
+        self.product_id = product_id
+        self.category_id = category_id
+        self.rate = Decimal(value) / HUNDRED
+        self.amount = Decimal(value)
+        self.group = buy_quantity + get_quantity
+        self.free = get_quantity
+        self.discount = getattr(self, f'discount_{kind}')
+
+    def discount_percentage(self, quantity, unit_price):
+        return unit_price * quantity * self.rate
+
+    def discount_fixed(self, quantity, unit_price):
+        return min(self.amount, unit_price) * quantity
+
+    def discount_buy_x_get_y(self, quantity, unit_price):
+        return quantity // self.group * self.free * unit_price
+
+
+class PromotionIndex:
+    """The active rules by product id and by category id."""
+
+    def __init__(self, rules, version=None, expires_at=None):
+        self.version = version
+        self.expires_at = expires_at
+        self.by_product = {}
+        self.by_category = {}
+        for rule in rules:
+            if rule.product_id is not None:
+                self.by_product.setdefault(rule.product_id, []).append(rule)
+            else:
+                self.by_category.setdefault(rule.category_id, []).append(rule)
+
+    def __bool__(self):
+        return bool(self.by_product or self.by_category)
+
+    def is_current(self, version, now):
+        return self.version == version and (self.expires_at is None or now < self.expires_at)
+
+    def discount(self, product_id, quantity, unit_price, category_ids=()):
+        """
+        The best discount on ``quantity`` units of a product in
+        ``category_ids``, rounded to the cent and never more than the line.
+        """
+        best = ZERO
+        for rule in self.by_product.get(product_id, ()):
+            best = max(best, rule.discount(quantity, unit_price))
+        if self.by_category:
+            for category_id in category_ids:
+                for rule in self.by_category.get(category_id, ()):
+                    best = max(best, rule.discount(quantity, unit_price))
+        if not best:
+            return ZERO
+        return min(best, unit_price * quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    def price(self, lines):
+        """
+        ``(subtotal, discount)`` of ``(product_id, quantity, unit_price,
+        category_ids)`` lines, in a single pass over them.
+        """
+        subtotal = discount = ZERO
+        for product_id, quantity, unit_price, category_ids in lines:
+            subtotal += unit_price * quantity
+            discount += self.discount(product_id, quantity, unit_price, category_ids)
+        return subtotal, discount
+
+
+def compile_promotions(version=None):
+    """Build the index of the promotions active now, from one query."""
+    now = timezone.now()
+    promotions = (
+        Promotion.objects.filter(is_active=True).exclude(ends_at__lte=now)
+        .values_list('id', 'kind', 'value', 'buy_quantity', 'get_quantity', 'product_id', 'category_id',
+                     'starts_at', 'ends_at')
+    )
+    rules = []
+    # The index is good until the next promotion starts or ends.
+    expires_at = None
+    for *fields, starts_at, ends_at in promotions:
+        if starts_at is not None and starts_at > now:
+            boundary = starts_at
+        else:
+            rules.append(Rule(*fields))
+            boundary = ends_at
+        if boundary is not None and (expires_at is None or boundary < expires_at):
+            expires_at = boundary
+    return PromotionIndex(rules, version=version, expires_at=expires_at)
+
+
+def get_promotion_index():
+    """This worker's index, recompiled when a promotion changed or one started or ended."""
+    global _compiled
+    version = get_promotions_version()
+    index = _compiled
+    if index is None or not index.is_current(version, timezone.now()):
+        index = _compiled = compile_promotions(version)
+    return index
+
+
+def product_category_ids(product_ids):
+    """
+    ``{product_id: category ids}`` of the products' categories and all their
+    ancestors, read from the categories' paths in one query.
+    """
+    links = ProductCategory.objects.filter(product_id__in=product_ids).values_list('product_id', 'category__path')
+    categories = {}
+    for product_id, path in links:
+        categories.setdefault(product_id, set()).update(int(pk) for pk in path.split('/') if pk)
+    return categories
@@ -0,0 +1,91 @@
+import random
+import statistics
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.management.base import BaseCommand
+
+from promotions.engine import CENT, ZERO, PromotionIndex, Rule
+from promotions.models import Promotion
+
+
+class Command(BaseCommand):
+    help = 'Prices synthetic carts against synthetic active promotions, compiled index vs. scanning the rules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=10000)
+        parser.add_argument('--rules', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--categories', type=int, default=300)
+        parser.add_argument('--items', type=int, default=6, help='Items per cart, at most')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per case')
+        parser.add_argument('--scan-carts', type=int, default=500,
+                            help='Carts priced by the rule scan, which is too slow for all of them')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        kinds = [kind for kind, _ in Promotion.KIND_CHOICES]
+        rules = []
+        for pk in range(1, options['rules'] + 1):
+            kind = rng.choice(kinds)
+            target = {'category_id': rng.randint(1, options['categories'])} if rng.random() < 0.3 else {
+                'product_id': rng.randint(1, options['products'])
+            }
+            rules.append(Rule(pk, kind, value=Decimal(rng.randint(5, 50)), buy_quantity=rng.randint(1, 3),
+                              get_quantity=1, **target))
+
+        carts = []
+        for _ in range(options['carts']):
+            carts.append([
+                (rng.randint(1, options['products']), rng.randint(1, 5), Decimal(rng.randint(100, 50000)) / 100,
+                 {rng.randint(1, options['categories']) for _ in range(rng.randint(1, 3))})
+                for _ in range(rng.randint(1, options['items']))
+            ])
+        items = sum(len(cart) for cart in carts)
+        self.stdout.write(f'{len(carts)} carts, {items} items, {len(rules)} rules')
+
+        started = time.perf_counter()
+        index = PromotionIndex(rules)
+        self.stdout.write(f'{"compile":<16} {(time.perf_counter() - started) * 1000:8.2f} ms')
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            totals = [index.price(cart) for cart in carts]
+            timings.append((time.perf_counter() - started) * 1000)
+        self.report('index', timings, len(carts))
+
+        # The same prices from scanning every rule for every item.
+        sample = carts[:options['scan_carts']]
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            scanned = [self.scan(rules, cart) for cart in sample]
+            timings.append((time.perf_counter() - started) * 1000)
+        self.report('rule scan', timings, len(sample))
+
+        if scanned != totals[:len(sample)]:
+            self.stdout.write(self.style.ERROR('The index and the rule scan disagree'))
+        else:
+            self.stdout.write(self.style.SUCCESS('The index and the rule scan agree'))
+
+    @staticmethod
+    def scan(rules, cart):
+        subtotal = discount = ZERO
+        for product_id, quantity, unit_price, category_ids in cart:
+            subtotal += unit_price * quantity
+            best = max((
+                rule.discount(quantity, unit_price) for rule in rules
+                if rule.product_id == product_id or rule.category_id in category_ids
+            ), default=ZERO)
+            if best:
+                discount += min(best, unit_price * quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+        return subtotal, discount
+
+    def report(self, label, timings, carts):
+        median = statistics.median(timings)
+        self.stdout.write(
+            f'{label:<16} median {median:8.2f} ms   {median * 1000 / carts:8.2f} us/cart   '
+            f'max {max(timings):8.2f} ms'
+        )
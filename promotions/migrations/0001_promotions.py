@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('products', '0010_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=150)),
+                ('kind', models.CharField(choices=[('percentage', 'Percentage off'), ('fixed', 'Fixed amount off each unit'), ('buy_x_get_y', 'Buy X, get Y free')], max_length=20)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('buy_quantity', models.PositiveIntegerField(default=0)),
+                ('get_quantity', models.PositiveIntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='products.category')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'promotion',
+                'verbose_name_plural': 'promotions',
+                'db_table': 'promotions',
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('category__isnull', True), ('product__isnull', False)), models.Q(('category__isnull', False), ('product__isnull', True)), _connector='OR'), name='promotions_one_target')],
+            },
+        ),
+    ]
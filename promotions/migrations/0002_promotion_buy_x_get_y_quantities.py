@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_price_min_value'),
+        ('promotions', '0001_promotions'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='promotion',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('kind', 'buy_x_get_y'), _negated=True), models.Q(('buy_quantity__gt', 0), ('get_quantity__gt', 0)), _connector='OR'), name='promotions_buy_x_get_y_quantities'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Q
+
+from shared.models import BaseModel
+
+
+class Promotion(BaseModel):
+    """
+    A discount on one product or on every product of a category and its
+    subcategories. A cart item gets the single best promotion that applies
+    to it; promotions do not stack. Priced by promotions.engine.
+    """
+    PERCENTAGE = 'percentage'
+    FIXED = 'fixed'
+    BUY_X_GET_Y = 'buy_x_get_y'
+    KIND_CHOICES = (
+        (PERCENTAGE, 'Percentage off'),
+        (FIXED, 'Fixed amount off each unit'),
+        (BUY_X_GET_Y, 'Buy X, get Y free'),
+    )
+    name = models.CharField(max_length=150)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='promotions')
+    category = models.ForeignKey('products.Category', on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='promotions')
+    # Percent off for PERCENTAGE, amount off each unit for FIXED.
+    value = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # For BUY_X_GET_Y: of every buy_quantity + get_quantity units, get_quantity are free.
+    buy_quantity = models.PositiveIntegerField(default=0)
+    get_quantity = models.PositiveIntegerField(default=0)
+    is_active = models.BooleanField(default=True)
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if (self.product_id is None) == (self.category_id is None):
+            raise ValidationError('A promotion applies to either a product or a category.')
+        if self.kind == self.PERCENTAGE and not 0 < self.value <= 100:
+            raise ValidationError({'value': 'A percentage must be between 0 and 100.'})
+        if self.kind == self.FIXED and self.value <= 0:
+            raise ValidationError({'value': 'The amount off must be positive.'})
+        if self.kind == self.BUY_X_GET_Y and not (self.buy_quantity and self.get_quantity):
+            raise ValidationError('Buy X, get Y needs both quantities.')
+        if self.starts_at and self.ends_at and self.starts_at >= self.ends_at:
+            raise ValidationError({'ends_at': 'A promotion must end after it starts.'})
+
+    class Meta:
+        db_table = 'promotions'
+        verbose_name = 'promotion'
+        verbose_name_plural = 'promotions'
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(product__isnull=False, category__isnull=True)
+                | Q(product__isnull=True, category__isnull=False),
+                name='promotions_one_target',
+            ),
+            # Buy X, get Y prices by dividing by buy_quantity + get_quantity.
+            models.CheckConstraint(
+                condition=~Q(kind='buy_x_get_y') | Q(buy_quantity__gt=0, get_quantity__gt=0),
+                name='promotions_buy_x_get_y_quantities',
+            ),
+        ]
@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from carts.models import Cart, CartItem
+
+
+def reprice_open_carts(batch_size=500):
+    """
+    Recompute the stored totals of the open carts with items against the
+    current promotions, ``batch_size`` carts per transaction. The carts are
+    locked like item writers lock them, in id order. Returns the number of
+    carts re-priced.
+    """
+    repriced = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            carts = (
+                Cart.objects.filter(is_ordered=False, pk__gt=last_id)
+                .filter(Exists(CartItem.objects.filter(cart=OuterRef('pk'))))
+                .order_by('pk').select_for_update(no_key=True)
+            )
+            batch = list(carts.values_list('pk', flat=True)[:batch_size])
+            if batch:
+                Cart.objects.filter(pk__in=batch).update_total_prices()
+        repriced += len(batch)
+        if len(batch) < batch_size:
+            return repriced
+        last_id = batch[-1]
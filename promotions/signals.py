@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from promotions.engine import bump_promotions_version
+from promotions.models import Promotion
+from promotions.tasks import reprice_carts
+
+
+@receiver([post_save, post_delete], sender=Promotion)
+def invalidate_promotion_index(sender, instance, **kwargs):
+    bump_promotions_version()
+    # Stored cart totals are re-priced now and when the promotion starts and ends.
+    transaction.on_commit(lambda: reprice_carts.delay())
+    for moment in (instance.starts_at, instance.ends_at):
+        if moment is not None:
+            transaction.on_commit(lambda moment=moment: reprice_carts.apply_async(eta=moment))
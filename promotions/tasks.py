@@ -0,0 +1,7 @@
+from config.celery import app
+from promotions.pricing import reprice_open_carts
+
+
+@app.task
+def reprice_carts(batch_size=500):
+    return reprice_open_carts(batch_size=batch_size)
@@ -0,0 +1,122 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from accounts.models import CustomUser
+from carts.models import Cart, CartItem
+from products.models import Category, Product, ProductCategory
+from promotions.engine import bump_promotions_version, get_promotion_index
+from promotions.models import Promotion
+from promotions.pricing import reprice_open_carts
+
+
+class PromotionPricingTestCase(APITestCase):
+    def setUp(self):
+        # Rolled back rows send no signals, so later tests must not see this test's promotions.
+        self.addCleanup(bump_promotions_version)
+        self.user = CustomUser.objects.create_user(email='user@gmail.com', password='testpass123')
+        self.cart = Cart.objects.create(user=self.user)
+        self.lamp = Product.objects.create(name='Lamp', price=Decimal('20.00'), description='Lamp')
+        self.desk = Product.objects.create(name='Desk', price=Decimal('100.00'), description='Desk')
+        self.chair = Product.objects.create(name='Chair', price=Decimal('30.00'), description='Chair')
+        self.furniture = Category.objects.create(name='Furniture')
+        self.seating = Category.objects.create(name='Seating', parent=self.furniture)
+        ProductCategory.objects.create(product=self.desk, category=self.furniture)
+        ProductCategory.objects.create(product=self.chair, category=self.seating)
+
+    def add(self, product, quantity):
+        CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+        self.cart.refresh_from_db()
+
+    def test_percentage_and_fixed_promotions(self):
+        Promotion.objects.create(name='10% off lamps', kind=Promotion.PERCENTAGE, value=10, product=self.lamp)
+        Promotion.objects.create(name='5 off desks', kind=Promotion.FIXED, value=5, product=self.desk)
+
+        self.add(self.lamp, 3)
+        self.add(self.desk, 2)
+
+        self.assertEqual(self.cart.discount, Decimal('16.00'))
+        self.assertEqual(self.cart.total_price, Decimal('244.00'))
+
+    def test_buy_x_get_y(self):
+        Promotion.objects.create(name='3 for 2', kind=Promotion.BUY_X_GET_Y, buy_quantity=2, get_quantity=1,
+                                 product=self.lamp)
+
+        self.add(self.lamp, 7)
+
+        self.assertEqual(self.cart.discount, Decimal('40.00'))
+        self.assertEqual(self.cart.total_price, Decimal('100.00'))
+
+    def test_buy_x_get_y_needs_both_quantities(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Promotion.objects.create(name='Free lamps', kind=Promotion.BUY_X_GET_Y, buy_quantity=2, get_quantity=0,
+                                     product=self.lamp)
+
+    def test_category_promotions_cover_subcategories_and_the_best_one_wins(self):
+        Promotion.objects.create(name='Furniture sale', kind=Promotion.PERCENTAGE, value=20, category=self.furniture)
+        Promotion.objects.create(name='Chair deal', kind=Promotion.FIXED, value=3, product=self.chair)
+
+        self.add(self.chair, 1)
+        self.add(self.lamp, 1)
+
+        # 20% of the chair beats 3 off; the lamp is not furniture.
+        self.assertEqual(self.cart.discount, Decimal('6.00'))
+        self.assertEqual(self.cart.total_price, Decimal('44.00'))
+
+    def test_scheduled_and_inactive_promotions_do_not_apply(self):
+        now = timezone.now()
+        Promotion.objects.create(name='Later', kind=Promotion.PERCENTAGE, value=50, product=self.lamp,
+                                 starts_at=now + timedelta(hours=1))
+        Promotion.objects.create(name='Over', kind=Promotion.PERCENTAGE, value=50, product=self.lamp,
+                                 ends_at=now - timedelta(hours=1))
+        Promotion.objects.create(name='Off', kind=Promotion.PERCENTAGE, value=50, product=self.lamp,
+                                 is_active=False)
+
+        self.add(self.lamp, 1)
+
+        self.assertEqual(self.cart.discount, Decimal('0'))
+        # The index is rebuilt when the scheduled promotion starts.
+        self.assertEqual(get_promotion_index().expires_at, now + timedelta(hours=1))
+
+    def test_index_is_kept_until_a_promotion_changes(self):
+        promotion = Promotion.objects.create(name='Sale', kind=Promotion.PERCENTAGE, value=10, product=self.lamp)
+        index = get_promotion_index()
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertIs(get_promotion_index(), index)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        promotion.value = 50
+        promotion.save()
+        self.assertIsNot(get_promotion_index(), index)
+        self.add(self.lamp, 1)
+        self.assertEqual(self.cart.discount, Decimal('10.00'))
+
+    def test_stored_totals_are_repriced_after_a_promotion_change(self):
+        self.add(self.desk, 1)
+        Promotion.objects.create(name='Furniture sale', kind=Promotion.PERCENTAGE, value=25, category=self.furniture)
+
+        self.assertEqual(reprice_open_carts(batch_size=1), 1)
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('75.00'))
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('carts-detail', args=[self.cart.pk]))
+        self.assertEqual(response.data['discount'], '25.00')
+        self.assertEqual(response.data['total_price'], '75.00')
+
+    def test_live_cart_is_priced_with_promotions(self):
+        Promotion.objects.create(name='Furniture sale', kind=Promotion.PERCENTAGE, value=10, category=self.furniture)
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(reverse('current-cart'), {
+            'lines': [{'product_id': self.chair.pk, 'quantity': 2}, {'product_id': self.lamp.pk, 'quantity': 1}],
+        }, format='json')
+
+        self.assertEqual(response.data['discount'], '6.00')
+        self.assertEqual(response.data['total_price'], '74.00')
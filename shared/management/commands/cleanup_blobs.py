@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shared.storage import remove_orphaned_blobs
+
+
+class Command(BaseCommand):
+    help = 'Deletes content-addressed files that no row references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=1,
+                            help='How long a file must have been unreferenced before it is deleted')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        removed = remove_orphaned_blobs(grace=timedelta(hours=options['grace_hours']),
+                                        batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{removed} orphaned files removed'))
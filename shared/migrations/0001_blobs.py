@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('reference_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'blobs',
+                'indexes': [models.Index(condition=models.Q(('reference_count__lte', 0)), fields=['reference_count', 'updated_at'], name='blobs_orphan_idx')],
+            },
+        ),
+    ]
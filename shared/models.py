@@ -11,3 +11,24 @@ class BaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class Blob(models.Model):
+    """
+    A file stored under the hash of its content, and how many rows point at
+    it. Maintained by shared.storage.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    reference_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        db_table = 'blobs'
+        indexes = [
+            models.Index(fields=['reference_count', 'updated_at'], name='blobs_orphan_idx',
+                         condition=models.Q(reference_count__lte=0)),
+        ]
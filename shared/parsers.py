@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+
+from shared.renderers import FastJSONRenderer, MessagePackRenderer, msgpack, orjson
+
+
+class FastJSONParser(parsers.JSONParser):
+    """``JSONParser`` backed by orjson for UTF-8 bodies."""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackParser(parsers.BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise ImproperlyConfigured('MessagePackParser requires the msgpack package.')
+        try:
+            return msgpack.unpackb(stream.read())
+        except ValueError as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
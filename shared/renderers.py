@@ -0,0 +1,62 @@
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Types neither orjson nor msgpack encode the way DRF does (Decimal,
+# datetimes, lazy strings, querysets, ...) go through DRF's own encoder.
+encode_default = encoders.JSONEncoder().default
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    ``JSONRenderer`` backed by orjson, with the same output for everything
+    our serializers produce. Falls back to the stdlib encoder when orjson is
+    not installed or an indent other than 2 is asked for.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        options = ORJSON_OPTIONS
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None:
+            if indent != 2:
+                return super().render(data, accepted_media_type, renderer_context)
+            options |= orjson.OPT_INDENT_2
+
+        ret = orjson.dumps(data, default=encode_default, option=options)
+        # Same escaping as JSONRenderer, so the output stays valid JavaScript.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """Compact binary alternative to JSON, picked with ``Accept: application/msgpack``."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if msgpack is None:
+            raise ImproperlyConfigured('MessagePackRenderer requires the msgpack package.')
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default)
@@ -0,0 +1,225 @@
+from rest_framework import permissions, serializers
+from rest_framework.response import Response
+
+from shared.storage import content_digest, has_stored_blob
+
+
+def parse_field_paths(value):
+    """
+    ``'id,items.product.name'`` -> ``{'id': {}, 'items': {'product': {'name': {}}}}``.
+    An empty subtree means the whole field.
+    """
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in filter(None, (part.strip() for part in path.split('.'))):
+            node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelection:
+    """
+    The ``?fields=`` / ``?expand=`` selection of a serializer, as trees of
+    field names. ``fields`` is None when every field is wanted.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields or None
+        self.expand = expand or {}
+
+    @classmethod
+    def from_request(cls, request):
+        # Writes always validate and return the full representation.
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return cls()
+        params = request.query_params
+        return cls(parse_field_paths(params.get('fields', '')), parse_field_paths(params.get('expand', '')))
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields
+
+    def expands(self, name):
+        return name in self.expand
+
+    def nested(self, name):
+        fields = self.fields.get(name) if self.fields is not None else None
+        return FieldSelection(fields, self.expand.get(name))
+
+
+class SparseFieldsMixin:
+    """
+    Trims a serializer to the requested ``?fields=`` and swaps the fields
+    in ``expandable_fields`` for nested serializers when they are named in
+    ``?expand=``. Dotted paths reach into nested serializers. Views use the
+    same selection to drop prefetches and columns nobody will read.
+    """
+    # {field name: (serializer class, kwargs)}
+    expandable_fields = {}
+
+    def __init__(self, *args, selection=None, **kwargs):
+        self._selection = selection
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def get_deferred_fields(cls, selection):
+        """Model columns that only back fields left out of ``selection``."""
+        model = cls.Meta.model
+        columns = {field.name for field in model._meta.concrete_fields if not field.primary_key}
+        return [name for name in cls.Meta.fields if name in columns and not selection.includes(name)]
+
+    def get_field_selection(self):
+        if self._selection is not None:
+            return self._selection
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is None:
+            return FieldSelection.from_request(self.context.get('request'))
+        return FieldSelection()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.get_field_selection()
+
+        for name in list(fields):
+            if not selection.includes(name):
+                del fields[name]
+                continue
+            if name in self.expandable_fields and selection.expands(name):
+                serializer_class, kwargs = self.expandable_fields[name]
+                fields[name] = serializer_class(read_only=True, **kwargs)
+
+            field = fields[name]
+            if isinstance(field, serializers.ListSerializer):
+                field = field.child
+            if isinstance(field, SparseFieldsMixin):
+                field._selection = selection.nested(name)
+        return fields
+
+
+class FastRepresentation:
+    """
+    Read-only twin of a serializer that works on ``values()`` rows. The
+    serializer's readable fields are compiled once per request into a list
+    of ``(name, getter)`` pairs: plain and dotted-source fields read their
+    column and reuse the field's own ``to_representation``, so the output is
+    the same as the serializer's. Nested serializers and method fields need
+    a ``represent_<name>(row)`` method, usually fed by ``load()``.
+
+    ``supported`` is False when a selected field has no fast equivalent
+    (e.g. an expanded relation); callers then use the serializer instead.
+    """
+    # {field name: columns its represent_<name> method reads}
+    handler_columns = {}
+    # {field name: FastRepresentation subclass of the nested serializer}
+    nested_representations = {}
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.context = serializer.context
+        self.columns = {'id'}
+        self.nested = {}
+        self.plan = []
+        self.supported = True
+        for field in serializer._readable_fields:
+            getter = self.compile_field(field)
+            if getter is None:
+                self.supported = False
+                return
+            self.plan.append((field.field_name, getter))
+
+    def compile_field(self, field):
+        name = field.field_name
+        if isinstance(field, serializers.BaseSerializer):
+            representation_class = self.nested_representations.get(name)
+            if representation_class is None:
+                return None
+            nested = representation_class(getattr(field, 'child', field))
+            if not nested.supported:
+                return None
+            self.nested[name] = nested
+
+        handler = getattr(self, f'represent_{name}', None)
+        if handler is not None:
+            self.columns.update(self.handler_columns.get(name, ()))
+            return handler
+        if isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField,
+                              serializers.ManyRelatedField)):
+            return None
+
+        column = '__'.join(field.source_attrs)
+        self.columns.add(column)
+        # values() already returns the primary key of a relation.
+        to_representation = None if isinstance(field, serializers.RelatedField) else field.to_representation
+
+        def getter(row):
+            value = row[column]
+            if value is None or to_representation is None:
+                return value
+            return to_representation(value)
+        return getter
+
+    def values(self, queryset, *extra):
+        """The rows this representation reads, plus ``extra`` columns."""
+        return queryset.prefetch_related(None).values(*self.columns, *extra)
+
+    def load(self, rows):
+        """Hook to fetch whatever the page's handlers need, in bulk."""
+
+    def represent(self, rows):
+        rows = list(rows)
+        self.load(rows)
+        plan = self.plan
+        return [{name: getter(row) for name, getter in plan} for row in rows]
+
+
+class FastListMixin:
+    """
+    Serves ``list`` from ``values()`` rows through the serializer class's
+    ``fast_representation_class`` instead of instantiating models and
+    serializing them field by field. Falls back to the serializer when the
+    selection needs something the fast path cannot produce.
+    """
+    # Columns pagination may read from the rows, e.g. for keyset cursors.
+    fast_extra_columns = ('created_at',)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_list_response(self.filter_queryset(self.get_queryset()))
+
+    def get_fast_representation(self):
+        serializer_class = self.get_serializer_class()
+        representation_class = getattr(serializer_class, 'fast_representation_class', None)
+        if representation_class is None:
+            return None
+        representation = representation_class(serializer_class(context=self.get_serializer_context()))
+        return representation if representation.supported else None
+
+    def get_list_response(self, queryset):
+        representation = self.get_fast_representation()
+        if representation is None:
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        rows = representation.values(queryset, *self.fast_extra_columns)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(representation.represent(page))
+        return Response(representation.represent(rows))
+
+
+class DeduplicatedImageField(serializers.ImageField):
+    """
+    ``ImageField`` for content-addressed storage. The upload is hashed first;
+    content that is already stored was validated when it was first uploaded,
+    so it is not decoded again. The hash rides along on the file for the
+    storage to reuse.
+    """
+
+    def to_internal_value(self, data):
+        file = serializers.FileField.to_internal_value(self, data)
+        file.content_hash = content_digest(file)
+        if has_stored_blob(file.content_hash):
+            return file
+        return super().to_internal_value(data)
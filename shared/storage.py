@@ -0,0 +1,203 @@
+import hashlib
+import re
+from datetime import timedelta
+from functools import cache
+from pathlib import PurePosixPath
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from shared.models import Blob
+
+# <upload_to>/<2 hex>/<sha256><ext>, see ContentAddressedStorage.hashed_name.
+BLOB_NAME_RE = re.compile(r'(?:.*/)?(?P<prefix>[0-9a-f]{2})/(?P<sha256>[0-9a-f]{64})(?:\.[a-z0-9]+)?')
+
+ADD_REFERENCES_SQL = """
+    INSERT INTO blobs (name, sha256, reference_count, updated_at)
+    SELECT name, sha256, delta, now() FROM unnest(%s::text[], %s::text[], %s::integer[]) AS blob (name, sha256, delta)
+    ON CONFLICT (name) DO UPDATE SET
+        reference_count = blobs.reference_count + EXCLUDED.reference_count,
+        updated_at = EXCLUDED.updated_at
+"""
+
+# Claims a blob before its file is looked for, see ContentAddressedStorage.save.
+TOUCH_BLOB_SQL = """
+    INSERT INTO blobs (name, sha256, reference_count, updated_at) VALUES (%s, %s, 0, now())
+    ON CONFLICT (name) DO UPDATE SET updated_at = EXCLUDED.updated_at
+"""
+
+# (model, field name) pairs whose files are reference counted.
+_tracked_fields = []
+
+
+def content_digest(file):
+    """SHA-256 of a file, read chunk by chunk so large uploads are never held in memory."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def derived_directory(name):
+    """
+    Where files made from ``name``, e.g. resized images, are kept:
+    ``product_images/ab/<sha>.jpg`` -> ``product_images/ab/variants/<sha>``.
+    They are removed together with the blob.
+    """
+    path = PurePosixPath(name)
+    return str(path.parent / 'variants' / path.stem)
+
+
+def blob_sha256(name):
+    """The content hash in a blob name, None for files stored some other way."""
+    match = BLOB_NAME_RE.fullmatch(name or '')
+    if match is None or not match['sha256'].startswith(match['prefix']):
+        return None
+    return match['sha256']
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct content once, under its SHA-256. Saving content
+    that is already stored writes nothing and returns the existing name.
+    Uploads that were hashed before, e.g. by ``DeduplicatedImageField``,
+    carry a ``content_hash`` and are not read again for it.
+
+    The blob's row is touched before its file is looked for.
+    ``remove_orphaned_blobs`` deletes files under the rows' locks and skips
+    recently touched rows, so a file found here is not deleted before the
+    new reference to it is counted.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest = getattr(content, 'content_hash', None) or content_digest(content)
+        hashed = self.hashed_name(name, digest)
+        with connection.cursor() as cursor:
+            cursor.execute(TOUCH_BLOB_SQL, [hashed, digest])
+        if self.exists(hashed):
+            return hashed
+        return super().save(hashed, content, max_length=max_length)
+
+    def save_derived(self, name, content):
+        """Store a file made from a blob under exactly ``name``, replacing an older one."""
+        if self.exists(name):
+            self.delete(name)
+        return super().save(name, content)
+
+    def delete_blob(self, name):
+        """Delete a blob's file and the files derived from it."""
+        directory = derived_directory(name)
+        if self.exists(directory):
+            for file_name in self.listdir(directory)[1]:
+                self.delete(f'{directory}/{file_name}')
+            self.delete(directory)
+        self.delete(name)
+
+    @staticmethod
+    def hashed_name(name, digest):
+        path = PurePosixPath(name)
+        return str(path.parent / digest[:2] / f'{digest}{path.suffix.lower()}')
+
+
+@cache
+def content_addressed_storage():
+    return ContentAddressedStorage()
+
+
+def add_blob_references(deltas):
+    """
+    Apply ``{name: delta}`` to the blobs' reference counts in one upsert.
+    Names that are not blobs (defaults, files stored before) are ignored.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta and blob_sha256(name)}
+    if not deltas:
+        return
+    # A stable order keeps concurrent upserts from deadlocking on the rows.
+    names = sorted(deltas)
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_REFERENCES_SQL, [names, [blob_sha256(name) for name in names],
+                                            [deltas[name] for name in names]])
+
+
+def track_blob_references(model, field_name):
+    """Keep the reference counts of the blobs ``model.<field_name>`` points at up to date."""
+    _tracked_fields.append((model, field_name))
+    uid = f'blob-references:{model._meta.label}.{field_name}'
+
+    def remember_previous(sender, instance, update_fields=None, **kwargs):
+        previous = None
+        if instance.pk is not None and (update_fields is None or field_name in update_fields):
+            previous = sender._base_manager.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+        instance.__dict__.setdefault('_previous_blob_names', {})[field_name] = previous
+
+    def count_reference(sender, instance, update_fields=None, **kwargs):
+        previous = previous_blob_name(instance, field_name)
+        if update_fields is not None and field_name not in update_fields:
+            return
+        name = getattr(instance, field_name).name
+        if name != previous:
+            add_blob_references({name: 1, previous: -1})
+
+    def release_reference(sender, instance, **kwargs):
+        add_blob_references({getattr(instance, field_name).name: -1})
+
+    pre_save.connect(remember_previous, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(count_reference, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(release_reference, sender=model, weak=False, dispatch_uid=uid)
+
+
+def previous_blob_name(instance, field_name):
+    """The name ``instance.<field_name>`` had in the database before the save in progress, see ``track_blob_references``."""
+    return instance.__dict__.get('_previous_blob_names', {}).get(field_name)
+
+
+def has_stored_blob(digest):
+    return Blob.objects.filter(sha256=digest, reference_count__gt=0).exists()
+
+
+def remove_orphaned_blobs(grace=timedelta(hours=1), batch_size=500):
+    """
+    Delete the blobs no row points at any more. Only blobs whose count has
+    been zero for ``grace`` are candidates, and each batch is checked
+    against the tracked columns first, so rows written in bulk without the
+    signals are never left without their file. Returns the number removed.
+    """
+    storage = content_addressed_storage()
+    removed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            candidates = list(
+                Blob.objects.filter(reference_count__lte=0, updated_at__lt=timezone.now() - grace, id__gt=last_id)
+                .order_by('id').select_for_update(skip_locked=True).values_list('id', 'name')[:batch_size]
+            )
+            if not candidates:
+                return removed
+            last_id = candidates[-1][0]
+
+            names = {name for _, name in candidates}
+            referenced = {}
+            for model, field_name in _tracked_fields:
+                rows = model._base_manager.filter(**{f'{field_name}__in': names}).values_list(field_name, flat=True)
+                for name in rows:
+                    referenced[name] = referenced.get(name, 0) + 1
+            # Repair the counts the bulk writes skipped.
+            for name, count in referenced.items():
+                Blob.objects.filter(name=name).update(reference_count=count)
+
+            orphaned = names - referenced.keys()
+            Blob.objects.filter(name__in=orphaned).delete()
+            # Still under the rows' locks: a save of the same content waits
+            # for the commit, then finds the file gone and writes it again.
+            for name in orphaned:
+                storage.delete_blob(name)
+        removed += len(orphaned)
@@ -1,3 +1,170 @@
-from django.test import TestCase
+import io
+import tempfile
+import unittest
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone as django_timezone
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from PIL import Image
+
+from products.management.commands.populate_db import render_image
+from products.models import Product, ProductImage
+from products.serializers import ProductImageSerializer
+from products.tasks import generate_image_variants
+from shared.models import Blob
+from shared.parsers import FastJSONParser, MessagePackParser
+from shared.renderers import FastJSONRenderer, MessagePackRenderer, msgpack
+from shared.storage import content_addressed_storage, remove_orphaned_blobs
+
+User = get_user_model()
+
+DATA = {
+    'id': 1,
+    'price': Decimal('10.50'),
+    'created_at': datetime(2025, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+    'updated_at': datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=5))),
+    'day': date(2025, 1, 2),
+    'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'name': 'Ĉajo\u2028',
+    'counts': {1: 2},
+    'items': [{'quantity': 2, 'total': Decimal('3.10')}, None, True],
+}
+
+
+class FastJSONRendererTestCase(SimpleTestCase):
+    def test_output_matches_json_renderer(self):
+        self.assertEqual(FastJSONRenderer().render(DATA), JSONRenderer().render(DATA))
+
+    def test_indent_matches_json_renderer(self):
+        for media_type in ('application/json; indent=2', 'application/json; indent=4'):
+            with self.subTest(media_type=media_type):
+                self.assertEqual(
+                    FastJSONRenderer().render(DATA, media_type), JSONRenderer().render(DATA, media_type)
+                )
+
+    def test_parser_round_trip(self):
+        body = io.BytesIO(FastJSONRenderer().render({'name': 'Ĉajo', 'items': [1, 2]}))
+
+        self.assertEqual(FastJSONParser().parse(body), {'name': 'Ĉajo', 'items': [1, 2]})
+
+    def test_parser_rejects_invalid_json(self):
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"name": '))
+
+
+@unittest.skipIf(msgpack is None, 'msgpack is not installed')
+class MessagePackTestCase(SimpleTestCase):
+    def test_round_trip_uses_json_representations(self):
+        body = io.BytesIO(MessagePackRenderer().render(DATA))
+
+        parsed = MessagePackParser().parse(body)
+        self.assertEqual(parsed['price'], 10.5)
+        self.assertEqual(parsed['created_at'], '2025-01-02T03:04:05.678901Z')
+
+
+class RendererNegotiationTestCase(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(email='user@test.com', password='userpass123'))
+
+    def test_json_by_default(self):
+        response = self.client.get(reverse('products-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    @unittest.skipIf(settings.API_BROWSABLE, 'the browsable API is enabled')
+    def test_browsable_api_is_off(self):
+        response = self.client.get(reverse('products-list'), HTTP_ACCEPT='text/html')
+
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+
+class ContentAddressedStorageTestCase(APITestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.product = Product.objects.create(name="Poster", price=Decimal('5.00'), description="Poster")
+        self.content = render_image((10, 20, 30))
+
+    def upload(self, name='poster.JPG'):
+        serializer = ProductImageSerializer(data={
+            'product': self.product.pk,
+            'image': SimpleUploadedFile(name, self.content, content_type='image/jpeg'),
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload()
+        second = self.upload(name='copy.jpg')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^product_images/([0-9a-f]{2})/\1[0-9a-f]{62}\.jpg$')
+        self.assertEqual(Blob.objects.get(name=first.image.name).reference_count, 2)
+
+    def test_duplicate_upload_is_not_decoded(self):
+        self.upload()
+
+        with mock.patch.object(Image, 'open', side_effect=AssertionError('decoded')):
+            image = self.upload(name='again.jpg')
+
+        self.assertTrue(content_addressed_storage().exists(image.image.name))
+
+    def test_cleanup_only_removes_orphaned_blobs(self):
+        kept = self.upload()
+        self.upload().delete()
+        self.content = render_image((200, 10, 10))
+        orphan = self.upload()
+        orphan.delete()
+        # Rows written in bulk skip the signals, the cleanup checks them anyway.
+        Blob.objects.update(reference_count=0)
+
+        self.assertEqual(remove_orphaned_blobs(grace=timedelta(0)), 1)
+
+        storage = content_addressed_storage()
+        self.assertTrue(storage.exists(kept.image.name))
+        self.assertFalse(storage.exists(orphan.image.name))
+        self.assertEqual(Blob.objects.get(name=kept.image.name).reference_count, 1)
+
+    def test_cleanup_removes_the_variants_with_the_blob(self):
+        image = self.upload()
+        generate_image_variants(image.pk)
+        image.refresh_from_db()
+        variant = image.variants['thumb']['webp']
+        storage = content_addressed_storage()
+        self.assertTrue(storage.exists(variant))
+
+        image.delete()
+        self.assertEqual(remove_orphaned_blobs(grace=timedelta(0)), 1)
+
+        self.assertFalse(storage.exists(image.image.name))
+        self.assertFalse(storage.exists(variant))
+
+    def test_saving_known_content_keeps_its_blob_from_cleanup(self):
+        name = self.upload().image.name
+        ProductImage.objects.all().delete()
+        Blob.objects.update(reference_count=0, updated_at=django_timezone.now() - timedelta(hours=2))
+
+        # A new upload of the same content, before its row is saved.
+        storage = content_addressed_storage()
+        self.assertEqual(storage.save('product_images/again.jpg', ContentFile(self.content)), name)
+
+        self.assertEqual(remove_orphaned_blobs(grace=timedelta(hours=1)), 0)
+        self.assertTrue(storage.exists(name))